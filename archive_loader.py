@@ -0,0 +1,127 @@
+import os
+import traceback
+from timeit import default_timer
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from lib.bw_archive import probe_archive
+from lib.bw_toc import ArchiveTOC, load_toc, save_toc, get_toc, iter_archive, file_digest
+from lib.catalogue import archive_digests, digests_by_name
+from lib.gzip_index import get_gzip_index, IndexedGzipFile
+
+
+# Entries are sent to the GUI when this many were found or when the last ones
+# were sent longer ago than BATCH_TIME seconds, whichever happens first.
+BATCH_SIZE = 256
+BATCH_TIME = 0.1
+
+
+# Loads the TOC of an archive in a thread and sends the entries of the archive to the GUI
+# while it reads them. If the archive has no TOC yet, it is made while the archive is read
+# and the entries are sent in the order they are in the archive, otherwise the models are
+# sent first. opened is emitted first with the game and the gzip index (None for uncompressed
+# archives), so the archive can be opened on the GUI thread before its entries are known.
+class ArchiveLoader(QThread):
+    opened = pyqtSignal(str, object)
+    entries_found = pyqtSignal(list)
+    loaded = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self._cancelled = False
+
+    # The loader stops at the next batch of entries, wait() for it to be done.
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            self.load()
+        except Exception as error:
+            traceback.print_exc()
+            if not self._cancelled:
+                self.failed.emit("{0}: {1}".format(type(error).__name__, error))
+
+    def load(self):
+        path = self.path
+        game = probe_archive(path).game
+        index = get_gzip_index(path) if path.endswith(".gz") else None
+        if self._cancelled:
+            return
+
+        toc = load_toc(path)
+        self.opened.emit(game, index)
+
+        if toc is not None:
+            entries = sorted(toc.entries, key=lambda entry: entry.name != b"LDOM")
+            if self.send_entries(entries) is None:
+                return
+        else:
+            stat = os.stat(path)
+
+            if index is not None:
+                f = IndexedGzipFile(path, index)
+            else:
+                f = open(path, "rb")
+
+            with f:
+                entries = self.send_entries(iter_archive(f))
+            if entries is None:
+                return
+
+            save_toc(ArchiveTOC(game, entries, stat.st_size, stat.st_mtime_ns, file_digest(path)), path)
+
+        self.loaded.emit()
+
+    # Send the entries in batches and return them, or None if loading was cancelled
+    def send_entries(self, entries):
+        sent = []
+        batch = []
+        last = default_timer()
+
+        for entry in entries:
+            batch.append(entry)
+
+            if len(batch) >= BATCH_SIZE or default_timer() - last > BATCH_TIME:
+                if self._cancelled:
+                    return None
+                self.entries_found.emit(batch)
+                sent.extend(batch)
+                batch = []
+                last = default_timer()
+
+        if self._cancelled:
+            return None
+        if batch:
+            self.entries_found.emit(batch)
+            sent.extend(batch)
+
+        return sent
+
+
+# Reads the TOC of an archive and hashes every resource in it in a thread, so that the viewer
+# can find out which resources changed when the archive was written again. The TOC and the
+# gzip index are made again if the archive changed. digested is emitted with the TOC, the
+# gzip index (None for uncompressed archives) and the digests_by_name of the resources.
+class ArchiveDigester(QThread):
+    digested = pyqtSignal(object, object, dict)
+    failed = pyqtSignal(str)
+
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = path
+
+    def run(self):
+        try:
+            path = self.path
+            toc = get_toc(path)
+            index = get_gzip_index(path) if path.endswith(".gz") else None
+            digests = digests_by_name(toc.entries, archive_digests(path, toc.entries))
+        except Exception as error:
+            # The archive can be in the middle of being written
+            traceback.print_exc()
+            self.failed.emit("{0}: {1}".format(type(error).__name__, error))
+        else:
+            self.digested.emit(toc, index, digests)
@@ -0,0 +1,84 @@
+# Measures the memory that the objects of an archive's resources take, apart from the data of
+# the archive itself. Run it from the repository's root with
+#     python -m benchmarks.entry_memory archive.res [archive2.res ...]
+# Every archive is opened as an eager BWArchive, a lazy BWArchive before and after every resource
+# was converted to its typed object and as a TOCArchive, and the memory allocated for that is
+# divided by the amount of section entries in the archive.
+import gc
+import os
+import sys
+import tracemalloc
+
+from lib.bw_archive import BWArchive
+from lib.bw_toc import get_toc, TOCArchive
+
+
+def count_entries(section):
+    count = 0
+    for entry in section._current_entries():
+        count += 1
+        if hasattr(entry, "entries"):
+            count += count_entries(entry)
+    return count
+
+
+def convert_all(archive):
+    for name in ("textures", "sounds", "models", "animations", "effects", "scripts"):
+        for resource in getattr(archive, name):
+            pass
+
+
+def measure(func):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def open_eager(path):
+    with open(path, "rb") as f:
+        return BWArchive(f)
+
+
+def open_lazy(path, convert=False):
+    with open(path, "rb") as f:
+        archive = BWArchive(f, lazy=True)
+    if convert:
+        convert_all(archive)
+    return archive
+
+
+def report(path):
+    filesize = os.path.getsize(path)
+    toc = get_toc(path)
+
+    archive, size = measure(lambda: open_eager(path))
+    # The eager archive holds a copy of the file, which isn't part of the overhead
+    size -= filesize
+    entries = count_entries(archive)
+    del archive
+
+    print(path)
+    print("  Section entries:", entries, " Resources:", len(toc.entries))
+    print("  {0:<28}{1:>12}{2:>16}".format("Mode", "Bytes", "Bytes/entry"))
+    print("  {0:<28}{1:>12}{2:>16.1f}".format("BWArchive", size, size/entries))
+
+    for name, func in (("BWArchive lazy", lambda: open_lazy(path)),
+                       ("BWArchive lazy, converted", lambda: open_lazy(path, True))):
+        archive, size = measure(func)
+        print("  {0:<28}{1:>12}{2:>16.1f}".format(name, size, size/entries))
+        del archive
+
+    archive, size = measure(lambda: TOCArchive(path, toc))
+    print("  {0:<28}{1:>12}{2:>16.1f}".format("TOCArchive", size, size/len(toc.entries)))
+    archive.close()
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        report(path)
@@ -0,0 +1,149 @@
+# Measures how long reading and writing the headers of an archive's resources takes. Run it from
+# the repository's root with
+#     python -m benchmarks.header_parsing archive.res [archive2.res ...]
+# The archive is read from memory as a lazy BWArchive and every resource is converted to its typed
+# object, which parses its header. Then every resource is marked as modified and the archive is
+# prepared for saving, which packs every header again. The times are the best of several runs.
+# For the texture headers, reading and writing them field by field like the classes did before
+# the header schemas is compared with their schemas.
+import io
+import struct
+import sys
+from timeit import default_timer
+
+from lib.helper import unpack_uint32
+from lib.bw_archive import BWArchive, TextureEntry, TextureEntryBW2
+
+RUNS = 10
+RESOURCE_LISTS = ("textures", "sounds", "models", "animations", "effects", "scripts")
+
+
+def get_resources(archive):
+    resources = []
+    for name in RESOURCE_LISTS:
+        for resource in getattr(archive, name):
+            if isinstance(resource, tuple):
+                resources.extend(resource)
+            else:
+                resources.append(resource)
+
+    return resources
+
+
+def parse(data):
+    archive = BWArchive(io.BytesIO(data), lazy=True)
+    start = default_timer()
+    resources = get_resources(archive)
+    return default_timer() - start, archive, resources
+
+
+def pack(archive, resources):
+    archive.prepare()
+    for resource in resources:
+        resource.mark_modified()
+    archive.rxet.mark_modified()
+
+    start = default_timer()
+    archive.prepare()
+    return default_timer() - start
+
+
+class Header(object):
+    pass
+
+
+def parse_txet_fields(header, data):
+    header.res_name = data[0x00:0x10]
+    header.width = unpack_uint32(data, 0x10)
+    header.height = unpack_uint32(data, 0x14)
+    header.unknown1 = unpack_uint32(data, 0x18)
+    header.unknown2 = unpack_uint32(data, 0x1C)
+    header.tex_type = data[0x20:0x28]
+    header.draw_type = data[0x28:0x30]
+    header.unknowns = [unpack_uint32(data, 0x30+i*4) for i in range(8)]
+    header.image_sections = unpack_uint32(data, 0x50)
+
+
+def pack_txet_fields(header, data):
+    data[0x00:0x10] = bytes(header.res_name).ljust(16, b"\x00")
+    data[0x10:0x20] = struct.pack("I"*4, header.width, header.height, header.unknown1, header.unknown2)
+    data[0x20:0x28] = bytes(header.tex_type).ljust(8, b"\x00")
+    data[0x28:0x30] = bytes(header.draw_type).ljust(8, b"\x00")
+    data[0x30:0x50] = struct.pack("I"*8, *header.unknowns)
+    data[0x50:0x54] = struct.pack("I", header.image_sections)
+
+
+def parse_dxtg_fields(header, data):
+    header.res_name = data[0x00:0x20]
+    values = [struct.unpack(">I", data[i:i+4])[0] for i in range(0x20, 0x30, 4)]
+    header.width, header.height, header.unknown1, header.unknown2 = values
+    header.tex_type = data[0x30:0x40]
+    header.unknowns = [struct.unpack(">I", data[i:i+4])[0] for i in range(0x40, 0x50, 4)]
+    header.unknown_data = data[0x50:0x60]
+    values = [struct.unpack(">I", data[i:i+4])[0] for i in range(0x60, 0x70, 4)]
+    header.mipcount, header.image_width, header.image_height, header.mipcount2 = values
+
+
+def pack_dxtg_fields(header, data):
+    data[0x00:0x20] = bytes(header.res_name).ljust(32, b"\x00")
+    data[0x20:0x30] = struct.pack(">IIII", header.width, header.height, header.unknown1, header.unknown2)
+    data[0x30:0x40] = bytes(header.tex_type).ljust(16, b"\x00")
+    data[0x40:0x50] = struct.pack(">IIII", *header.unknowns)
+    data[0x50:0x60] = bytes(header.unknown_data).ljust(16, b"\x00")
+    data[0x60:0x70] = struct.pack(">IIII", header.mipcount, header.image_width, header.image_height,
+                                  header.mipcount2)
+
+
+def best_time(func, headers):
+    times = []
+    for i in range(RUNS):
+        start = default_timer()
+        for header, data in headers:
+            func(header, data)
+        times.append(default_timer() - start)
+    return min(times)
+
+
+def report_texture_headers(archive):
+    if archive.game == "BW1":
+        schema = TextureEntry.header_schema
+        parse_fields, pack_fields = parse_txet_fields, pack_txet_fields
+    else:
+        schema = TextureEntryBW2.header_schema
+        parse_fields, pack_fields = parse_dxtg_fields, pack_dxtg_fields
+
+    headers = [(Header(), bytearray(texture.data[:schema.size])) for texture in archive.textures]
+    if not headers:
+        return
+
+    print("  Texture headers: {0}".format(len(headers)))
+    for name, parse_func, pack_func in (("Field by field", parse_fields, pack_fields),
+                                        ("Schema", schema.unpack_into, schema.pack_into)):
+        parse_time = best_time(parse_func, headers)
+        pack_time = best_time(pack_func, headers)
+        print("    {0:<16} parse {1:6.2f} us/header, pack {2:6.2f} us/header".format(
+            name, parse_time*1e6/len(headers), pack_time*1e6/len(headers)))
+
+
+def report(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    parse_times = []
+    pack_times = []
+    for i in range(RUNS):
+        parse_time, archive, resources = parse(data)
+        parse_times.append(parse_time)
+        pack_times.append(pack(archive, resources))
+
+    count = len(resources)
+    print(path)
+    print("  Resources:", count)
+    print("  Parse: {0:8.1f} ms {1:8.2f} us/resource".format(min(parse_times)*1000, min(parse_times)*1e6/count))
+    print("  Pack:  {0:8.1f} ms {1:8.2f} us/resource".format(min(pack_times)*1000, min(pack_times)*1e6/count))
+    report_texture_headers(archive)
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        report(path)
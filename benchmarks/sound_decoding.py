@@ -0,0 +1,111 @@
+# Measures how long decoding DSP-ADPCM sounds takes. Run it from the repository's root with
+#     python -m benchmarks.sound_decoding [archive.res ...]
+# Without archives a channel of 10 seconds of random ADPCM frames at 32 kHz is decoded. Every
+# channel is decoded with decode_dsp_adpcm and with a decoder that does everything per sample
+# in Python, and the results are compared. The part of decode_dsp_adpcm that is done with NumPy
+# (dsp_frame_deltas) is timed on its own. The times are the best of a few runs.
+import sys
+from timeit import default_timer
+
+from lib.bw_toc import open_archive
+from lib.sound import numpy, dsp_header, read_dsp_headers, decode_dsp_adpcm, dsp_frame_deltas, \
+    nibbles_to_samples, FRAME_SIZE, SAMPLES_PER_FRAME
+
+RUNS = 3
+SYNTHETIC_SAMPLES = 32000*10
+SYNTHETIC_COEFS = (0, 0, 2048, 0, 0, 2048, 1024, 1024, 4096, -2048, 3584, -1536, 3072, -1024, 4608, -2560)
+
+
+def decode_per_sample(data, header):
+    samples = []
+    hist1, hist2 = header.yn1, header.yn2
+
+    for i in range(header.num_samples):
+        frame, index = divmod(i, SAMPLES_PER_FRAME)
+        ps = data[frame*FRAME_SIZE]
+        byte = data[frame*FRAME_SIZE + 1 + index // 2]
+        nibble = byte >> 4 if index % 2 == 0 else byte & 0xF
+        if nibble >= 8:
+            nibble -= 16
+
+        coef1 = header.coefs[(ps >> 4)*2]
+        coef2 = header.coefs[(ps >> 4)*2 + 1]
+        sample = (coef1*hist1 + coef2*hist2 + ((nibble << (ps & 0xF)) << 11) + 1024) >> 11
+        sample = max(-32768, min(32767, sample))
+
+        samples.append(sample)
+        hist2 = hist1
+        hist1 = sample
+
+    return samples
+
+
+def best_time(func, *args):
+    times = []
+    for i in range(RUNS):
+        start = default_timer()
+        result = func(*args)
+        times.append(default_timer() - start)
+    return min(times), result
+
+
+def synthetic_channel():
+    random = numpy.random.default_rng(1)
+    frames = (SYNTHETIC_SAMPLES + SAMPLES_PER_FRAME - 1) // SAMPLES_PER_FRAME
+
+    data = random.integers(0, 256, frames*FRAME_SIZE, dtype=numpy.uint8)
+    # Predictors 0 to 7 and scales up to 2**11
+    data[::FRAME_SIZE] = random.integers(0, 8, frames)*16 + random.integers(0, 12, frames)
+
+    num_nibbles = frames*16
+    header = dsp_header.pack(nibbles_to_samples(num_nibbles), num_nibbles, 32000, 0, 0, 0, 0, 2,
+                             *SYNTHETIC_COEFS, 0, 0, 0, 0, 0, 0, 0)
+    return data.tobytes(), read_dsp_headers(bytes(0x20) + b"DHSD" + len(header).to_bytes(4, "little") + header)[0]
+
+
+def archive_channels(path):
+    archive = open_archive(path)
+    channels = []
+
+    try:
+        for header, data in archive.sounds:
+            headers = read_dsp_headers(bytes(header.data))
+            stride = len(data.data) // len(headers)
+            for i, channel_header in enumerate(headers):
+                channels.append((bytes(data.data[i*stride:(i+1)*stride]), channel_header))
+    finally:
+        archive.close()
+
+    return channels
+
+
+def report(name, channels):
+    samples = 0
+    totals = [0.0, 0.0, 0.0]
+    mismatches = 0
+
+    for data, header in channels:
+        deltas_time, result = best_time(dsp_frame_deltas, data, header)
+        numpy_time, result = best_time(decode_dsp_adpcm, data, header)
+        python_time, expected = best_time(decode_per_sample, data, header)
+        if result.tolist() != expected:
+            mismatches += 1
+
+        samples += header.num_samples
+        totals[0] += deltas_time
+        totals[1] += numpy_time
+        totals[2] += python_time
+
+    print(name)
+    print("  Channels: {0}, samples: {1}, different results: {2}".format(len(channels), samples, mismatches))
+    print("  Per sample in Python:  {0:8.1f} ms".format(totals[2]*1000))
+    print("  decode_dsp_adpcm:      {0:8.1f} ms ({1:.1f} times as fast)".format(totals[1]*1000, totals[2]/totals[1]))
+    print("    dsp_frame_deltas:    {0:8.1f} ms".format(totals[0]*1000))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            report(path, archive_channels(path))
+    else:
+        report("Synthetic sound", [synthetic_channel()])
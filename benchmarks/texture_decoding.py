@@ -0,0 +1,67 @@
+# Measures how long decoding the textures of archives takes with the NumPy decoders of
+# texture_numpy and with the loops in texture.py. Run it from the repository's root with
+#     python -m benchmarks.texture_decoding archive.res [archive2.res ...]
+# Every texture is decoded both ways and the results are compared, the times are the
+# totals per texture format of the best of a few runs.
+import sys
+from timeit import default_timer
+
+import lib.texture_numpy as texture_numpy
+from lib.bw_toc import open_archive
+from lib.bw_archive import texture_format
+from lib.texture import Texture
+
+RUNS = 3
+
+
+def decode(texture, game):
+    tex = Texture(texture.res_name)
+    tex.from_file_game(texture.fileobj, game)
+    return tex
+
+
+def best_time(texture, game):
+    times = []
+    for i in range(RUNS):
+        start = default_timer()
+        tex = decode(texture, game)
+        times.append(default_timer() - start)
+    return min(times), tex
+
+
+def report(path):
+    archive = open_archive(path)
+    numpy = texture_numpy.numpy
+    totals = {}
+    mismatches = 0
+
+    try:
+        for texture in archive.textures:
+            texformat = texture_format(texture, archive.game)
+
+            fast_time, fast = best_time(texture, archive.game)
+            texture_numpy.numpy = None
+            try:
+                loop_time, loop = best_time(texture, archive.game)
+            finally:
+                texture_numpy.numpy = numpy
+
+            if fast.success != loop.success or (fast.success and fast.rgba != loop.rgba):
+                mismatches += 1
+
+            count, fast_total, loop_total, pixels = totals.get(texformat, (0, 0.0, 0.0, 0))
+            totals[texformat] = (count + 1, fast_total + fast_time, loop_total + loop_time,
+                                 pixels + texture.width*texture.height)
+    finally:
+        archive.close()
+
+    print(path)
+    for texformat, (count, fast_total, loop_total, pixels) in sorted(totals.items()):
+        print("  {0:<10} {1:6} textures {2:10} pixels  loops {3:9.1f} ms  NumPy {4:8.1f} ms".format(
+            texformat, count, pixels, loop_total*1000, fast_total*1000))
+    print("  Different results:", mismatches)
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        report(path)
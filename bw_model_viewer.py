@@ -1,6 +1,5 @@
 print("Hello!", __name__)
 import traceback
-import gzip
 import os
 from timeit import default_timer
 
@@ -18,14 +17,22 @@ import PyQt5.QtCore as QtCore
 
 from custom_widgets import catch_exception
 from configuration import read_config, make_default_config, save_cfg
-from lib.texture import TextureArchive
+from lib.texture_gl import GLTextureArchive
 
 from bw_model_viewer_widgets import RenderWindow, catch_exception, catch_exception_with_dialog, open_error_dialog
 #from lib.model_rendering import Waterbox
 from lib.bw_archive import BWArchive
+from lib.bw_toc import ArchiveTOC, TOCArchive
+from archive_loader import ArchiveLoader, ArchiveDigester
+from lib.catalogue import changed_resources
 from lib.texture import Texture
+from lib.texture_dds import write_dds
 PIKMIN2GEN = "Resource Files (*.res)"
 
+# How often the open archive is checked for changes in watch mode, in milliseconds
+WATCH_INTERVAL = 1000
+TEXTURE_TYPES = (b"TXET", b"DXTG")
+
 
 class GenEditor(QMainWindow):
     def __init__(self):
@@ -61,11 +68,25 @@ class GenEditor(QMainWindow):
 
         self.lastshow = None
         self.modelindices = {}
+        self.loader = None
+
+        # Watch mode: the modification time of the open archive is checked regularly and if it
+        # changed, all resources are hashed in a thread and only those that changed are reloaded.
+        self.watch_timer = QtCore.QTimer(self)
+        self.watch_timer.setInterval(WATCH_INTERVAL)
+        self.watch_timer.timeout.connect(self.check_archive_changed)
+        self.digester = None
+        self.watch_mtime = None
+        self.resource_digests = None
 
     @catch_exception
     def reset(self):
+        self.stop_loading()
+        self.reset_watch()
         self.object_to_be_added = None
         self.model_list.clear()
+        if self.res_file is not None:
+            self.res_file.close()
         self.res_file = None
         self.current_coordinates = None
 
@@ -111,6 +132,8 @@ class GenEditor(QMainWindow):
         self.waterbox_renderer.setMinimumWidth(400)
         self.model_list.setMaximumWidth(200)
         self.model_list.setFocusPolicy(Qt.NoFocus)
+        # Models are added while the archive is loading, this keeps the list sorted
+        self.model_list.setSortingEnabled(True)
 
         self.horizontalLayout = QHBoxLayout(self.centralwidget)
         self.horizontalLayout.setObjectName("horizontalLayout")
@@ -142,6 +165,11 @@ class GenEditor(QMainWindow):
 
         self.file_menu.addAction(self.file_load_action)
 
+        self.watch_file_action = QAction("Reload When File Changes", self)
+        self.watch_file_action.setCheckable(True)
+        self.watch_file_action.toggled.connect(self.toggle_watch)
+        self.file_menu.addAction(self.watch_file_action)
+
 
         # Misc
         self.model_menu = QMenu(self.menubar)
@@ -160,6 +188,9 @@ class GenEditor(QMainWindow):
         self.export_tex_action = QAction("Export All Textures as PNG", self)
         self.export_tex_action.triggered.connect(self.export_all_textures)
         self.texturemenu.addAction(self.export_tex_action)
+        self.export_tex_dds_action = QAction("Export All Textures as DDS", self)
+        self.export_tex_dds_action.triggered.connect(self.export_all_textures_dds)
+        self.texturemenu.addAction(self.export_tex_dds_action)
 
         self.menubar.addAction(self.file_menu.menuAction())
         self.menubar.addAction(self.model_menu.menuAction())
@@ -231,20 +262,15 @@ class GenEditor(QMainWindow):
         game = self.res_file.game
 
         curr = 0
-        total_tex = len(self.texture_archive.textures)
+        total_tex = len(self.texture_archive.texture_indices)
         if filepath and self.texture_archive is not None:
-            for texname, texentry in self.texture_archive.textures.items():
+            for texname in self.texture_archive.texture_indices:
                 curr += 1
                 QtCore.QCoreApplication.processEvents()
+                texentry = self.texture_archive.get_texture_entry(texname)
 
                 tex = Texture(texname)
-
-                if game == "BW1":
-                    tex.from_file_bw1(texentry.fileobj)
-                elif game == "BW2":
-                    tex.from_file(texentry.fileobj)
-                elif game == "AQ":
-                    tex.from_file_aragorn(texentry.fileobj)
+                tex.from_file_game(texentry.fileobj, game)
 
                 #if isbw:
                 #    tex.from_file_bw1(texentry.fileobj)
@@ -260,6 +286,33 @@ class GenEditor(QMainWindow):
             self.statusbar.showMessage("Finished", 5000)
             self.pathsconfig["exportedModels"] = filepath
 
+    # Like export_all_textures, but as DDS with all mipmaps and without decoding DXT1 textures
+    @catch_exception_with_dialog
+    def export_all_textures_dds(self, _):
+        if self.res_file is None:
+            return
+
+        filepath = QFileDialog.getExistingDirectory(
+            self, "Open Directory",
+            self.pathsconfig["exportedModels"])
+        game = self.res_file.game
+
+        curr = 0
+        total_tex = len(self.texture_archive.texture_indices)
+        if filepath and self.texture_archive is not None:
+            for texname in self.texture_archive.texture_indices:
+                curr += 1
+                QtCore.QCoreApplication.processEvents()
+                texentry = self.texture_archive.get_texture_entry(texname)
+
+                filename = str(texname.strip(b"\x00"), encoding="ascii")+".dds"
+                write_dds(os.path.join(filepath, filename), texentry, game)
+                self.statusbar.showMessage("Extracted {0} ({1} of {2})".format(
+                    filename, curr, total_tex
+                ))
+            self.statusbar.showMessage("Finished", 5000)
+            self.pathsconfig["exportedModels"] = filepath
+
     #@catch_exception
     def button_load_level(self):
         filepath, choosentype = QFileDialog.getOpenFileName(
@@ -272,44 +325,194 @@ class GenEditor(QMainWindow):
             self.reset()
             print("Reset done")
             print("Chosen file type:", choosentype)
-            if filepath.endswith(".gz"):
-                openfunc = gzip.open
+            # The archive's table of contents is loaded (or made) in a thread. The model list
+            # and texture names are filled in as the loader finds them, resources are only read
+            # from the file once they are selected.
+            self.modelindices = {}
+            self.loader = ArchiveLoader(filepath, self)
+            self.loader.opened.connect(self.archive_opened)
+            self.loader.entries_found.connect(self.add_archive_entries)
+            self.loader.loaded.connect(self.archive_loaded)
+            self.loader.failed.connect(self.archive_failed)
+            self.loader.start()
+
+            self.set_base_window_title(filepath)
+            self.pathsconfig["resourceFiles"] = filepath
+            save_cfg(self.configuration)
+            self.current_gen_path = filepath
+            self.statusbar.showMessage("Loading...")
+
+    # Stop loading the current archive, signals that the loader already sent are ignored
+    # because they don't come from self.loader anymore.
+    def stop_loading(self):
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader.wait()
+            self.loader = None
+
+    def closeEvent(self, event):
+        self.stop_loading()
+        if self.digester is not None:
+            self.digester.wait()
+        super().closeEvent(event)
+
+    def toggle_watch(self, enabled):
+        self.reset_watch()
+        if enabled:
+            self.watch_timer.start()
+            self.check_archive_changed()
+        else:
+            self.watch_timer.stop()
+
+    # Forget the digests of the archive, they are made again for the next archive. A digester
+    # that is still running is left to finish, its result is ignored.
+    def reset_watch(self):
+        self.digester = None
+        self.watch_mtime = None
+        self.resource_digests = None
+
+    def check_archive_changed(self):
+        if self.res_file is None or self.loader is not None or self.digester is not None:
+            return
+
+        try:
+            mtime = os.stat(self.res_file.path).st_mtime_ns
+        except OSError:
+            # The file can be missing for a moment while it is replaced
+            return
+
+        # The first time the digests of the open archive are made
+        if self.watch_mtime is None or mtime != self.watch_mtime:
+            self.watch_mtime = mtime
+            self.digester = ArchiveDigester(self.res_file.path, self)
+            self.digester.digested.connect(self.archive_digested)
+            self.digester.failed.connect(self.archive_digest_failed)
+            self.digester.start()
+
+    def archive_digested(self, toc, gzip_index, digests):
+        if self.sender() is not self.digester:
+            return
+
+        self.digester = None
+        self.watch_mtime = toc.mtime
+        old_digests = self.resource_digests
+        self.resource_digests = digests
+
+        if old_digests is not None:
+            changed = changed_resources(old_digests, digests)
+            if changed:
+                self.reload_archive(toc, gzip_index, changed)
+
+    def archive_digest_failed(self, error):
+        if self.sender() is not self.digester:
+            return
+
+        # Tried again once the file is written again
+        self.digester = None
+        self.statusbar.showMessage("Couldn't reload archive: {0}".format(error), 5000)
+
+    # Switch to the new version of the archive and only throw away the textures and
+    # models that changed. changed has the type and lowercase name of those resources.
+    @catch_exception_with_dialog
+    def reload_archive(self, toc, gzip_index, changed):
+        start = default_timer()
+        old_file = self.res_file
+        self.res_file = TOCArchive(old_file.path, toc, gzip_index, mapped=False)
+        old_file.close()
+
+        # Textures are deleted from OpenGL and models get new display lists
+        self.waterbox_renderer.makeCurrent()
+        try:
+            self.texture_archive.replace_archive(
+                self.res_file, [name for restype, name in changed if restype in TEXTURE_TYPES])
+
+            # Models can have moved in the archive, the list only changes if models were added or removed
+            self.modelindices = {}
+            for i, name in enumerate(self.res_file.model_names()):
+                self.modelindices[str(name, encoding="ascii")] = i
+
+            listed = set()
+            for row in reversed(range(self.model_list.count())):
+                name = self.model_list.item(row).text()
+                if name in self.modelindices:
+                    listed.add(name)
+                else:
+                    self.model_list.takeItem(row)
+
+            for name in self.modelindices:
+                if name not in listed:
+                    self.model_list.addItem(name)
+
+            # Textures are looked up by name when the model is drawn, so the
+            # current model only has to be loaded again if it changed itself.
+            item = self.model_list.currentItem()
+            if item is not None and (b"LDOM", bytes(item.text(), encoding="ascii").lower()) in changed:
+                self.select_model()
             else:
-                openfunc = open
-
-            with openfunc(filepath, "rb") as f:
-                try:
-                    self.res_file = BWArchive(f)
-                    self.texture_archive = TextureArchive(self.res_file)
-                    self.modelindices = {}
-                    modellist = []
-                    for model in self.res_file.models:
-                        name = str(model.res_name, encoding="ascii")
-                        modellist.append(name)
-                        self.modelindices[name] = len(modellist)-1
-                    modellist.sort()
-                    for name in modellist:
-                        self.model_list.addItem(name)
-
-                    self.waterbox_renderer.texarchive = self.texture_archive
-
-
-                    print("File loaded")
-                    # self.bw_map_screen.update()
-                    # path_parts = path.split(filepath)
-                    self.set_base_window_title(filepath)
-                    self.pathsconfig["resourceFiles"] = filepath
-                    save_cfg(self.configuration)
-                    self.current_gen_path = filepath
-
-                except Exception as error:
-                    self.modelindices = {}
-                    print("Error appeared while loading:", error)
-                    traceback.print_exc()
-                    open_error_dialog(str(error), self)
+                self.waterbox_renderer.do_redraw()
+        finally:
+            self.waterbox_renderer.doneCurrent()
+
+        self.statusbar.showMessage("Reloaded {0} changed resources in {1:.2f} s".format(
+            len(changed), default_timer() - start), 5000)
+
+    def archive_opened(self, game, gzip_index):
+        if self.sender() is not self.loader:
+            return
+
+        try:
+            self.res_file = TOCArchive(self.loader.path, ArchiveTOC(game, []), gzip_index, mapped=False)
+            self.texture_archive = GLTextureArchive(self.res_file)
+            self.waterbox_renderer.texarchive = self.texture_archive
+        except Exception as error:
+            traceback.print_exc()
+            self.stop_loading()
+            self.show_loading_error(str(error))
+
+    def add_archive_entries(self, entries):
+        if self.sender() is not self.loader or self.res_file is None:
+            return
+
+        start = len(self.res_file.models)
+        self.res_file.add_entries(entries)
+
+        for i, entry in enumerate(self.res_file.models.unconverted()[start:]):
+            name = str(entry.res_name, encoding="ascii")
+            self.modelindices[name] = start + i
+            self.model_list.addItem(name)
+
+        self.texture_archive.update_texture_names()
+
+    def archive_loaded(self):
+        if self.sender() is not self.loader:
+            return
+
+        print("File loaded")
+        self.loader = None
+        self.statusbar.showMessage("Finished", 5000)
+
+        # Textures of a model that was shown before they were found are missing, show it again
+        if self.model_list.currentItem() is not None:
+            self.select_model()
+
+    def archive_failed(self, error):
+        if self.sender() is not self.loader:
+            return
+
+        self.loader = None
+        self.show_loading_error(error)
+
+    def show_loading_error(self, error):
+        self.modelindices = {}
+        print("Error appeared while loading:", error)
+        self.statusbar.clearMessage()
+        open_error_dialog(error, self)
 
     @catch_exception_with_dialog
     def select_model(self):
+        if self.model_list.currentItem() is None:
+            return
+
         item = self.model_list.currentItem().text()
         index = self.modelindices[item]
 
@@ -10,7 +10,7 @@ from OpenGL.GLU import *
 from lib.vectors import Vector3, Plane, Triangle, Line
 from custom_widgets import catch_exception
 from lib.read_binary import *
-from lib.model_rendering import Box, Transform, BW2Model, BW1Model, AragornModel
+from lib.model_rendering import Box, Transform, BW2Model, BW1Model, AragornModel, load_model
 from lib.shader import create_shader, create_shaderSimple, create_shaderNoRotate
 
 
@@ -249,26 +249,10 @@ class RenderWindow(QtWidgets.QOpenGLWidget):
 
     def create_drawlist(self, bwmodel, game):
         self.game = game
-        data = bwmodel.entries[0]
-        data.fileobj.seek(0)
-        f = data.fileobj
-
-        if game == "BW1":
-            #print("Model is BW1")
-            model = BW1Model()
-            model.bgfname = bytes(bwmodel.res_name)
-        elif game == "BW2":
-            #print("Model is BW2")
-            model = BW2Model()
-        elif game == "AQ":
-            model = AragornModel()
-        else:
-            raise RuntimeError("Unknown game: {0}".format(game))
 
         if self.main_model is not None:
             self.main_model.destroy()
-        model.from_file(f)
-        self.main_model = model
+        self.main_model = load_model(bwmodel, game)
 
     @catch_exception
     def paintGL(self):
@@ -0,0 +1,500 @@
+# Command line tool for listing and extracting the contents of archives without the viewer.
+# It only uses the parsing code in lib and doesn't need Qt or OpenGL, so it also runs on
+# machines without a display. Run it with python -m bw_tool or python bw_tool.py.
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from lib.bw_toc import get_toc, open_archive
+from lib.gzip_index import get_gzip_index
+from lib.catalogue import load_catalogue, classify_archives, find_archives, run_for_archives, format_error
+from lib.resource_store import (ResourceStore, extract_archive_file, build_archive_file, replace_resource,
+                                iter_resources)
+from lib.texture import Texture, TextureArchive
+from lib.texture_dds import write_dds
+from lib.sound import Sound
+from lib.model_rendering import load_model
+from lib.model_dependencies import TextureDependencies
+from lib.catalogue_db import CatalogueDatabase
+from lib.slim_archive import read_level_resources, slim_archive_file
+
+
+# Amount of textures or models that a worker process handles at once
+TASK_SIZE = 32
+
+KIND_ORDER = ("models", "textures", "sounds", "animations", "effects", "scripts")
+
+
+def res_name_to_str(name):
+    return str(bytes(name).strip(b"\x00"), encoding="ascii", errors="replace")
+
+
+# The directory where the files of an archive are put. When a whole directory is
+# extracted, every archive gets a directory named after its path in that directory.
+def get_output_dir(outdir, inputpath, archivepath):
+    if os.path.isfile(inputpath):
+        return outdir
+
+    relpath = os.path.relpath(archivepath, inputpath)
+    for ext in (".gz", ".res"):
+        if relpath.lower().endswith(ext):
+            relpath = relpath[:-len(ext)]
+
+    return os.path.join(outdir, relpath)
+
+
+# Run func for every set of arguments in tasks and yield the results in the same order.
+# With more than one job the tasks are run in a pool of processes.
+def run_tasks(func, tasks, jobs):
+    if jobs == 1:
+        for args in tasks:
+            yield func(*args)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(func, *args) for args in tasks]
+            for future in futures:
+                yield future.result()
+
+
+def split_tasks(items, size=TASK_SIZE):
+    return [items[i:i+size] for i in range(0, len(items), size)]
+
+
+def load(args, digests=False):
+    catalogue = load_catalogue(args.path, jobs=args.jobs, digests=digests)
+
+    for path, error in catalogue.errors.items():
+        print("Couldn't read {0}: {1}".format(path, error), file=sys.stderr)
+
+    return catalogue
+
+
+def cmd_list(args):
+    catalogue = load(args)
+    several = len(catalogue.archives) > 1
+    kinds = KIND_ORDER if args.kind is None else (args.kind, )
+
+    for kind in kinds:
+        for resource in catalogue.resources[kind]:
+            name = res_name_to_str(resource.name)
+            if several:
+                print(resource.archive, kind, name, sep="\t")
+            else:
+                print(kind, name, sep="\t")
+
+
+def cmd_info(args):
+    catalogue = load(args)
+    counts = {}
+    sizes = {}
+
+    for kind, resources in catalogue.resources.items():
+        for resource in resources:
+            key = (resource.archive, kind)
+            counts[key] = counts.get(key, 0) + 1
+            sizes[key] = sizes.get(key, 0) + resource.size
+
+    for path, game in catalogue.archives.items():
+        print(path)
+        print("  Game:", game)
+        print("  File size:", os.path.getsize(path))
+        for kind in KIND_ORDER:
+            print("  {0}: {1} ({2} bytes)".format(kind.capitalize(), counts.get((path, kind), 0),
+                                                  sizes.get((path, kind), 0)))
+
+
+def cmd_probe(args):
+    games, errors = classify_archives(args.path, jobs=args.jobs)
+
+    for path, error in errors.items():
+        print("Couldn't read {0}: {1}".format(path, error), file=sys.stderr)
+    for path, probe in games.items():
+        print(path, probe.game, probe.version, sep="\t")
+
+
+def cmd_stats(args):
+    catalogue = load(args, digests=True)
+    games = {}
+    for game in catalogue.archives.values():
+        games[game] = games.get(game, 0) + 1
+
+    print("Archives:", len(catalogue.archives), ", ".join(
+        "{0}: {1}".format(game, count) for game, count in sorted(games.items())))
+    if catalogue.errors:
+        print("Unreadable archives:", len(catalogue.errors))
+
+    print("{0:<12}{1:>10}{2:>10}{3:>16}{4:>16}".format("Kind", "Count", "Unique", "Bytes", "Unique bytes"))
+    for kind in KIND_ORDER:
+        resources = catalogue.resources[kind]
+        unique = catalogue.unique_resources(kind)
+
+        print("{0:<12}{1:>10}{2:>10}{3:>16}{4:>16}".format(
+            kind, len(resources), len(unique),
+            sum(resource.size for resource in resources), sum(resource.size for resource in unique)))
+
+
+# Make sure that the TOC (and gzip index) of an archive exists before several processes
+# read the archive, so that they don't all create them at the same time.
+def prepare_archive(path):
+    toc = get_toc(path)
+    if path.endswith(".gz"):
+        get_gzip_index(path)
+
+    return toc.game
+
+
+def prepare_archives(paths, jobs):
+    games = {}
+    for path, game in zip(paths, run_tasks(prepare_archive, [(path, ) for path in paths], jobs)):
+        games[path] = game
+    return games
+
+
+def extract_textures(path, names, outdir):
+    archive = open_archive(path)
+    errors = []
+
+    try:
+        os.makedirs(outdir, exist_ok=True)
+        for name in names:
+            try:
+                entry = archive.get_resource("cTextureResource", name)
+                tex = Texture(name)
+                tex.from_file_game(entry.fileobj, archive.game)
+
+                if tex.success:
+                    tex.dump_to_file(os.path.join(outdir, res_name_to_str(name) + ".png"))
+                else:
+                    errors.append("{0}: unsupported texture {1}".format(path, res_name_to_str(name)))
+            except Exception as error:
+                errors.append("{0}: texture {1}: {2}: {3}".format(
+                    path, res_name_to_str(name), type(error).__name__, error))
+    finally:
+        archive.close()
+
+    return len(names) - len(errors), errors
+
+
+# Like extract_textures, but as DDS files with all mipmaps. DXT1 textures aren't decoded for this.
+def extract_textures_dds(path, names, outdir):
+    archive = open_archive(path)
+    errors = []
+
+    try:
+        os.makedirs(outdir, exist_ok=True)
+        for name in names:
+            try:
+                entry = archive.get_resource("cTextureResource", name)
+                write_dds(os.path.join(outdir, res_name_to_str(name) + ".dds"), entry, archive.game)
+            except Exception as error:
+                errors.append("{0}: texture {1}: {2}: {3}".format(
+                    path, res_name_to_str(name), type(error).__name__, error))
+    finally:
+        archive.close()
+
+    return len(names) - len(errors), errors
+
+
+def extract_sounds(path, names, outdir):
+    archive = open_archive(path)
+    errors = []
+
+    try:
+        os.makedirs(outdir, exist_ok=True)
+        for name in names:
+            try:
+                header, data = archive.get_resource("sSampleResource", name)
+                sound = Sound(name)
+                sound.from_data(header.data, data.data)
+                sound.dump_to_file(os.path.join(outdir, res_name_to_str(name) + ".wav"))
+            except Exception as error:
+                errors.append("{0}: sound {1}: {2}: {3}".format(
+                    path, res_name_to_str(name), type(error).__name__, error))
+    finally:
+        archive.close()
+
+    return len(names) - len(errors), errors
+
+
+def export_models(path, names, outdir):
+    archive = open_archive(path)
+    textures = TextureArchive(archive)
+    errors = []
+
+    try:
+        for name in names:
+            try:
+                bwmodel = archive.get_resource("cNodeHierarchyResource", name)
+                # Without displaylists no OpenGL is needed
+                model = load_model(bwmodel, archive.game, displaylists=False)
+
+                folderpath = os.path.join(outdir, res_name_to_str(name))
+                os.makedirs(folderpath, exist_ok=True)
+                model.export_obj(folderpath, textures)
+            except Exception as error:
+                errors.append("{0}: model {1}: {2}: {3}".format(
+                    path, res_name_to_str(name), type(error).__name__, error))
+    finally:
+        archive.close()
+
+    return len(names) - len(errors), errors
+
+
+def run_extraction(args, func, kind):
+    catalogue = load(args)
+    paths = list(catalogue.archives.keys())
+    prepare_archives(paths, args.jobs)
+
+    tasks = []
+    for path in paths:
+        names = [resource.name for resource in catalogue.resources[kind] if resource.archive == path]
+        outdir = get_output_dir(args.outdir, args.path, path)
+
+        for chunk in split_tasks(names):
+            tasks.append((path, chunk, outdir))
+
+    done = 0
+    failed = 0
+    for count, errors in run_tasks(func, tasks, args.jobs):
+        done += count
+        failed += len(errors)
+        for error in errors:
+            print(error, file=sys.stderr)
+
+    print("Exported {0} {1}, {2} failed".format(done, kind, failed))
+    return 1 if failed > 0 else 0
+
+
+def cmd_extract_textures(args):
+    if args.dds:
+        return run_extraction(args, extract_textures_dds, "textures")
+    return run_extraction(args, extract_textures, "textures")
+
+
+def cmd_extract_sounds(args):
+    return run_extraction(args, extract_sounds, "sounds")
+
+
+def cmd_export_models(args):
+    return run_extraction(args, export_models, "models")
+
+
+def archive_dependencies(path):
+    archive = open_archive(path)
+    try:
+        return TextureDependencies.from_archive(archive)
+    finally:
+        archive.close()
+
+
+def names_to_str(names):
+    return ", ".join(res_name_to_str(name) for name in names)
+
+
+def cmd_dependencies(args):
+    paths = find_archives(args.path)
+    results = run_for_archives(paths, archive_dependencies, (), args.jobs)
+    everything = not (args.missing or args.unused)
+    failed = 0
+
+    for path in paths:
+        if isinstance(results[path], Exception):
+            print("Couldn't read {0}: {1}".format(path, format_error(results[path])), file=sys.stderr)
+            failed += 1
+            continue
+
+        dependencies = results[path]
+        print(path)
+
+        if everything:
+            for modelname, textures in dependencies.model_textures.items():
+                print("  {0}: {1}".format(res_name_to_str(modelname), names_to_str(textures)))
+            for modelname, error in dependencies.errors.items():
+                print("  {0}: couldn't be read: {1}".format(res_name_to_str(modelname), error))
+
+        if everything or args.missing:
+            for texname, models in dependencies.missing_textures.items():
+                print("  Missing texture {0}, used by {1}".format(res_name_to_str(texname), names_to_str(models)))
+
+        if everything or args.unused:
+            for texname in dependencies.unused_textures():
+                print("  Unused texture", res_name_to_str(texname))
+
+    return 1 if failed > 0 else 0
+
+
+def cmd_index(args):
+    with CatalogueDatabase(args.database) as database:
+        read = database.update(args.path, jobs=args.jobs)
+        errors = database.query("SELECT path, error FROM archives WHERE error IS NOT NULL")
+        count, = database.query("SELECT COUNT(*) FROM archives")[0]
+
+    for path, error in errors:
+        print("Couldn't read {0}: {1}".format(path, error), file=sys.stderr)
+    print("Read {0} archives, {1} archives in the catalogue".format(read, count))
+
+
+def cmd_query(args):
+    with CatalogueDatabase(args.database) as database:
+        for row in database.query(args.sql):
+            print(*row, sep="\t")
+
+
+def cmd_slim(args):
+    level_names = None
+    if args.level is not None:
+        with open(args.level, "rb") as f:
+            level_names = read_level_resources(f)
+
+    else:
+        print("Without --level only textures, effects and animations with the same name as an earlier one "
+              "are removed", file=sys.stderr)
+
+    report = slim_archive_file(args.archive, args.output, level_names)
+
+    for modelname, error in report.errors.items():
+        print("Couldn't read model {0}, no textures were removed: {1}".format(res_name_to_str(modelname), error),
+              file=sys.stderr)
+    for kind, name in report.removed:
+        print("Removed", str(kind, encoding="ascii"), res_name_to_str(name))
+
+    print("Removed {0} resources, {1} bytes instead of {2} ({3} bytes saved)".format(
+        len(report.removed), report.new_size, report.old_size, report.old_size - report.new_size))
+
+
+# Name of the manifest of an archive, the path of the archive in the directory
+# that is extracted or the name of the archive if a single archive is extracted.
+def get_manifest_name(inputpath, archivepath):
+    if os.path.isfile(inputpath):
+        return os.path.basename(archivepath)
+    else:
+        return os.path.relpath(archivepath, inputpath)
+
+
+def store_archive(path, storepath):
+    return extract_archive_file(ResourceStore(storepath), path)
+
+
+def cmd_store_extract(args):
+    store = ResourceStore(args.store)
+    paths = find_archives(args.path)
+    results = run_for_archives(paths, store_archive, (args.store, ), args.jobs)
+
+    failed = 0
+    resources = 0
+    for path in paths:
+        if isinstance(results[path], Exception):
+            print("Couldn't read {0}: {1}".format(path, format_error(results[path])), file=sys.stderr)
+            failed += 1
+        else:
+            manifest = results[path]
+            resources += sum(1 for entry in iter_resources(manifest["sections"]))
+            store.save_manifest(get_manifest_name(args.path, path), manifest)
+
+    print("Stored {0} resources of {1} archives, {2} failed".format(resources, len(paths) - failed, failed))
+    return 1 if failed > 0 else 0
+
+
+def cmd_store_rebuild(args):
+    store = ResourceStore(args.store)
+    build_archive_file(store, store.load_manifest(args.manifest), args.output)
+
+
+def cmd_store_replace(args):
+    store = ResourceStore(args.store)
+    manifest = store.load_manifest(args.manifest)
+
+    with open(args.file, "rb") as f:
+        data = f.read()
+
+    if not replace_resource(store, manifest, args.type, args.name, data):
+        print("No resource {0} {1} in {2}".format(args.type, args.name, args.manifest), file=sys.stderr)
+        return 1
+
+    store.save_manifest(args.manifest, manifest)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="bw_tool", description="List and extract the contents of BW1/BW2/AQ archives (.res/.res.gz)")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--jobs", "-j", type=int, default=None,
+                        help="Amount of processes to use, by default one per core")
+
+    def add_command(name, func, helptext, output=False):
+        subparser = subparsers.add_parser(name, help=helptext, parents=[common])
+        subparser.add_argument("path", help="Archive or directory with archives")
+        if output:
+            subparser.add_argument("outdir", help="Output directory")
+        subparser.set_defaults(func=func)
+        return subparser
+
+    list_parser = add_command("list", cmd_list, "List the resources of archives")
+    list_parser.add_argument("--kind", choices=KIND_ORDER, help="Only list resources of this kind")
+    add_command("info", cmd_info, "Show the game and the amount of resources of archives")
+    dependencies_parser = add_command("dependencies", cmd_dependencies,
+                                      "Show the textures of every model, textures that are missing and unused textures")
+    dependencies_parser.add_argument("--missing", action="store_true", help="Only show missing textures")
+    dependencies_parser.add_argument("--unused", action="store_true", help="Only show unused textures")
+    add_command("probe", cmd_probe, "Show the game of archives, only their first few hundred bytes are read")
+    add_command("stats", cmd_stats, "Show statistics for all archives, including duplicated resources")
+    extract_textures_parser = add_command("extract-textures", cmd_extract_textures,
+                                          "Export the textures of archives as PNG", output=True)
+    extract_textures_parser.add_argument("--dds", action="store_true",
+                                         help="Export as DDS with all mipmaps, DXT1 textures stay compressed")
+    add_command("extract-sounds", cmd_extract_sounds, "Export the sounds of archives as WAV", output=True)
+    add_command("export-models", cmd_export_models, "Export the models of archives as OBJ", output=True)
+
+    slim_parser = subparsers.add_parser(
+        "slim", help="Write a copy of an archive without unused textures, effects and animations "
+                     "and without textures, effects and animations that have the same name as another one")
+    slim_parser.add_argument("archive", help="Archive to slim")
+    slim_parser.add_argument("output", help="Slimmed archive, compressed with gzip if it ends with .gz")
+    slim_parser.add_argument("--level", help="XML file of the level that uses the archive, without it "
+                                             "all textures, effects and animations are kept")
+    slim_parser.set_defaults(func=cmd_slim, jobs=None)
+
+    index_parser = add_command("index", cmd_index,
+                               "Add archives to a catalogue database or update the archives that changed")
+    index_parser.add_argument("database", help="SQLite database file, created if it doesn't exist")
+
+    query_parser = subparsers.add_parser("query", help="Run an SQL query on a catalogue database")
+    query_parser.add_argument("database", help="SQLite database file made by the index command")
+    query_parser.add_argument("sql", help="The query, e.g. \"SELECT path FROM archives\"")
+    query_parser.set_defaults(func=cmd_query, jobs=None)
+
+    store_parser = subparsers.add_parser(
+        "store-extract", parents=[common],
+        help="Put the resources of archives into a content addressed store, with a manifest for every archive")
+    store_parser.add_argument("path", help="Archive or directory with archives")
+    store_parser.add_argument("store", help="Directory of the store")
+    store_parser.set_defaults(func=cmd_store_extract)
+
+    rebuild_parser = subparsers.add_parser("store-rebuild", help="Build an archive from its manifest in a store")
+    rebuild_parser.add_argument("store", help="Directory of the store")
+    rebuild_parser.add_argument("manifest", help="Name of the manifest in the store or path of a .json manifest")
+    rebuild_parser.add_argument("output", help="Archive to write, compressed with gzip if it ends with .gz")
+    rebuild_parser.set_defaults(func=cmd_store_rebuild, jobs=None)
+
+    replace_parser = subparsers.add_parser(
+        "store-replace", help="Replace the data of a resource in a manifest with the content of a file")
+    replace_parser.add_argument("store", help="Directory of the store")
+    replace_parser.add_argument("manifest", help="Name of the manifest in the store or path of a .json manifest")
+    replace_parser.add_argument("type", help="Section type of the resource, e.g. LDOM or DXTG")
+    replace_parser.add_argument("name", help="Name of the resource")
+    replace_parser.add_argument("file", help="File with the new data of the resource's section")
+    replace_parser.set_defaults(func=cmd_store_replace, jobs=None)
+
+    args = parser.parse_args(argv)
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs has to be at least 1")
+
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
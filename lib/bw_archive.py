@@ -1,97 +1,104 @@
 
+import gzip
 import io
 import struct
+from collections import namedtuple
 
 
-from .helper import unpack_uint32
-from .bw_archive_base import BWArchiveBase, BWSection, BWResource
+from .helper import unpack_uint32, read_uint32
+from .bw_archive_base import BWArchiveBase, BWSection, BWResource, BufferReader, LazyEntryList, section_header
+from .header_schema import HeaderSchema, unpack_prefixed_name, pack_prefixed_name
 
 
 
+# Header of the texture, sound and sound count sections that only contain the amount of entries
+count_schema = HeaderSchema([("count", "I")])
+
+
 class ArchiveHeader(BWSection):
+    encoded_attributes = ("filename",)
+    __slots__ = encoded_attributes
+
     def __init__(self, name, size, memview):
         assert name == b"RXET"
-        strlength = unpack_uint32(memview, offset=0)
-        offset = 4 + strlength
+        filename, offset = unpack_prefixed_name(memview)
 
         super().__init__(name, size, memview, section_offset=offset)
 
-        self.filename = self._header[4:4+strlength]
-
-    def pack(self):
-        # If the filename changed size, we have to resize the header
-        if len(self.filename) != len(self._header) - 4:
-            data = io.BytesIO()
-            data.write(struct.pack("I", len(self.filename)))
-            data.write(self.filename)
-            self._header = data.getvalue()
+        self.filename = filename
 
-            data.close()
-        else:
+    def prepare(self):
+        if self.modified:
+            # If the filename changed size, we have to resize the header
+            if len(self.filename) != len(self._header) - 4:
+                self._header = pack_prefixed_name(self.filename)
+            else:
+                self._header[4:4+len(self.filename)] = self.filename
 
-            self._header[4:4+len(self.filename)] = self.filename
+            self.modified = False
 
-        return super().pack()
+        return super().prepare()
 
 
 class TextureSection(BWSection):
+    header_schema = count_schema
+    __slots__ = ("count",)
+
     def __init__(self, name, size, memview):
         assert name == b"FTBX"
-        super().__init__(name, size, memview, section_offset=4)
+        super().__init__(name, size, memview, section_offset=self.header_schema.size)
 
-    def pack(self):
-        texture_count = len(self.entries)
+        self.header_schema.unpack_into(self, self._header)
 
-        self._header[0:4] = struct.pack("I", texture_count)
+    def prepare(self):
+        self.count = len(self.entries)
+        self.header_schema.pack_into(self, self._header)
 
-        return super().pack()
+        return super().prepare()
 
 
 class TextureSectionBW2(BWSection):
+    header_schema = count_schema
+    __slots__ = ("count",)
+
     def __init__(self, name, size, memview):
         assert name == b"FTBG"
-        super().__init__(name, size, memview, section_offset=4)
+        super().__init__(name, size, memview, section_offset=self.header_schema.size)
 
-    def pack(self):
-        texture_count = len(self.entries)
+        self.header_schema.unpack_into(self, self._header)
 
-        self._header[0:4] = struct.pack("I", texture_count)
+    def prepare(self):
+        self.count = len(self.entries)
+        self.header_schema.pack_into(self, self._header)
 
-        return super().pack()
+        return super().prepare()
 
 
 class TextureEntry(BWSection):
+    encoded_attributes = ("res_name", "width", "height", "unknown1", "unknown2", "tex_type", "draw_type",
+                          "unknowns")
+    __slots__ = encoded_attributes + ("image_sections",)
+
+    header_schema = HeaderSchema([
+        ("res_name", "16s"),
+        ("width", "I"),
+        ("height", "I"),
+        ("unknown1", "I"),
+        ("unknown2", "I"),
+        ("tex_type", "8s"),
+        ("draw_type", "8s"),  # draw type is usually A8R8G8B8 in BW1
+        ("unknowns", "8I"),
+        ("image_sections", "I")
+    ])
+
     def __init__(self, name, size, memview):
         assert name == b"TXET"
 
-        super().__init__(name, size, memview, section_offset=0x54)
-
-        self.res_name = self._header[0x00:0x10]
-        self.width = unpack_uint32(self._header, 0x10)
-        self.height = unpack_uint32(self._header, 0x14)
-
-        self.unknown1 = unpack_uint32(self._header, 0x18)
-        self.unknown2 = unpack_uint32(self._header, 0x1C)
-
-        self.tex_type = self._header[0x20:0x28]
-        self.draw_type = self._header[0x28:0x30] # draw type is usually A8R8G8B8 in BW1
-
-        self.unknowns = [unpack_uint32(self._header, 0x30+i*4) for i in range(8)]
-
-    def pack(self):
-        #print(bytes(self.res_name))
-        self._header[0x00:0x10] = bytes(self.res_name).ljust(16, b"\x00")
+        super().__init__(name, size, memview, section_offset=self.header_schema.size)
 
-        self._header[0x10:0x20] = struct.pack(
-            "I"*4, self.width, self.height, self.unknown1, self.unknown2
-        )
-
-        self._header[0x20:0x28] = bytes(self.tex_type).ljust(8, b"\x00")
-        self._header[0x28:0x30] = bytes(self.draw_type).ljust(8, b"\x00")
-
-        self._header[0x30:0x50] = struct.pack("I"*8, *self.unknowns)
-        #print(self.image_sections, len(self.entries), bytes(self.tex_type), bytes(self.draw_type))
+        self.header_schema.unpack_into(self, self._header)
 
+    def prepare(self):
         # P8 is a image format with a palette, so the amount of image entries is the amount of entries minus 1
         # due to one of the entries being the palette data (LAP), which doesn't count as an image.
         if self.tex_type == b"P8" + b"\x00"*6:
@@ -99,148 +106,193 @@ class TextureEntry(BWSection):
         else:
             image_sections = len(self.entries)
 
-        self._header[0x50:0x54] = struct.pack("I", image_sections)
-        return super().pack()
+        if self.modified or image_sections != self.image_sections:
+            self.image_sections = image_sections
+            self.header_schema.pack_into(self, self._header)
+            self.modified = False
+
+        return super().prepare()
 
     def get_format(self):
         return bytes(self.tex_type).rstrip(b"\x00")
 
 
 class TextureEntryBW2(BWResource):
+    encoded_attributes = ("res_name", "width", "height", "unknown1", "unknown2", "tex_type", "unknowns",
+                          "unknown_data", "mipcount", "image_width", "image_height", "mipcount2")
+    __slots__ = encoded_attributes
+
+    # The texture data follows the header, in BW2 and AQ alike. Unlike the
+    # BW1 texture header, the values are big endian.
+    header_schema = HeaderSchema([
+        ("res_name", "32s"),
+        ("width", "I"),
+        ("height", "I"),
+        ("unknown1", "I"),
+        ("unknown2", "I"),
+        ("tex_type", "16s"),
+        ("unknowns", "4I"),
+        ("unknown_data", "16s"),
+        ("mipcount", "I"),
+        ("image_width", "I"),
+        ("image_height", "I"),
+        ("mipcount2", "I")
+    ], byteorder=">")
+
     def __init__(self, name, size, memview):
         assert name == b"DXTG"
 
-        super().__init__(name, size, memview)#, section_offset=0x54)
+        super().__init__(name, size, memview)
 
-        self.res_name = self.data[0:0x20]#self._header[0:0x16]
+        self.header_schema.unpack_into(self, self._data)
 
-    """def pack(self):
-        data = io.BytesIO()
-        data.write(struct.pack("I", len(self.res_name)))
-        data.write(self.res_name)
-        data.write(self.image_data)
-        self._header = data.getvalue()
+    def prepare(self):
+        if self.modified:
+            self.header_schema.pack_into(self, self._data)
+            self.modified = False
 
-        data.close()
+        return super().prepare()
+
+
+# Name of the format of a texture as the viewer calls it, e.g. P8 or DXT1. BW2 and
+# AQ store the name reversed and padded at the start, BW1 padded at the end.
+def texture_format(texture, game):
+    if game == "BW1":
+        tex_type = bytes(texture.tex_type)
+    else:
+        tex_type = bytes(texture.tex_type)[:8][::-1]
+
+    return str(tex_type.rstrip(b"\x00"), encoding="ascii", errors="replace")
+
+
+def texture_mipcount(texture, game):
+    if game == "BW1":
+        return texture.image_sections
+    elif game == "AQ":
+        return texture.mipcount2
+    else:
+        return texture.mipcount
 
-        return super().pack()
-"""
 
 class SoundSection(BWSection):
+    encoded_attributes = ("filename",)
+    __slots__ = encoded_attributes
+
     def __init__(self, name, size, memview):
         assert name == b"DNOS"
-        strlength = unpack_uint32(memview, offset=0)
-        offset = 4 + strlength
+        filename, offset = unpack_prefixed_name(memview)
 
         super().__init__(name, size, memview, section_offset=offset)
 
-        self.filename = self._header[4:4+strlength]
-
-    def pack(self):
-        # If the filename changed size, we have to resize the header
-        if len(self.filename) != len(self._header) - 4:
-            data = io.BytesIO()
-            data.write(struct.pack("I", len(self.filename)))
-            data.write(self.filename)
-            self._header = data.getvalue()
+        self.filename = filename
 
-            data.close()
-        else:
-
-            self._header[4:4+len(self.filename)] = self.filename
+    def prepare(self):
+        if self.modified:
+            # If the filename changed size, we have to resize the header
+            if len(self.filename) != len(self._header) - 4:
+                self._header = pack_prefixed_name(self.filename)
+            else:
+                self._header[4:4+len(self.filename)] = self.filename
 
+            self.modified = False
 
-        return super().pack()
+        return super().prepare()
 
 
 class SoundCount(BWSection):
+    header_schema = count_schema
+    __slots__ = ("count",)
+
     def __init__(self, name, size, memview):
         assert name == b"HFSB"
-        super().__init__(name, size, memview, section_offset=4)
+        super().__init__(name, size, memview, section_offset=self.header_schema.size)
 
-        self.count = unpack_uint32(self._header, 0x00)
+        self.header_schema.unpack_into(self, self._header)
 
-    def pack(self):
-        self._header[0x00:0x04] = struct.pack("I", self.count)
+    def prepare(self):
+        self.header_schema.pack_into(self, self._header)
 
-        return super().pack()
+        return super().prepare()
 
 
 class SoundName(BWSection):
+    encoded_attributes = ("res_name",)
+    __slots__ = encoded_attributes
+
+    header_schema = HeaderSchema([("res_name", "32s")])
+
     def __init__(self, name, size, memview):
         assert name == b"HPSD"
-        super().__init__(name, size, memview, section_offset=0x20)
+        super().__init__(name, size, memview, section_offset=self.header_schema.size)
 
-        self.res_name = self._header[0:0x20]
+        self.header_schema.unpack_into(self, self._header)
 
-    def pack(self):
-        self._header[0:0x20] = self.res_name
+    def prepare(self):
+        if self.modified:
+            self.header_schema.pack_into(self, self._header)
+            self.modified = False
 
-        return super().pack()
+        return super().prepare()
 
 
 class ParticleEntry(BWResource):
+    encoded_attributes = ("res_name", "particle_data")
+    __slots__ = encoded_attributes
+
     def __init__(self, name, size, memview):
         assert name == b"FEQT"
         super().__init__(name, size, memview)
 
-        strlength = unpack_uint32(self._data, 0)
-        self.res_name = self._data[4:4+strlength]
-        self.particle_data = self._data[4+strlength:]
+        self.res_name, offset = unpack_prefixed_name(self._data)
+        self.particle_data = self._data[offset:]
 
-    def pack(self):
-        self._fileobj = io.BytesIO()
-        self._fileobj.write(struct.pack("I", len(self.res_name)))
-        self._fileobj.write(self.res_name)
-        self._fileobj.write(self.particle_data)
+    def prepare(self):
+        if self.modified:
+            self.data = b"".join((pack_prefixed_name(self.res_name), self.particle_data))
+            self.modified = False
 
-        self._data = self._fileobj.getbuffer()
-
-        return super().pack()
+        return super().prepare()
 
 
 class AnimationEntry(BWResource):
+    encoded_attributes = ("res_name", "animation_data")
+    __slots__ = encoded_attributes
+
     def __init__(self, name, size, memview):
         assert name == b"MINA"
         super().__init__(name, size, memview)
 
-        strlength = unpack_uint32(self._data, 0)
-        self.res_name = self._data[4:4+strlength]
-        self.animation_data = self._data[4+strlength:]
-
-        #print(bytes(self.animation_name))
+        self.res_name, offset = unpack_prefixed_name(self._data)
+        self.animation_data = self._data[offset:]
 
-    def pack(self):
-        self._fileobj = io.BytesIO()
-        self._fileobj.write(struct.pack("I", len(self.res_name)))
-        self._fileobj.write(self.res_name)
-        self._fileobj.write(self.animation_data)
+    def prepare(self):
+        if self.modified:
+            self.data = b"".join((pack_prefixed_name(self.res_name), self.animation_data))
+            self.modified = False
 
-        self._data = self._fileobj.getbuffer()
-
-        return super().pack()
+        return super().prepare()
 
 
 class ModelSection(BWSection):
+    encoded_attributes = ("res_name",)
+    __slots__ = encoded_attributes
+
     def __init__(self, name, size, memview):
         assert name == b"LDOM"
-        strlength = unpack_uint32(memview, 0)
-        super().__init__(name, size, memview, section_offset=4+strlength)
+        res_name, offset = unpack_prefixed_name(memview)
+        super().__init__(name, size, memview, section_offset=offset)
 
         assert self.entries[0].name == b"LDOM" and len(self.entries) == 1
         #self.entries[0] = self.modeldata = self.entries[0].as_section(cls=ModelSubsection)
 
-        self.res_name = self._header[4:4+strlength]
+        self.res_name = res_name
 
-    def pack(self):
-        newheader = io.BytesIO()
-        newheader.write(struct.pack("I", len(self.res_name)))
-        newheader.write(self.res_name)
+    def prepare(self):
+        if self.modified:
+            self._header = pack_prefixed_name(self.res_name)
+            self.modified = False
 
-        self._header = newheader.getvalue()
-        newheader.close()
-
-        return super().pack()
+        return super().prepare()
 
 """
 class ModelSubsection(BWSection):
@@ -250,29 +302,222 @@ class ModelSubsection(BWSection):
 """
 
 class ScriptEntry(BWResource):
+    encoded_attributes = ("res_name", "script_data")
+    __slots__ = encoded_attributes
+
     def __init__(self, name, size, memview):
         super().__init__(name, size, memview)
-        strlength = unpack_uint32(self._data, 0)
-        self.res_name = self._data[4:4+strlength]
-        self.script_data = self._data[4+strlength:]
 
-    def pack(self):
-        self._fileobj = io.BytesIO()
-        self._fileobj.write(struct.pack("I", len(self.res_name)))
-        self._fileobj.write(self.res_name)
-        self._fileobj.write(self.script_data)
+        self.res_name, offset = unpack_prefixed_name(self._data)
+        self.script_data = self._data[offset:]
 
-        self._data = self._fileobj.getbuffer()
+    def prepare(self):
+        if self.modified:
+            self.data = b"".join((pack_prefixed_name(self.res_name), self.script_data))
+            self.modified = False
 
-        return super().pack()
+        return super().prepare()
 
 
-class BWArchive(BWArchiveBase):
-    def __init__(self, f):
-        super().__init__(f)
+# Typed classes for the resources at the top level of an archive
+TOP_LEVEL_RESOURCES = {
+    b"FEQT": ParticleEntry,
+    b"MINA": AnimationEntry,
+    b"LDOM": ModelSection,
+    b"PRCS": ScriptEntry
+}
 
-        is_bw1 = True
+# Typed classes for every kind of resource, including the textures and sounds
+# that are nested in the RXET and DNOS sections.
+RESOURCE_CLASSES = dict(TOP_LEVEL_RESOURCES)
+RESOURCE_CLASSES[b"TXET"] = TextureEntry
+RESOURCE_CLASSES[b"DXTG"] = TextureEntryBW2
+RESOURCE_CLASSES[b"HPSD"] = SoundName
+
+# Length of the fixed size name at the start of textures and sound headers,
+# the other resources start with a length-prefixed name.
+RESOURCE_NAME_LENGTHS = {
+    b"TXET": 0x10,
+    b"DXTG": 0x20,
+    b"HPSD": 0x20
+}
+
+
+# Read the name of a resource from f, which has to be at the start of the resource's data.
+def read_res_name(f, name):
+    if name in RESOURCE_NAME_LENGTHS:
+        return f.read(RESOURCE_NAME_LENGTHS[name])
+    elif name in TOP_LEVEL_RESOURCES:
+        strlength = read_uint32(f)
+        return f.read(strlength)
+    else:
+        return b""
+
+
+# Get the name of a resource without converting it into its typed object.
+def get_res_name(entry):
+    return read_res_name(BufferReader(entry.data), entry.name)
+
+
+# Names are compared without the null padding and case-insensitively.
+def normalize_res_name(name):
+    if isinstance(name, str):
+        name = bytes(name, encoding="ascii")
+    return bytes(name).strip(b"\x00").upper()
+
+
+# The resource types used by levels to refer to resources of an archive and
+# the archive attribute with the list of those resources.
+RESOURCE_TYPES = {
+    "sSampleResource": "sounds",
+    "cTequilaEffectResource": "effects",
+    "cNodeHierarchyResource": "models",
+    "cTextureResource": "textures"
+}
+
+
+# Size of the header of a DXTG texture, the texture data follows it
+DXTG_HEADER_SIZE = 0x70
+
+# game is "BW1", "BW2" or "AQ", version is the format of the texture entries:
+# "TXET" for BW1, "DXTG" for BW2 and "DXTG/RPIM" for Aragorn's Quest.
+GameProbe = namedtuple("GameProbe", ["game", "version"])
+
+
+def _probe_read(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise RuntimeError("Unexpected end of archive")
+    return data
+
+
+def _probe_section(f):
+    return section_header.unpack(_probe_read(f, section_header.size))
+
+
+# Find out which game an archive is from by reading the archive's first few hundred bytes: the RXET
+# header, the FTBX/FTBG tag and the header of the first DXTG texture. BW2 and AQ textures only differ
+# in the tag of the image data (" PIM" or "RPIM"), which comes after the header and the palette, if the
+# texture has one. f has to be at the start of the archive and is left somewhere after the texture header.
+def probe_game(f):
+    name, size = _probe_section(f)
+    if name != b"RXET":
+        raise RuntimeError("Not an archive, starts with {0}".format(name))
+
+    strlength = struct.unpack("I", _probe_read(f, 4))[0]
+    f.seek(strlength, io.SEEK_CUR)
+
+    ftbname, ftbsize = _probe_section(f)
+    texture_count = struct.unpack("I", _probe_read(f, 4))[0]
+
+    if ftbname == b"FTBX":
+        return GameProbe("BW1", "TXET")
+    elif ftbname != b"FTBG":
+        raise RuntimeError("Unknown texture section {0}".format(ftbname))
+    elif texture_count == 0:
+        # Without textures BW2 and AQ can't be told apart
+        return GameProbe("BW2", "DXTG")
+
+    texname, texsize = _probe_section(f)
+    assert texname == b"DXTG"
+    f.seek(DXTG_HEADER_SIZE, io.SEEK_CUR)
+
+    tag, tagsize = _probe_section(f)
+    if tag == b" LAP":
+        f.seek(tagsize, io.SEEK_CUR)
+        tag, tagsize = _probe_section(f)
+
+    if tag == b"RPIM":
+        return GameProbe("AQ", "DXTG/RPIM")
+    elif tag == b" PIM":
+        return GameProbe("BW2", "DXTG")
+    else:
+        raise RuntimeError("Unknown texture data {0}".format(tag))
+
+
+def probe_archive(path):
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            return probe_game(f)
+    else:
+        with open(path, "rb") as f:
+            return probe_game(f)
+
+
+class ResourceLookup(object):
+    # Lookup of resources by name through one dictionary of normalized names per resource type.
+    # Classes using this need the resource lists from RESOURCE_TYPES, _convert, _convert_sound
+    # and _unconverted like BWArchive has.
+    def _build_resource_index(self):
+        self._resource_index = {}
+        for restype in RESOURCE_TYPES:
+            self._index_resources(restype)
+
+    def _index_resources(self, restype):
+        self._resource_index[restype] = {}
+
+        for resource in self._unconverted(getattr(self, RESOURCE_TYPES[restype])):
+            self._add_to_index(restype, resource)
+
+    def _add_to_index(self, restype, resource):
+        index = self._resource_index[restype]
+        name = self._indexed_name(resource)
+        # If several resources have the same name the first one is found, like before
+        if name not in index:
+            index[name] = resource
+
+    def _indexed_name(self, resource):
+        if isinstance(resource, tuple) and len(resource) == 2:
+            resource = resource[0]  # Sounds are (name, data) pairs
+
+        if hasattr(resource, "res_name"):
+            return normalize_res_name(resource.res_name)
+        else:
+            return normalize_res_name(get_res_name(resource))
+
+    def _check_restype(self, restype):
+        if restype not in RESOURCE_TYPES:
+            raise RuntimeError("Unknown resoure type: {0}".format(restype))
+
+    # Sounds are returned as (name, data) pairs, None is returned if there's no such resource.
+    def get_resource(self, restype, name):
+        self._check_restype(restype)
+
+        resource = self._resource_index[restype].get(normalize_res_name(name))
+        if resource is None:
+            return None
+        elif restype == "sSampleResource":
+            return self._convert_sound(resource)
+        else:
+            return self._convert(resource)
 
+    # Look up many resources of one type at once. Returns a list with the resource
+    # (or None) for every name in the same order as names.
+    def get_resources(self, restype, names):
+        self._check_restype(restype)
+
+        index = self._resource_index[restype]
+        convert = self._convert_sound if restype == "sSampleResource" else self._convert
+
+        resources = []
+        for name in names:
+            resource = index.get(normalize_res_name(name))
+            resources.append(None if resource is None else convert(resource))
+
+        return resources
+
+
+class BWArchive(BWArchiveBase, ResourceLookup):
+    # With lazy set to True, only the section headers are read when the archive is opened
+    # and every texture, sound, model, animation, effect and script is turned into its typed
+    # object when it is accessed for the first time. Archives opened from a file on disk are
+    # memory mapped in that case.
+    def __init__(self, f, lazy=False):
+        super().__init__(f, use_mmap=lazy and isinstance(f, (io.BufferedReader, io.FileIO)))
+
+        is_bw1 = True
+        self.lazy = lazy
+        self._converted = {}
 
         # Unpack RXET into an object containing other resources
         assert self.entries[0].name == b"RXET"
@@ -287,13 +532,8 @@ class BWArchive(BWArchiveBase):
         else:
             self.rxet.entries[0] = self.ftb = self.rxet.entries[0].as_section(cls=TextureSectionBW2)
 
-        for i in range(len(self.ftb.entries)):
-            if is_bw1:
-                self.ftb.entries[i] = self.ftb.entries[i].as_section(cls=TextureEntry)
-            else:
-                self.ftb.entries[i] = self.ftb.entries[i].as_section(cls=TextureEntryBW2)
-            #else:
-            #    raise RuntimeError("Unknown image entry name:", self.ftb.entries[i].name)
+        for entry in self.ftb.entries:
+            assert entry.name == (b"TXET" if is_bw1 else b"DXTG")
 
         assert self.entries[1].name == b"DNOS"
         self.entries[1] = self.dnos = self.entries[1].as_section(cls=SoundSection)
@@ -306,30 +546,83 @@ class BWArchive(BWArchiveBase):
 
             if self.dnos.entries[i].name == b"HPSD":
                 assert self.dnos.entries[i+1].name == b"DPSD"
-                self.dnos.entries[i] = self.dnos.entries[i].as_section(cls=SoundName)
 
-        for i, entry in enumerate(self.entries):
-            if entry.name == b"FEQT":
-                self.entries[i] = self.entries[i].as_section(cls=ParticleEntry)
-            elif entry.name == b"MINA":
-                self.entries[i] = self.entries[i].as_section(cls=AnimationEntry)
-            elif entry.name == b"LDOM":
-                self.entries[i] = self.entries[i].as_section(cls=ModelSection)
-            elif entry.name == b"PRCS":
-                self.entries[i] = self.entries[i].as_section(cls=ScriptEntry)
-
-        self.sounds = [(self.dnos.entries[i], self.dnos.entries[i+1]) for i in range(1, len(self.dnos.entries), 2)]
-        self.models = [x for x in filter(lambda k: k.name == b"LDOM", self.entries)]
-        self.animations = [x for x in filter(lambda k: k.name == b"MINA", self.entries)]
-        self.effects = [x for x in filter(lambda k: k.name == b"FEQT", self.entries)]
-        self.scripts = [x for x in filter(lambda k: k.name == b"PRCS", self.entries)]
-        self.textures = [x for x in self.ftb.entries]
+        if lazy:
+            self.ftb.entries = LazyEntryList(self.ftb.entries, self._convert, self._converted)
+            self.dnos.entries = LazyEntryList(self.dnos.entries, self._convert, self._converted)
+            self.entries = LazyEntryList(self.entries, self._convert, self._converted)
+        else:
+            for i in range(len(self.ftb.entries)):
+                self.ftb.entries[i] = self._convert(self.ftb.entries[i])
+            for i in range(1, len(self.dnos.entries)):
+                self.dnos.entries[i] = self._convert(self.dnos.entries[i])
+            for i in range(len(self.entries)):
+                self.entries[i] = self._convert(self.entries[i])
+
+        self._build_resource_lists()
         self.game = self.get_game()
         """for nameentry, dataentry in self.models:
             print(bytes(nameentry.modelname))
         print(self.dnos.entries[0].count)
         print((len(self.dnos.entries)-1)/2.0)"""
 
+    def _build_resource_lists(self):
+        entries = self._unconverted(self.entries)
+        sounds = self._unconverted(self.dnos.entries)
+
+        self.sounds = self._resource_list([(sounds[i], sounds[i+1]) for i in range(1, len(sounds), 2)],
+                                          self._convert_sound)
+        self.models = self._resource_list(filter(lambda k: k.name == b"LDOM", entries))
+        self.animations = self._resource_list(filter(lambda k: k.name == b"MINA", entries))
+        self.effects = self._resource_list(filter(lambda k: k.name == b"FEQT", entries))
+        self.scripts = self._resource_list(filter(lambda k: k.name == b"PRCS", entries))
+        self.textures = self._resource_list(self._unconverted(self.ftb.entries))
+
+        self._build_resource_index()
+
+    # Turn a raw entry into an object of its typed class. Entries that are already typed
+    # or don't have a typed class are returned as they are.
+    def _convert(self, entry):
+        if type(entry) is not BWResource:
+            return entry
+
+        if entry in self._converted:
+            return self._converted[entry]
+
+        cls = RESOURCE_CLASSES.get(entry.name)
+        if cls is None:
+            return entry
+
+        converted = entry.as_section(cls=cls)
+        if self.lazy:
+            self._converted[entry] = converted
+
+        return converted
+
+    def _convert_sound(self, sound):
+        name, data = sound
+        return self._convert(name), data
+
+    # In lazy mode the resource lists hold unconverted entries and share
+    # the conversions with the entry lists of the sections.
+    def _resource_list(self, entries, convert=None):
+        if self.lazy:
+            return LazyEntryList(entries, convert if convert is not None else self._convert, self._converted)
+        else:
+            return [x for x in entries]
+
+    def _unconverted(self, entries):
+        if self.lazy:
+            return entries.unconverted()
+        else:
+            return entries
+
+    def model_names(self):
+        return [get_res_name(x) for x in self._unconverted(self.models)]
+
+    def texture_names(self):
+        return [get_res_name(x) for x in self._unconverted(self.textures)]
+
     """def add_model(self, model):
         found = False
         end = False
@@ -346,57 +639,118 @@ class BWArchive(BWArchiveBase):
             raise RuntimeError("Malformed res archive?")
         #self.entries.append(model)"""
 
-    # All resources have
-    def get_resource(self, restype, name):
-        name = name.upper()
+    # Add a resource to the archive, for sSampleResource the resource is a (name, data) pair
+    # of a HPSD and a DPSD entry. Models and effects are put after the last resource of the
+    # same kind in the archive.
+    def add_resource(self, restype, resource):
+        self._check_restype(restype)
+
         if restype == "sSampleResource":
-            reslist = self.sounds
+            self.dnos.entries.extend(resource)
+        elif restype == "cTextureResource":
+            self.ftb.entries.append(resource)
+        else:
+            name = b"LDOM" if restype == "cNodeHierarchyResource" else b"FEQT"
+            entries = self._unconverted(self.entries)
+            position = len(entries)
+
+            for i in range(len(entries)-1, -1, -1):
+                if entries[i].name == name:
+                    position = i+1
+                    break
+
+            self.entries.insert(position, resource)
+
+        getattr(self, RESOURCE_TYPES[restype]).append(resource)
+
+        name = self._indexed_name(resource)
+        index = self._resource_index[restype]
+        if name not in index:
+            index[name] = resource
+
+    # Remove a resource from the archive and return it, None is returned if there is no
+    # resource with that name.
+    def remove_resource(self, restype, name):
+        self._check_restype(restype)
 
-            for res, res_data in reslist:
-                if bytes(res.res_name).strip(b"\x00").upper() == name:
-                    return res, res_data
+        indexed = self._resource_index[restype].get(normalize_res_name(name))
+        if indexed is None:
             return None
 
-        elif restype == "cTequilaEffectResource":
-            reslist = self.effects
-        elif restype == "cNodeHierarchyResource":
-            reslist = self.models
-        elif restype == "cTextureResource":
-            reslist = self.textures
+        resource = self.get_resource(restype, name)
+
+        if restype == "sSampleResource":
+            self._remove_entry(self.dnos.entries, indexed[0], resource[0])
+            self._remove_entry(self.dnos.entries, indexed[1], resource[1])
+            self._remove_entry(self.sounds, indexed[0], resource[0])
         else:
-            raise RuntimeError("Unknown resoure type: {0}".format(restype))
+            if restype == "cTextureResource":
+                self._remove_entry(self.ftb.entries, indexed, resource)
+            else:
+                self._remove_entry(self.entries, indexed, resource)
+            self._remove_entry(getattr(self, RESOURCE_TYPES[restype]), indexed, resource)
+
+        # Another resource with the same name might be found now
+        self._index_resources(restype)
 
-        for i, res in enumerate(reslist):
-            #print(bytes(res.res_name).strip(b"\x00").upper(), name,bytes(res.res_name).strip(b"\x00").upper() == name)
-            #if hasattr(res, "res_name"):
-                #print("Comparing:", bytes(res.res_name).strip(b"\x00").upper(), name)
-            if hasattr(res, "res_name") and bytes(res.res_name).strip(b"\x00").upper() == name:
-                print("found", name, "at position", i)
-                return res
+        return resource
 
-        return None
+    # Remove every resource for which keep(kind, name) is False in one pass over the archive,
+    # with kind the section name of the resource (e.g. b"LDOM", b"HPSD" for sounds) and name its
+    # normalized name. keep is called in the order of the archive. Returns the kind and name of
+    # every removed resource. Unlike remove_resource the resource lists and the index are only
+    # made again once, so many resources can be removed at once.
+    def remove_resources(self, keep):
+        removed = []
 
-    def pack(self):
+        def filter_entries(entries, start, step):
+            items = self._unconverted(entries)
+            kept = items[:start]
+
+            for i in range(start, len(items), step):
+                kind = items[i].name
+                name = self._indexed_name(items[i])
+
+                if kind not in RESOURCE_CLASSES or keep(kind, name):
+                    kept.extend(items[i:i+step])
+                else:
+                    removed.append((kind, name))
+
+            if self.lazy:
+                return LazyEntryList(kept, self._convert, self._converted)
+            else:
+                return kept
+
+        self.ftb.entries = filter_entries(self.ftb.entries, 0, 1)
+        # A sound is the HPSD entry with its name and the DPSD entry with the data after it
+        self.dnos.entries = filter_entries(self.dnos.entries, 1, 2)
+        self.entries = filter_entries(self.entries, 0, 1)
+
+        self._build_resource_lists()
+        return removed
+
+    # Remove an entry from a resource list by identity. In lazy mode
+    # the list might hold the unconverted or the converted entry.
+    def _remove_entry(self, entries, unconverted, converted):
+        items = self._unconverted(entries)
+
+        for i, item in enumerate(items):
+            if isinstance(item, tuple):
+                item = item[0]
+
+            if item is unconverted or item is converted:
+                del entries[i]
+                return
+
+    def prepare(self):
         # Adjust the amount of models in case models were taken away or added.
         # Every model has a HPSD entry and a DPSD entry in the DNOS section.
         self.hfsb.count = (len(self.dnos.entries) - 1) // 2
 
-        return super().pack()
+        return super().prepare()
 
     def get_game(self):
-        result = None
-        if self.ftb.entries[0].name != b"DXTG":
-            result = "BW1"
-        else:
-            print(self.textures[0])
-            print(bytes(self.textures[0].data))
-
-            if b"RPIM" in bytes(self.textures[0].data):
-                result = "AQ"
-            else:
-                result = "BW2"
-        print("HELLOOOO", result)
-        return result
+        return probe_game(BufferReader(self._data)).game
 
 
     def is_bw2(self):
@@ -407,15 +761,15 @@ class BWArchive(BWArchiveBase):
 
 
 class BW1Archive(BWArchive):
-    def __init__(self, f):
-        super().__init__(f)
+    def __init__(self, f, lazy=False):
+        super().__init__(f, lazy)
 
         assert self.is_bw() is True
 
 
 class BW2Archive(BWArchive):
-    def __init__(self, f):
-        super().__init__(f)
+    def __init__(self, f, lazy=False):
+        super().__init__(f, lazy)
 
         assert self.is_bw() is True
 
@@ -1,19 +1,122 @@
 import io
+import mmap
 import struct
 from array import array
 
 from .helper import read_uint32, write_uint32
 
 
+section_header = struct.Struct("4sI")
+
+READ_CHUNK_SIZE = 4*1024*1024
+
+
+class BufferReader(object):
+    # Seekable file object for reading a buffer. Unlike io.BytesIO the buffer
+    # isn't copied, only the bytes that are read are.
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer)
+        self._pos = 0
+        self.closed = False
+
+    def read(self, size=-1):
+        start = self._pos
+        if size is None or size < 0:
+            end = len(self._buffer)
+        else:
+            end = max(start, min(start + size, len(self._buffer)))
+
+        self._pos = end
+        return self._buffer[start:end].tobytes()
+
+    # Same as read, but returns a memoryview of the buffer instead of a copy.
+    def read_view(self, size):
+        start = self._pos
+        end = max(start, min(start + size, len(self._buffer)))
+
+        self._pos = end
+        return self._buffer[start:end]
+
+    # Read and unpack the values of a struct.Struct at the current position.
+    def unpack(self, struct_obj):
+        values = struct_obj.unpack_from(self._buffer, self._pos)
+        self._pos += struct_obj.size
+        return values
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._buffer) + offset
+        else:
+            raise ValueError("Invalid whence: {0}".format(whence))
+
+        if self._pos < 0:
+            raise ValueError("Negative seek position {0}".format(self._pos))
+
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def getbuffer(self):
+        return self._buffer
+
+    def getvalue(self):
+        return self._buffer.tobytes()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+def _set_encoded_attribute(self, name, value):
+    # Only changes after the attribute was set the first time count
+    if name in self.encoded_attributes and hasattr(self, name):
+        object.__setattr__(self, "modified", True)
+    object.__setattr__(self, name, value)
+
+
 class BWResource(object):
+    # Attributes of typed resources that are encoded into the data when the archive is saved.
+    # Assigning to one of them marks the resource as modified, if they are changed in place
+    # (e.g. a list) mark_modified() has to be called.
+    encoded_attributes = ()
+
+    # Archives can have tens of thousands of resources, with __slots__ they don't need a
+    # dictionary each. Subclasses list their own attributes in __slots__ as well.
+    __slots__ = ("name", "_size", "_data", "_source", "modified", "_fileobj", "_packed_size")
+
     def __init__(self, name, size, memview):
         self.name = name
         self._size = size
         self._data = memview
-        self._fileobj = io.BytesIO(self._data)
+        self._source = memview  # The data as it was read from the archive
+        self.modified = False
+        # The file object is only created when it is needed so that resources
+        # which are never looked at don't hold a copy of their data.
+        self._fileobj = None
+
+    # Checking every assignment is slow, so only classes with encoded attributes do it
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.encoded_attributes:
+            cls.__setattr__ = _set_encoded_attribute
+
+    def mark_modified(self):
+        self.modified = True
 
     @property
     def fileobj(self):
+        if self._fileobj is None:
+            self._fileobj = BufferReader(self._data)
         return self._fileobj
 
     # File object and data object should be kept up to date together when
@@ -32,20 +135,38 @@ class BWResource(object):
 
     @data.setter
     def data(self, data):
-        self._fileobj.close()
+        if self._fileobj is not None:
+            self._fileobj.close()
 
         self._data = data
-        self._fileobj = io.BytesIO(self._data)
+        self._fileobj = None
     
     def write(self, file):
-        name, length, data = self.pack()
-        
-        file.write(name)
-        write_uint32(file, length)
-        file.write(data)
-    
+        size = self.prepare()
+
+        file.write(section_header.pack(self.name, size))
+        self.write_data(file)
+
+    # Saving works in two passes: prepare() brings the data up to date and returns the size
+    # of the packed data, which is known for every section before anything is written. Then
+    # write_data() writes the headers and the data of the entries straight to the file.
+    # Classes that need to update their header or data before saving override prepare()
+    # and should only encode their attributes again if the resource was modified.
+    def prepare(self):
+        self._packed_size = len(self._data)
+        return self._packed_size
+
+    # True if the packed data is the data from the archive, at the same place in it.
+    # Changes made in place to the data don't matter, they are part of the source.
+    def is_verbatim(self):
+        return self._data is self._source
+
+    def write_data(self, file):
+        file.write(self._data)
+
     def pack(self):
         #data = self.fileobj.read()
+        self.prepare()
         data = self._data#self.fileobj.getbuffer()
         #print(self.name, len(data))
         return self.name, len(data), data
@@ -59,77 +180,171 @@ class BWResource(object):
             return cls(self.name, self._size, self._data)
             
 class BWResourceFromData(BWResource):
+    __slots__ = ()
+
     def __init__(self, name, data):
         self.name = name 
+        self._source = None
+        self.modified = False
         self._fileobj = None
-        self.fileobj = data # data should be BytesIO
+        self.fileobj = data # data should be BytesIO or BufferReader
 
 class BWSection(BWResource):
+    __slots__ = ("entries", "_header", "_source_header", "_source_entries", "_verbatim", "_packed_entries")
+
     def __init__(self, name, size, memview, section_offset=0):
         super().__init__(name, size, memview)
 
         self.entries = []
         self._header = self._data[0:section_offset]
-        self._fileobj.seek(section_offset)
 
-        while self._fileobj.tell() < self._size:
-            name, size, entry_memview = read_section(self._fileobj, memview)
+        reader = BufferReader(memview)
+        reader.seek(section_offset)
+
+        while reader.tell() < self._size:
+            name, size, entry_memview = read_section(reader)
             res_obj = BWResource(name, size, entry_memview)
 
             self.entries.append(res_obj)
 
-    def pack(self):
-        packed = io.BytesIO()
+        # Remember the layout of the section to tell if it has changed when saving
+        self._source_header = self._header
+        self._source_entries = [entry._data for entry in self.entries]
 
-        packed.write(self._header)
+    # The entries as they are now. Entries of a LazyEntryList that weren't accessed aren't
+    # converted, they can't have been modified.
+    def _current_entries(self):
+        if isinstance(self.entries, LazyEntryList):
+            return self.entries.current()
+        else:
+            return self.entries
 
+    def prepare(self):
+        entries = self._current_entries()
         section_size = len(self._header)
+        verbatim = (self._data is self._source and self._header is self._source_header
+                    and len(entries) == len(self._source_entries))
 
-        for entry in self.entries:
-            name, size, data = entry.pack()
+        for i, entry in enumerate(entries):
+            # 4 bytes for the ID, 4 bytes for the length, and the rest is from the data
+            section_size += 4 + 4 + entry.prepare()
 
-            packed.write(name)
-            assert size == len(data)
-            packed.write(struct.pack("I", size))
+            if verbatim and (entry._data is not self._source_entries[i] or not entry.is_verbatim()):
+                verbatim = False
 
-            packed.write(data)
+        # If nothing but the data in place has changed, the whole section
+        # can be written as one piece of the source.
+        self._verbatim = verbatim
+        self._packed_entries = entries
+        self._packed_size = section_size
+        return section_size
 
-            # 4 bytes for the ID, 4 bytes for the length, and the rest is from the data
-            section_size += 4 + 4 + len(data)
+    def is_verbatim(self):
+        return self._verbatim
+
+    # prepare() has to be called before this so that the sizes of the entries are known.
+    def write_data(self, file):
+        if self._verbatim:
+            file.write(self._data)
+            return
+
+        file.write(self._header)
+
+        for entry in self._packed_entries:
+            file.write(section_header.pack(entry.name, entry._packed_size))
+            entry.write_data(file)
 
+    def pack(self):
+        section_size = self.prepare()
+
+        packed = io.BytesIO()
+        self.write_data(packed)
         packed_data = packed.getvalue()
         packed.close()
 
+        assert section_size == len(packed_data)
         return self.name, section_size, packed_data
 
     def as_section(self, offset=0, cls=None):
         return self
 
 
+class LazyEntryList(list):
+    # A list of raw resources that are turned into their typed objects by
+    # convert() the first time they are accessed. The converted object replaces
+    # the raw one in the list, convert() has to return the same object for the
+    # same raw resource if several lists share resources. converted is the dictionary
+    # of raw resources and their conversions that convert() keeps, if it keeps one.
+    def __init__(self, entries, convert, converted=None):
+        super().__init__(entries)
+        self._convert = convert
+        self._converted = converted if converted is not None else {}
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        entry = list.__getitem__(self, index)
+        converted = self._convert(entry)
+        if converted is not entry:
+            list.__setitem__(self, index, converted)
+
+        return converted
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # Get an entry without converting it
+    def peek(self, index):
+        return list.__getitem__(self, index)
+
+    def unconverted(self):
+        return list.copy(self)
+
+    # The entries with the conversions that were made so far, without converting any others.
+    def current(self):
+        converted = self._converted
+        return [converted.get(entry, entry) for entry in list.__iter__(self)]
+
+
 class BWArchiveBase(BWSection):
     # f should be a file open in binary mode
-    def __init__(self, f):
-        # We read the content of the file into memory and put it in a bytearray,
-        # which is necessary so the content can be modified.
-        file_content = bytearray(f.read())
+    def __init__(self, f, use_mmap=False):
+        if use_mmap:
+            # Map the file copy-on-write instead of reading it. Only the pages
+            # that are touched are loaded and changes made by the pack() hooks
+            # never reach the file on disk.
+            file_content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        else:
+            # We read the content of the file into memory and put it in a bytearray,
+            # which is necessary so the content can be modified. Reading it in chunks
+            # avoids holding the whole file twice while doing so.
+            file_content = bytearray()
+            chunk = f.read(READ_CHUNK_SIZE)
+            while chunk:
+                file_content += chunk
+                chunk = f.read(READ_CHUNK_SIZE)
         #file_content = array("B", f.read())
 
 
         super().__init__(name=None, size=len(file_content), memview=file_content)
 
     def write(self, f):
-        unused, size, data = self.pack()
-        f.write(data)
+        self.prepare()
+        self.write_data(f)
+
 
 
+# f should be a BufferReader, the returned data is a memoryview
+# of the reader's buffer.
+# Every entry of a kind has the same name, only one bytes object is kept for each name
+_section_names = {}
 
-def read_section(f, memview):
-    name = f.read(4)
-    size = read_uint32(f)
 
-    offset = f.tell()
-    data = memoryview(memview[offset:(offset+size)])#f.read(data_len)
-    f.seek(size, io.SEEK_CUR)
+def read_section(f):
+    name, size = f.unpack(section_header)
+    name = _section_names.setdefault(name, name)
+    data = f.read_view(size)
 
-    #print(len(memview), len(f.getbuffer()))
     return name, size, data
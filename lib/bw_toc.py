@@ -0,0 +1,396 @@
+import gzip
+import hashlib
+import io
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+from .helper import read_uint32, get_sidecar_paths
+from .gzip_index import open_indexed_gzip, get_gzip_index
+from .bw_archive_base import BWResource, LazyEntryList
+from .bw_archive import RESOURCE_CLASSES, ResourceLookup, read_res_name, probe_game
+
+
+# A table of contents (TOC) lists every resource of an archive with its offset and size in the
+# uncompressed archive, so that the resources can be listed and read without parsing the archive.
+# It is stored in a small binary file next to the archive or in the user's cache directory.
+TOC_MAGIC = b"BWTC"
+TOC_VERSION = 1
+TOC_EXTENSION = ".toc"
+
+# magic, version, file size, file mtime in ns, file digest, game, entry count
+toc_header = struct.Struct("<4sIQQ16s4sI")
+# resource type, offset, size, name length
+toc_entry = struct.Struct("<4sQIH")
+
+HASH_CHUNK_SIZE = 1024*1024
+
+# name is the resource type (e.g. b"LDOM") like the name of a BWResource, res_name is the name of
+# the resource as stored in the archive and offset is the offset of the resource's data.
+TOCEntry = namedtuple("TOCEntry", ["name", "res_name", "offset", "size"])
+
+
+class ArchiveTOC(object):
+    def __init__(self, game, entries, filesize=0, mtime=0, digest=b""):
+        self.game = game
+        self.entries = entries
+
+        # Identify the archive file the TOC was made for
+        self.filesize = filesize
+        self.mtime = mtime
+        self.digest = digest
+
+    @classmethod
+    def from_file(cls, path):
+        stat = os.stat(path)
+
+        with open_archive_file(path) as f:
+            game, entries = scan_archive(f)
+
+        return cls(game, entries, stat.st_size, stat.st_mtime_ns, file_digest(path))
+
+    @classmethod
+    def read(cls, f):
+        magic, version, filesize, mtime, digest, game, count = toc_header.unpack(f.read(toc_header.size))
+        if magic != TOC_MAGIC or version != TOC_VERSION:
+            raise RuntimeError("Not a supported TOC file")
+
+        entries = []
+        for i in range(count):
+            name, offset, size, namelength = toc_entry.unpack(f.read(toc_entry.size))
+            entries.append(TOCEntry(name, f.read(namelength), offset, size))
+
+        return cls(str(game.rstrip(b"\x00"), encoding="ascii"), entries, filesize, mtime, digest)
+
+    def write(self, f):
+        f.write(toc_header.pack(TOC_MAGIC, TOC_VERSION, self.filesize, self.mtime, self.digest,
+                                bytes(self.game, encoding="ascii"), len(self.entries)))
+
+        for entry in self.entries:
+            f.write(toc_entry.pack(entry.name, entry.offset, entry.size, len(entry.res_name)))
+            f.write(entry.res_name)
+
+    # Check if the TOC still describes the archive at path. The file's content is only
+    # hashed if the size matches but the modification time has changed.
+    def matches(self, path):
+        stat = os.stat(path)
+        if stat.st_size != self.filesize:
+            return False
+        if stat.st_mtime_ns == self.mtime:
+            return True
+
+        if file_digest(path) == self.digest:
+            self.mtime = stat.st_mtime_ns
+            return True
+        else:
+            return False
+
+    def get_entries(self, *names):
+        return [entry for entry in self.entries if entry.name in names]
+
+
+def open_archive_file(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    else:
+        return open(path, "rb")
+
+
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+
+    with open(path, "rb") as f:
+        chunk = f.read(HASH_CHUNK_SIZE)
+        while chunk:
+            digest.update(chunk)
+            chunk = f.read(HASH_CHUNK_SIZE)
+
+    return digest.digest()
+
+
+def _read_section_header(f):
+    name = f.read(4)
+    size = read_uint32(f)
+    return name, size, f.tell()
+
+
+# Walk through the section headers of an archive and collect the textures, sounds, models,
+# animations, effects and scripts. Only the headers and names are read and apart from going
+# back to the start after finding out the game, f is only read forward, so this also works
+# on a gzip file without having to decompress it twice.
+def scan_archive(f):
+    game = probe_game(f).game
+    f.seek(0)
+
+    return game, list(iter_archive(f))
+
+
+# Yields the entries of scan_archive one by one while reading through the archive from
+# the current position of f, so they can be used before the whole archive was read.
+def iter_archive(f):
+    header = f.read(4)
+    while len(header) == 4:
+        name = header
+        size = read_uint32(f)
+        start = f.tell()
+        end = start + size
+
+        if name == b"RXET":
+            strlength = read_uint32(f)
+            f.seek(strlength, io.SEEK_CUR)
+
+            ftbname, ftbsize, ftbstart = _read_section_header(f)
+            assert ftbname in (b"FTBX", b"FTBG")
+            texture_count = read_uint32(f)
+
+            for i in range(texture_count):
+                texname, texsize, texstart = _read_section_header(f)
+                res_name = read_res_name(f, texname)
+                f.seek(texstart + texsize)
+
+                yield TOCEntry(texname, res_name, texstart, texsize)
+
+        elif name == b"DNOS":
+            strlength = read_uint32(f)
+            f.seek(strlength, io.SEEK_CUR)
+            res_name = b""
+
+            while f.tell() < end:
+                subname, subsize, substart = _read_section_header(f)
+
+                if subname == b"HPSD":
+                    res_name = read_res_name(f, subname)
+                if subname in (b"HPSD", b"DPSD"):
+                    # Sound data has the name of the sound header before it
+                    yield TOCEntry(subname, res_name, substart, subsize)
+
+                f.seek(substart + subsize)
+
+        else:
+            res_name = read_res_name(f, name)
+            yield TOCEntry(name, res_name, start, size)
+
+        f.seek(end)
+        header = f.read(4)
+
+
+def get_toc_paths(path):
+    return get_sidecar_paths(path, TOC_EXTENSION)
+
+
+# Returns the stored TOC of the archive at path or None if there is
+# no TOC or it is out of date.
+def load_toc(path):
+    for tocpath in get_toc_paths(path):
+        try:
+            with open(tocpath, "rb") as f:
+                toc = ArchiveTOC.read(f)
+        except (OSError, RuntimeError, struct.error):
+            continue
+
+        mtime = toc.mtime
+        if toc.matches(path):
+            if toc.mtime != mtime:
+                # The file was touched without being changed, remember the new time
+                # so it doesn't have to be hashed again next time.
+                try:
+                    with open(tocpath, "wb") as f:
+                        toc.write(f)
+                except OSError:
+                    pass
+
+            return toc
+
+    return None
+
+
+def save_toc(toc, path):
+    for tocpath in get_toc_paths(path):
+        try:
+            os.makedirs(os.path.dirname(tocpath), exist_ok=True)
+            with open(tocpath, "wb") as f:
+                toc.write(f)
+            return tocpath
+        except OSError:
+            continue
+
+    return None
+
+
+# The TOC of the archive at path. A TOC that has to be made is saved for the next time,
+# unless save is False (e.g. for archives that nothing should be written next to).
+def get_toc(path, save=True):
+    toc = load_toc(path)
+
+    if toc is None:
+        toc = ArchiveTOC.from_file(path)
+        if save:
+            save_toc(toc, path)
+
+    return toc
+
+
+# The lists of TOCArchive that the entries are put in and the resource types of the
+# entries that can be looked up by name. Sounds are handled separately.
+TOC_LISTS = {
+    b"TXET": "textures",
+    b"DXTG": "textures",
+    b"LDOM": "models",
+    b"MINA": "animations",
+    b"FEQT": "effects",
+    b"PRCS": "scripts"
+}
+
+TOC_RESOURCE_TYPES = {
+    b"TXET": "cTextureResource",
+    b"DXTG": "cTextureResource",
+    b"LDOM": "cNodeHierarchyResource",
+    b"FEQT": "cTequilaEffectResource"
+}
+
+
+class TOCArchive(ResourceLookup):
+    # Read-only archive that lists its resources from a TOC. The resources are turned into
+    # their typed objects like in a lazy BWArchive, but are only read from the archive file
+    # when they are accessed. More entries can be added with add_entries while the archive
+    # is in use, e.g. when the TOC is still being made. gzip_index is the index of a gzip
+    # compressed archive if it was already loaded.
+    #
+    # With mapped, an uncompressed archive is memory mapped and resources are views of the
+    # mapping. Archives that other programs can write while they are open (like in the viewer's
+    # watch mode) shouldn't be mapped: the file is then only opened to read a resource and the
+    # data of every resource is copied, so the file can be replaced at any time.
+    def __init__(self, path, toc, gzip_index=None, mapped=True):
+        self.path = path
+        self.toc = toc
+        self.game = toc.game
+        self.lazy = True
+        self._converted = {}
+        self._gzip_index = gzip_index
+
+        self._file = None
+        self._mmap = None
+        self._buffer = None
+        if mapped and path.endswith(".gz"):
+            # With the gzip index only the part of the archive before a resource
+            # that comes after the closest checkpoint has to be decompressed.
+            self._file = open_indexed_gzip(path, gzip_index)
+        elif mapped:
+            with open(path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            self._buffer = memoryview(self._mmap)
+
+        self.textures = LazyEntryList([], self._convert)
+        self.sounds = LazyEntryList([], self._convert_sound)
+        self.models = LazyEntryList([], self._convert)
+        self.animations = LazyEntryList([], self._convert)
+        self.effects = LazyEntryList([], self._convert)
+        self.scripts = LazyEntryList([], self._convert)
+
+        self._build_resource_index()
+        self._sound_name = None
+        self._add_entries(toc.entries)
+
+    # Add entries that aren't in the TOC yet. A sound is added once its data entry was
+    # added, which can be in a later call than its name entry.
+    def add_entries(self, entries):
+        self.toc.entries.extend(entries)
+        self._add_entries(entries)
+
+    def _add_entries(self, entries):
+        for entry in entries:
+            if entry.name == b"HPSD":
+                self._sound_name = entry
+            elif entry.name == b"DPSD":
+                sound = (self._sound_name, entry)
+                self.sounds.append(sound)
+                self._add_to_index("sSampleResource", sound)
+            elif entry.name in TOC_LISTS:
+                getattr(self, TOC_LISTS[entry.name]).append(entry)
+
+                restype = TOC_RESOURCE_TYPES.get(entry.name)
+                if restype is not None:
+                    self._add_to_index(restype, entry)
+
+    def _open_file(self):
+        if self.path.endswith(".gz"):
+            return open_indexed_gzip(self.path, self._gzip_index)
+        else:
+            return open(self.path, "rb")
+
+    def read_data(self, entry):
+        if self._buffer is not None:
+            return self._buffer[entry.offset:entry.offset+entry.size]
+
+        if self._file is not None:
+            self._file.seek(entry.offset)
+            data = self._file.read(entry.size)
+        else:
+            with self._open_file() as f:
+                f.seek(entry.offset)
+                data = f.read(entry.size)
+
+        if len(data) < entry.size:
+            raise RuntimeError("Archive is shorter than its table of contents, it was changed")
+        return memoryview(bytearray(data))
+
+    def _convert(self, entry):
+        if not isinstance(entry, TOCEntry):
+            return entry
+
+        if entry in self._converted:
+            return self._converted[entry]
+
+        cls = RESOURCE_CLASSES.get(entry.name, BWResource)
+        converted = cls(entry.name, entry.size, self.read_data(entry))
+        self._converted[entry] = converted
+
+        return converted
+
+    def _convert_sound(self, sound):
+        name, data = sound
+        return self._convert(name), self._convert(data)
+
+    def _unconverted(self, entries):
+        return entries.unconverted()
+
+    def model_names(self):
+        return [entry.res_name for entry in self.models.unconverted()]
+
+    def texture_names(self):
+        return [entry.res_name for entry in self.textures.unconverted()]
+
+    def get_game(self):
+        return self.game
+
+    # The mapping of the archive is closed once no resource read from it is in use anymore
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        self._converted = {}
+        if self._buffer is not None:
+            self._buffer.release()
+            self._buffer = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+
+
+# Open an archive for reading through its TOC, the TOC is created if it doesn't exist yet or is
+# out of date. With save set to False the TOC and the index of a gzip compressed archive aren't
+# saved, so nothing is written next to the archive or to the cache directory.
+def open_archive(path, save=True):
+    gzip_index = None
+    if not save and path.endswith(".gz"):
+        try:
+            gzip_index = get_gzip_index(path, save=False)
+        except (RuntimeError, OSError) as error:
+            print("Couldn't index gzip file, reading it without index:", error)
+
+    return TOCArchive(path, get_toc(path, save), gzip_index)
@@ -0,0 +1,268 @@
+import hashlib
+import mmap
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .helper import unpack_uint32
+from .bw_toc import get_toc, open_archive_file, scan_archive
+from .bw_archive import RESOURCE_NAME_LENGTHS, normalize_res_name, probe_archive
+
+
+ARCHIVE_EXTENSIONS = (".res", ".res.gz")
+
+# The kinds of resources in the catalogue and the sections they are stored in. Sounds are
+# listed by their HPSD header, the DPSD entry with the sound data comes right after it.
+RESOURCE_KINDS = {
+    b"LDOM": "models",
+    b"TXET": "textures",
+    b"DXTG": "textures",
+    b"HPSD": "sounds",
+    b"MINA": "animations",
+    b"FEQT": "effects",
+    b"PRCS": "scripts"
+}
+
+DIGEST_SIZE = 16
+
+# archive is the path of the archive the resource is from, offset and size are those of the
+# resource's data in the uncompressed archive. digest is the hash of the resource's content
+# if the catalogue was loaded with digests, otherwise it is None.
+CatalogueEntry = namedtuple("CatalogueEntry", ["archive", "kind", "name", "offset", "size", "digest"])
+
+
+class Catalogue(object):
+    def __init__(self):
+        self.archives = {}  # Path of every archive and the game it is from
+        self.errors = {}  # Path of every archive that couldn't be read and the error
+        self.resources = {kind: [] for kind in set(RESOURCE_KINDS.values())}
+        self._index = {}
+        self._digests = {}
+
+    # digests is None or has the digest of every entry.
+    def add_archive(self, path, game, entries, digests=None):
+        self.archives[path] = game
+
+        for i, entry in enumerate(entries):
+            kind = RESOURCE_KINDS.get(entry.name)
+            if kind is None:
+                continue
+
+            digest = None if digests is None else digests[i]
+            resource = CatalogueEntry(path, kind, bytes(entry.res_name).rstrip(b"\x00"),
+                                      entry.offset, entry.size, digest)
+            self.resources[kind].append(resource)
+            self._index.setdefault((kind, normalize_res_name(resource.name)), []).append(resource)
+
+            if digest is not None:
+                self._digests.setdefault((kind, digest), []).append(resource)
+
+    # Every resource of a kind with that name, from all archives.
+    def find(self, kind, name):
+        return list(self._index.get((kind, normalize_res_name(name)), []))
+
+    # One resource for every distinct content of a kind, the first one in the catalogue.
+    # Resources with the same content are the same even if their names differ.
+    # Needs a catalogue loaded with digests.
+    def unique_resources(self, kind):
+        unique = []
+        seen = set()
+
+        for resource in self.resources[kind]:
+            if resource.digest is None:
+                raise RuntimeError("The catalogue was loaded without digests")
+
+            if resource.digest not in seen:
+                seen.add(resource.digest)
+                unique.append(resource)
+
+        return unique
+
+    # Every resource in all archives with the same content as resource,
+    # including resource itself.
+    def get_copies(self, resource):
+        if resource.digest is None:
+            raise RuntimeError("The catalogue was loaded without digests")
+
+        return list(self._digests[(resource.kind, resource.digest)])
+
+    def __len__(self):
+        return sum(len(resources) for resources in self.resources.values())
+
+
+# The archives in directory and its subdirectories. If directory is
+# the path of an archive, that archive is returned.
+def find_archives(directory):
+    if os.path.isfile(directory):
+        return [directory]
+
+    paths = []
+
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.lower().endswith(ARCHIVE_EXTENSIONS):
+                paths.append(os.path.join(dirpath, filename))
+
+    paths.sort()
+    return paths
+
+
+# Hash of the content of a resource, which is the data without the resource's name
+# so that the same resource stored under different names has the same digest.
+# A sound's content is its header and its sound data.
+def resource_digest(name, data, sound_data=None):
+    if name in RESOURCE_NAME_LENGTHS:
+        start = RESOURCE_NAME_LENGTHS[name]
+    else:
+        start = 4 + unpack_uint32(data, 0)
+
+    digest = hashlib.blake2b(name, digest_size=DIGEST_SIZE)
+    digest.update(data[start:])
+    if sound_data is not None:
+        digest.update(sound_data)
+
+    return digest.digest()
+
+
+# Digests of the entries of an archive, the DPSD entries get None because their data is
+# part of the digest of the HPSD entry before them. Uncompressed archives are memory mapped
+# and hashed without copying, gzip compressed archives are read from start to end once.
+# The mapping is closed before returning, so the archive can be written again right away.
+def archive_digests(path, entries):
+    with open_archive_file(path) as f:
+        if path.endswith(".gz"):
+            def read_data(entry):
+                f.seek(entry.offset)
+                return f.read(entry.size)
+
+            return _entry_digests(entries, read_data)
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping, memoryview(mapping) as buffer:
+            def read_data(entry):
+                return buffer[entry.offset:entry.offset+entry.size]
+
+            # Every slice of the buffer is only used inside of this call
+            return _entry_digests(entries, read_data)
+
+
+def _entry_digests(entries, read_data):
+    digests = [None]*len(entries)
+    order = sorted(range(len(entries)), key=lambda i: entries[i].offset)
+    sound_header = None
+
+    for i in order:
+        entry = entries[i]
+        if entry.name == b"HPSD":
+            sound_header = (i, bytes(read_data(entry)))
+        elif entry.name == b"DPSD":
+            if sound_header is not None:
+                index, data = sound_header
+                digests[index] = resource_digest(b"HPSD", data, read_data(entry))
+                sound_header = None
+        else:
+            digests[i] = resource_digest(entry.name, read_data(entry))
+
+    return digests
+
+
+# The digests of archive_digests by the type and lowercase name of the resources,
+# so that two versions of an archive can be compared resource by resource.
+def digests_by_name(entries, digests):
+    return {(entry.name, bytes(entry.res_name).lower()): digest
+            for entry, digest in zip(entries, digests) if digest is not None}
+
+
+# Type and name of every resource that was changed, added or removed
+# between two versions of an archive, from their digests_by_name.
+def changed_resources(old, new):
+    return set(key for key in old.keys() | new.keys() if old.get(key) != new.get(key))
+
+
+# Runs in the worker processes, so it has to be at module level.
+def _read_archive_entries(path, use_toc, digests):
+    if use_toc:
+        toc = get_toc(path)
+        game, entries = toc.game, toc.entries
+    else:
+        with open_archive_file(path) as f:
+            game, entries = scan_archive(f)
+
+    return game, entries, archive_digests(path, entries) if digests else None
+
+
+# Call func(path, *args) for every archive in paths, with jobs processes (by default one per core)
+# and progress(done, total, path) after every archive. Returns the results by path, with the
+# exception instead of the result if func failed for an archive.
+def run_for_archives(paths, func, args=(), jobs=None, progress=None):
+    results = {}
+
+    def archive_done(path, result):
+        results[path] = result
+        if progress is not None:
+            progress(len(results), len(paths), path)
+
+    if jobs == 1:
+        for path in paths:
+            try:
+                result = func(path, *args)
+            except Exception as error:
+                result = error
+            archive_done(path, result)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(func, path, *args): path for path in paths}
+
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error:
+                    result = error
+                archive_done(futures[future], result)
+
+    return results
+
+
+def format_error(error):
+    return "{0}: {1}".format(type(error).__name__, error)
+
+
+# Build a catalogue of every archive in directory (including subdirectories, directory can also
+# be the path of a single archive) from the section headers of the archives, the resource data
+# isn't read. With use_toc the TOC files of the archives are used and created if needed,
+# otherwise every archive is scanned and nothing is written next to it. With digests the content
+# of every resource is hashed as well, which needs the data of the archives to be read and allows
+# finding resources that are the same. The archives are read by jobs processes (by default one
+# per core) and progress(done, total, path) is called after every archive.
+def load_catalogue(directory, jobs=None, progress=None, use_toc=True, digests=False):
+    paths = find_archives(directory)
+    catalogue = Catalogue()
+    results = run_for_archives(paths, _read_archive_entries, (use_toc, digests), jobs, progress)
+
+    # The archives are added in the order of their paths, not in the order they were read
+    for path in paths:
+        result = results[path]
+        if isinstance(result, Exception):
+            catalogue.errors[path] = format_error(result)
+        else:
+            game, entries, entry_digests = result
+            catalogue.add_archive(path, game, entries, entry_digests)
+
+    return catalogue
+
+
+# Find out the game of every archive in directory (or of the archive directory) from the first
+# few hundred bytes of the archives. Returns a dictionary with a GameProbe for every archive that
+# could be read and one with the error for every other archive, both sorted by path.
+def classify_archives(directory, jobs=None, progress=None):
+    paths = find_archives(directory)
+    results = run_for_archives(paths, probe_archive, (), jobs, progress)
+    games = {}
+    errors = {}
+
+    for path in paths:
+        if isinstance(results[path], Exception):
+            errors[path] = format_error(results[path])
+        else:
+            games[path] = results[path]
+
+    return games, errors
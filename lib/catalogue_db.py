@@ -0,0 +1,263 @@
+import os
+import sqlite3
+from collections import namedtuple
+
+from .bw_toc import open_archive, file_digest
+from .bw_archive import normalize_res_name, texture_format, texture_mipcount
+from .catalogue import RESOURCE_KINDS, find_archives, run_for_archives, format_error, archive_digests
+from .model_dependencies import read_model_nodes
+
+
+# A catalogue of every archive of a game dump in an SQLite database, so that questions like
+# which archives have a model or which textures have a format can be answered without opening
+# the archives. Every archive is read once, after that only archives whose size or modification
+# time changed are hashed and only those whose content changed are read again. Names are stored
+# normalized (without padding and in upper case), SQL's LIKE ignores case anyway.
+DATABASE_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    game TEXT,
+    size INTEGER,
+    mtime INTEGER,
+    digest BLOB,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS resources (
+    archive INTEGER NOT NULL,
+    kind TEXT,
+    type TEXT,
+    name TEXT,
+    offset INTEGER,
+    size INTEGER,
+    digest BLOB
+);
+CREATE TABLE IF NOT EXISTS textures (
+    archive INTEGER NOT NULL,
+    name TEXT,
+    width INTEGER,
+    height INTEGER,
+    format TEXT,
+    mipcount INTEGER
+);
+CREATE TABLE IF NOT EXISTS models (
+    archive INTEGER NOT NULL,
+    name TEXT,
+    node_count INTEGER,
+    texture_count INTEGER,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    archive INTEGER NOT NULL,
+    model TEXT,
+    node_index INTEGER,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS model_textures (
+    archive INTEGER NOT NULL,
+    model TEXT,
+    texture TEXT
+);
+CREATE INDEX IF NOT EXISTS resources_archive ON resources (archive);
+CREATE INDEX IF NOT EXISTS resources_name ON resources (name);
+CREATE INDEX IF NOT EXISTS resources_digest ON resources (digest);
+CREATE INDEX IF NOT EXISTS textures_archive ON textures (archive);
+CREATE INDEX IF NOT EXISTS textures_format ON textures (format);
+CREATE INDEX IF NOT EXISTS models_archive ON models (archive);
+CREATE INDEX IF NOT EXISTS nodes_archive ON nodes (archive);
+CREATE INDEX IF NOT EXISTS nodes_name ON nodes (name);
+CREATE INDEX IF NOT EXISTS model_textures_archive ON model_textures (archive);
+CREATE INDEX IF NOT EXISTS model_textures_texture ON model_textures (texture);
+"""
+
+# Tables with rows for every archive, the rows are replaced when the archive changed
+ARCHIVE_TABLES = ("resources", "textures", "models", "nodes", "model_textures")
+
+# The rows of an archive for each of the tables, without the archive column. unchanged is
+# True if the archive has the same content as when it was last indexed, the rows are empty then.
+ArchiveRows = namedtuple("ArchiveRows", ["game", "size", "mtime", "digest", "unchanged",
+                                         "resources", "textures", "models", "nodes", "model_textures"])
+
+
+def name_to_str(name):
+    return str(normalize_res_name(name), encoding="ascii", errors="replace")
+
+
+# Runs in the worker processes. Reads everything that goes into the database from the
+# archive at path, unless its digest is known_digest. Indexing doesn't write anything next
+# to the archives, so the TOC isn't saved.
+def read_archive_rows(path, known_digest=None):
+    stat = os.stat(path)
+    digest = file_digest(path)
+    if digest == known_digest:
+        return ArchiveRows(None, stat.st_size, stat.st_mtime_ns, digest, True, [], [], [], [], [])
+
+    archive = open_archive(path, save=False)
+    try:
+        game = archive.game
+        entries = archive.toc.entries
+        digests = archive_digests(path, entries)
+
+        resources = []
+        for entry, entry_digest in zip(entries, digests):
+            kind = RESOURCE_KINDS.get(entry.name)
+            if kind is not None:
+                resources.append((kind, str(entry.name, encoding="ascii"), name_to_str(entry.res_name),
+                                  entry.offset, entry.size, entry_digest))
+
+        textures = []
+        for texture in archive.textures:
+            textures.append((name_to_str(texture.res_name), texture.width, texture.height,
+                             texture_format(texture, game), texture_mipcount(texture, game)))
+
+        models = []
+        nodes = []
+        model_textures = []
+        for bwmodel in archive.models:
+            modelname = name_to_str(bwmodel.res_name)
+            try:
+                model_nodes = read_model_nodes(bwmodel, game)
+            except Exception as error:
+                models.append((modelname, None, None, format_error(error)))
+                continue
+
+            texnames = list(dict.fromkeys(texname for nodename, node_textures in model_nodes
+                                          for texname in node_textures))
+            models.append((modelname, len(model_nodes), len(texnames), None))
+            for i, (nodename, node_textures) in enumerate(model_nodes):
+                nodes.append((modelname, i, str(nodename, encoding="ascii", errors="replace")))
+            for texname in texnames:
+                model_textures.append((modelname, name_to_str(texname)))
+    finally:
+        archive.close()
+
+    return ArchiveRows(game, stat.st_size, stat.st_mtime_ns, digest, False,
+                       resources, textures, models, nodes, model_textures)
+
+
+class CatalogueDatabase(object):
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+
+        version, = self.connection.execute("PRAGMA user_version").fetchone()
+        if version not in (0, DATABASE_VERSION):
+            self.connection.close()
+            raise RuntimeError("Unsupported catalogue database version: {0}".format(version))
+
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute("PRAGMA user_version = {0}".format(DATABASE_VERSION))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def query(self, sql, parameters=()):
+        return self.connection.execute(sql, parameters).fetchall()
+
+    # Add the archives in directory (or the archive directory) to the database and bring archives
+    # that are in it already up to date. Archives that were in directory but don't exist anymore are
+    # removed. Returns the amount of archives that were read. Archives are read by jobs processes
+    # and progress(done, total, path) is called after every archive that had to be read or hashed.
+    def update(self, directory, jobs=None, progress=None):
+        paths = [os.path.abspath(path) for path in find_archives(directory)]
+        known = {}
+        for archive_id, path, size, mtime, digest in self.query(
+                "SELECT id, path, size, mtime, digest FROM archives"):
+            known[path] = (archive_id, size, mtime, digest)
+
+        # Only archives with a different size or modification time are hashed
+        changed = []
+        digests = {}
+        for path in paths:
+            stat = os.stat(path)
+            if path in known:
+                archive_id, size, mtime, digest = known[path]
+                if size == stat.st_size and mtime == stat.st_mtime_ns:
+                    continue
+                digests[path] = digest
+            changed.append(path)
+
+        results = {}
+        if changed:
+            results = run_for_archives(changed, _read_changed_archive, (digests, ), jobs, progress)
+
+        read = 0
+        with self.connection:
+            for path in changed:
+                archive_id = known[path][0] if path in known else None
+                result = results[path]
+
+                if isinstance(result, Exception):
+                    self._set_error(archive_id, path, format_error(result))
+                elif result.unchanged:
+                    self.connection.execute("UPDATE archives SET size = ?, mtime = ? WHERE id = ?",
+                                            (result.size, result.mtime, archive_id))
+                else:
+                    self._replace_archive(archive_id, path, result)
+                    read += 1
+
+            # Remove archives of the directory that are gone
+            if os.path.isdir(directory):
+                prefix = os.path.join(os.path.abspath(directory), "")
+                present = set(paths)
+                for path, (archive_id, size, mtime, digest) in known.items():
+                    if path.startswith(prefix) and path not in present:
+                        self._delete_rows(archive_id)
+                        self.connection.execute("DELETE FROM archives WHERE id = ?", (archive_id, ))
+
+        return read
+
+    def _delete_rows(self, archive_id):
+        for table in ARCHIVE_TABLES:
+            self.connection.execute("DELETE FROM {0} WHERE archive = ?".format(table), (archive_id, ))
+
+    def _set_archive(self, archive_id, path, values):
+        if archive_id is None:
+            cursor = self.connection.execute(
+                "INSERT INTO archives (path, game, size, mtime, digest, error) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, ) + values)
+            return cursor.lastrowid
+        else:
+            self._delete_rows(archive_id)
+            self.connection.execute(
+                "UPDATE archives SET game = ?, size = ?, mtime = ?, digest = ?, error = ? WHERE id = ?",
+                values + (archive_id, ))
+            return archive_id
+
+    # An archive that can't be read keeps its size and modification time, so that it is
+    # only read again once it changed.
+    def _set_error(self, archive_id, path, error):
+        try:
+            stat = os.stat(path)
+            size, mtime = stat.st_size, stat.st_mtime_ns
+        except OSError:
+            size, mtime = None, None
+
+        self._set_archive(archive_id, path, (None, size, mtime, None, error))
+
+    def _replace_archive(self, archive_id, path, rows):
+        archive_id = self._set_archive(archive_id, path, (rows.game, rows.size, rows.mtime, rows.digest, None))
+
+        for table, columns in (("resources", "kind, type, name, offset, size, digest"),
+                               ("textures", "name, width, height, format, mipcount"),
+                               ("models", "name, node_count, texture_count, error"),
+                               ("nodes", "model, node_index, name"),
+                               ("model_textures", "model, texture")):
+            table_rows = getattr(rows, table)
+            placeholders = ", ".join(["?"]*(columns.count(",") + 2))
+            self.connection.executemany(
+                "INSERT INTO {0} (archive, {1}) VALUES ({2})".format(table, columns, placeholders),
+                [(archive_id, ) + row for row in table_rows])
+
+
+def _read_changed_archive(path, digests):
+    return read_archive_rows(path, digests.get(path))
@@ -0,0 +1,334 @@
+import ctypes
+import ctypes.util
+import gzip
+import io
+import os
+import struct
+import zlib
+from bisect import bisect_right
+
+from .helper import get_sidecar_paths
+
+
+# Random access to gzip compressed archives, based on zran.c from the zlib examples.
+# While the archive is decompressed once, a checkpoint is stored every SPAN bytes of
+# uncompressed output at the start of a deflate block: the position in the compressed
+# and uncompressed data and the last 32 KiB of output, which is the history the following
+# blocks can refer to. Reading at an offset then only needs to decompress from the
+# checkpoint before it.
+#
+# Finding block boundaries needs Z_BLOCK, which the zlib module doesn't offer, so
+# building an index uses the zlib library through ctypes. Unlike zran, only blocks that
+# start on a byte boundary are used as checkpoints. The zlib module can't be primed with
+# the bits of a partial byte, but it can continue from a whole byte with the window as
+# dictionary, so reading from a checkpoint works with the zlib module alone. Block starts
+# are byte aligned often enough (and always after a stored block) that this only moves
+# checkpoints a little.
+GZI_MAGIC = b"BWGZ"
+GZI_VERSION = 1
+GZI_EXTENSION = ".gzi"
+
+WINDOW_SIZE = 32*1024
+SPAN = 1024*1024
+CHUNK_SIZE = 64*1024
+
+# magic, version, gz file size, gz file mtime in ns, uncompressed size, checkpoint count
+gzi_header = struct.Struct("<4sIQQQI")
+# uncompressed offset, compressed offset, size of compressed window
+gzi_point = struct.Struct("<QQI")
+
+Z_OK = 0
+Z_STREAM_END = 1
+Z_BLOCK = 5
+
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [
+        ("next_in", ctypes.POINTER(ctypes.c_ubyte)),
+        ("avail_in", ctypes.c_uint),
+        ("total_in", ctypes.c_ulong),
+        ("next_out", ctypes.POINTER(ctypes.c_ubyte)),
+        ("avail_out", ctypes.c_uint),
+        ("total_out", ctypes.c_ulong),
+        ("msg", ctypes.c_char_p),
+        ("state", ctypes.c_void_p),
+        ("zalloc", ctypes.c_void_p),
+        ("zfree", ctypes.c_void_p),
+        ("opaque", ctypes.c_void_p),
+        ("data_type", ctypes.c_int),
+        ("adler", ctypes.c_ulong),
+        ("reserved", ctypes.c_ulong)
+    ]
+
+
+_libz = None
+
+
+def _load_libz():
+    global _libz
+
+    if _libz is None:
+        path = ctypes.util.find_library("z") or ctypes.util.find_library("zlib1")
+        if path is None:
+            raise RuntimeError("zlib library not found, can't build gzip index")
+
+        libz = ctypes.CDLL(path)
+        libz.zlibVersion.restype = ctypes.c_char_p
+        libz.inflateInit2_.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        libz.inflate.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_int]
+        libz.inflateEnd.argtypes = [ctypes.POINTER(_ZStream)]
+        _libz = libz
+
+    return _libz
+
+
+class Checkpoint(object):
+    def __init__(self, out, inp, window):
+        self.out = out  # Offset in the uncompressed data
+        self.inp = inp  # Offset in the compressed data
+        self.window = window
+
+
+class GzipIndex(object):
+    def __init__(self, points, size, filesize=0, mtime=0):
+        self.points = points
+        self.size = size  # Size of the uncompressed data
+        self.filesize = filesize
+        self.mtime = mtime
+        self._offsets = [point.out for point in points]
+
+    @classmethod
+    def build(cls, path, span=SPAN):
+        libz = _load_libz()
+        stat = os.stat(path)
+
+        strm = _ZStream()
+        window = (ctypes.c_ubyte * WINDOW_SIZE)()
+        window_address = ctypes.addressof(window)
+
+        # 16 + 15: gzip stream with the maximum window size
+        ret = libz.inflateInit2_(ctypes.byref(strm), 31, libz.zlibVersion(), ctypes.sizeof(_ZStream))
+        if ret != Z_OK:
+            raise RuntimeError("inflateInit2 failed: {0}".format(ret))
+
+        points = []
+        totin = totout = last = 0
+        ret = Z_OK
+
+        try:
+            with open(path, "rb") as f:
+                while ret != Z_STREAM_END:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        raise RuntimeError("Unexpected end of gzip file")
+
+                    inbuf = (ctypes.c_ubyte * len(chunk)).from_buffer_copy(chunk)
+                    strm.next_in = ctypes.cast(inbuf, ctypes.POINTER(ctypes.c_ubyte))
+                    strm.avail_in = len(chunk)
+
+                    while strm.avail_in != 0:
+                        if strm.avail_out == 0:
+                            strm.next_out = ctypes.cast(window, ctypes.POINTER(ctypes.c_ubyte))
+                            strm.avail_out = WINDOW_SIZE
+
+                        totin += strm.avail_in
+                        totout += strm.avail_out
+                        ret = libz.inflate(ctypes.byref(strm), Z_BLOCK)
+                        totin -= strm.avail_in
+                        totout -= strm.avail_out
+
+                        if ret == Z_STREAM_END:
+                            break
+                        elif ret != Z_OK:
+                            raise RuntimeError("Error while decompressing gzip file: {0}".format(ret))
+
+                        # Bit 7 is set at the end of a block, bit 6 if it was the last block
+                        # and the lowest 3 bits are the unused bits of the last byte read.
+                        if (strm.data_type & 128 and not strm.data_type & 64 and strm.data_type & 7 == 0
+                                and (totout == 0 or totout - last > span)):
+                            # The window is circular, the oldest output starts where the next output goes.
+                            left = strm.avail_out
+                            data = ctypes.string_at(window_address, WINDOW_SIZE)
+                            points.append(Checkpoint(totout, totin, data[WINDOW_SIZE-left:] + data[:WINDOW_SIZE-left]))
+                            last = totout
+
+                # Anything after the 8 byte trailer would be another gzip member.
+                if strm.avail_in + len(f.read(9)) > 8:
+                    raise RuntimeError("gzip files with several members aren't supported")
+        finally:
+            libz.inflateEnd(ctypes.byref(strm))
+
+        return cls(points, totout, stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def read(cls, f):
+        magic, version, filesize, mtime, size, count = gzi_header.unpack(f.read(gzi_header.size))
+        if magic != GZI_MAGIC or version != GZI_VERSION:
+            raise RuntimeError("Not a supported gzip index file")
+
+        points = []
+        for i in range(count):
+            out, inp, windowsize = gzi_point.unpack(f.read(gzi_point.size))
+            points.append(Checkpoint(out, inp, zlib.decompress(f.read(windowsize))))
+
+        return cls(points, size, filesize, mtime)
+
+    def write(self, f):
+        f.write(gzi_header.pack(GZI_MAGIC, GZI_VERSION, self.filesize, self.mtime, self.size, len(self.points)))
+
+        for point in self.points:
+            window = zlib.compress(point.window)
+            f.write(gzi_point.pack(point.out, point.inp, len(window)))
+            f.write(window)
+
+    def matches(self, path):
+        stat = os.stat(path)
+        return stat.st_size == self.filesize and stat.st_mtime_ns == self.mtime
+
+    def find_point(self, offset):
+        return self.points[max(0, bisect_right(self._offsets, offset) - 1)]
+
+
+class IndexedGzipFile(object):
+    # Read-only, seekable file object for a gzip file with an index. Reads continue
+    # decompressing from the current position if possible, otherwise they start
+    # again from the checkpoint closest to the read.
+    def __init__(self, path, index):
+        self._file = open(path, "rb")
+        self._index = index
+        self._pos = 0
+
+        self._decompressor = None
+        self._stream_pos = 0  # Position of the decompressor in the uncompressed data
+        self.closed = False
+
+    def _start(self, point):
+        self._file.seek(point.inp)
+        self._decompressor = zlib.decompressobj(-15, zdict=point.window)
+        self._stream_pos = point.out
+
+    def _next_input(self):
+        return self._file.read(CHUNK_SIZE)
+
+    def _inflate(self, size):
+        chunks = []
+        count = 0
+        decompressor = self._decompressor
+
+        while count < size and not decompressor.eof:
+            data = decompressor.unconsumed_tail or self._next_input()
+
+            # With no input left this still returns output that zlib is holding back
+            output = decompressor.decompress(data, size - count)
+            if not data and not output:
+                break
+
+            chunks.append(output)
+            count += len(output)
+
+        self._stream_pos += count
+        return b"".join(chunks)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._index.size - self._pos
+        size = max(0, min(size, self._index.size - self._pos))
+        if size == 0:
+            return b""
+
+        point = self._index.find_point(self._pos)
+        if (self._decompressor is None or self._pos < self._stream_pos
+                or point.out > self._stream_pos):
+            self._start(point)
+
+        while self._stream_pos < self._pos:
+            self._inflate(min(CHUNK_SIZE*4, self._pos - self._stream_pos))
+
+        data = self._inflate(size)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self._index.size + offset
+        else:
+            raise ValueError("Invalid whence: {0}".format(whence))
+
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self._file.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Returns the stored index of the gzip file at path or None if there is
+# no index or it is out of date.
+def load_gzip_index(path):
+    for indexpath in get_sidecar_paths(path, GZI_EXTENSION):
+        try:
+            with open(indexpath, "rb") as f:
+                index = GzipIndex.read(f)
+        except (OSError, RuntimeError, struct.error, zlib.error):
+            continue
+
+        if index.matches(path):
+            return index
+
+    return None
+
+
+def save_gzip_index(index, path):
+    for indexpath in get_sidecar_paths(path, GZI_EXTENSION):
+        try:
+            os.makedirs(os.path.dirname(indexpath), exist_ok=True)
+            with open(indexpath, "wb") as f:
+                index.write(f)
+            return indexpath
+        except OSError:
+            continue
+
+    return None
+
+
+def get_gzip_index(path, span=SPAN, save=True):
+    index = load_gzip_index(path)
+
+    if index is None:
+        index = GzipIndex.build(path, span)
+        if save:
+            save_gzip_index(index, path)
+
+    return index
+
+
+# Open a gzip file for random access, with index if it was already loaded. If no index can be
+# built for it, a GzipFile is returned instead, which has to decompress everything before the
+# position it reads at.
+def open_indexed_gzip(path, index=None):
+    if index is None:
+        try:
+            index = get_gzip_index(path)
+        except (RuntimeError, OSError) as error:
+            print("Couldn't index gzip file, reading it without index:", error)
+            return gzip.open(path, "rb")
+
+    return IndexedGzipFile(path, index)
@@ -0,0 +1,97 @@
+import re
+from struct import Struct
+
+
+# Fixed size headers of sections are declared as a list of fields, each with the attribute the
+# value goes into and the struct format of the value. A format with a count (e.g. "8I") is a list
+# of that many values, strings (e.g. "16s") are bytes padded with zeroes. All fields are put into
+# one precompiled struct.Struct, so reading or writing a header is a single struct call no matter
+# how many fields it has, and reading and writing can't disagree about the layout.
+FIELD_FORMAT = re.compile(r"^(\d*)([cbB?hHiIlLqQefds])$")
+
+# How the values of a field are stored in its attribute
+FIELD_VALUE = 0
+FIELD_BYTES = 1
+FIELD_LIST = 2
+
+
+class HeaderSchema(object):
+    def __init__(self, fields, byteorder="<"):
+        self.fields = fields
+
+        formats = []
+        self._fields = []  # Attribute, kind, index of the first value and the number of values
+        index = 0
+
+        for attribute, fmt in fields:
+            match = FIELD_FORMAT.match(fmt)
+            if match is None or not attribute.isidentifier():
+                raise RuntimeError("Invalid field {0}: {1}".format(attribute, fmt))
+
+            count, valuetype = match.groups()
+            if valuetype == "s":
+                # For strings the count is the size of the field
+                self._fields.append((attribute, FIELD_BYTES, index, int(count) if count else 1))
+                index += 1
+            elif count and int(count) != 1:
+                self._fields.append((attribute, FIELD_LIST, index, int(count)))
+                index += int(count)
+            else:
+                self._fields.append((attribute, FIELD_VALUE, index, 1))
+                index += 1
+
+            formats.append(fmt)
+
+        self.struct = Struct(byteorder + "".join(formats))
+        self.size = self.struct.size
+
+    # Read the header at offset in data into the attributes of obj. The attributes are set
+    # directly, so a resource doesn't count as modified by reading its header.
+    def unpack_into(self, obj, data, offset=0):
+        values = self.struct.unpack_from(data, offset)
+
+        for attribute, kind, index, count in self._fields:
+            if kind == FIELD_LIST:
+                object.__setattr__(obj, attribute, list(values[index:index+count]))
+            else:
+                object.__setattr__(obj, attribute, values[index])
+
+    def _values(self, obj):
+        values = []
+        for attribute, kind, index, count in self._fields:
+            if kind == FIELD_LIST:
+                values.extend(getattr(obj, attribute))
+            elif kind == FIELD_BYTES:
+                # struct would cut off the end of a value that doesn't fit
+                value = bytes(getattr(obj, attribute))
+                if len(value) > count:
+                    raise ValueError("{0} is {1} bytes long, but its field only has {2}: {3!r}".format(
+                        attribute, len(value), count, value))
+                values.append(value)
+            else:
+                values.append(getattr(obj, attribute))
+
+        return values
+
+    # Write the attributes of obj as the header at offset in buffer. Raises a ValueError if
+    # a string is longer than its field.
+    def pack_into(self, obj, buffer, offset=0):
+        self.struct.pack_into(buffer, offset, *self._values(obj))
+
+    def pack(self, obj):
+        return self.struct.pack(*self._values(obj))
+
+
+# Names that are stored as a 4 byte length followed by the name
+name_length = Struct("<I")
+
+
+# Returns the name at offset in data and the offset after it.
+def unpack_prefixed_name(data, offset=0):
+    length, = name_length.unpack_from(data, offset)
+    start = offset + name_length.size
+    return bytes(data[start:start+length]), start + length
+
+
+def pack_prefixed_name(name):
+    return name_length.pack(len(name)) + bytes(name)
@@ -1,3 +1,5 @@
+import hashlib
+import os
 from struct import unpack, pack
 
 
@@ -15,4 +17,22 @@ def unpack_uint32(data, offset):
     return unpack("I", data[offset:offset+4])[0]
 
 def write_uint32(fileobj, val):
-    fileobj.write(pack("I", val))
\ No newline at end of file
+    fileobj.write(pack("I", val))
+
+
+def get_cache_dir():
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+
+    return os.path.join(base, "bw-model-viewer")
+
+
+# Files with extra data for a file (e.g. an archive's table of contents) are preferably
+# stored next to it, the path in the cache directory is used if that isn't possible.
+def get_sidecar_paths(path, extension):
+    path = os.path.abspath(path)
+    cache_name = hashlib.blake2b(bytes(path, encoding="utf-8"), digest_size=16).hexdigest()
+
+    return [path + extension, os.path.join(get_cache_dir(), cache_name + extension)]
@@ -0,0 +1,154 @@
+from struct import Struct
+
+from .bw_archive import normalize_res_name
+
+
+# Finds the textures that the models of an archive use without reading the models. A model is
+# a list of nodes and every node has a MATL section with the names of the textures of its
+# materials, so only the headers of the model and its nodes are read, the MATL sections are
+# read and everything else, including all of the geometry, is skipped.
+
+# version, node count, additional data count, unknown int, 4 floats, bgf name length
+bw2_model_header = Struct(">IIHHI4fI")
+# node count, additional data count, padding, unknown int, 4 floats
+bw1_model_header = Struct("<HBx4x16x")
+# name and size of a section in a model, the name is stored reversed
+model_section = Struct("<4sI")
+name_length = Struct(">I")
+
+NODE_HEADER_SIZE = 0x38
+
+# Size of a material, the size of a texture name and the amount of texture names at its start
+MATERIAL_LAYOUTS = {
+    "BW1": (0x48, 0x10, 2),
+    "BW2": (0xA4, 0x20, 4),
+    "AQ": (0xA4, 0x20, 4)
+}
+
+
+def _read_section(data, offset):
+    name, size = model_section.unpack_from(data, offset)
+    return name, size, offset + model_section.size
+
+
+def _skip_section(data, offset, name):
+    secname, size, start = _read_section(data, offset)
+    if secname != name:
+        raise RuntimeError("Expected section {0} in model, found {1}".format(name, secname))
+    return start + size
+
+
+def _read_node(data, offset, nodeend, game, additionalcount, index):
+    if game == "BW1":
+        # BW1 nodes have no names, they are named like in the viewer
+        nodename = bytes("Node {0}".format(index), encoding="ascii")
+    else:
+        length, = name_length.unpack_from(data, offset)
+        offset += name_length.size
+        nodename = bytes(data[offset:offset+length])
+        offset += length
+
+    offset += NODE_HEADER_SIZE + additionalcount*4
+
+    # The sections before the materials are the bounding box and a few optional sections
+    secname, size, offset = _read_section(data, offset)
+    while secname != b"LTAM":
+        offset += size
+        if offset >= nodeend:
+            raise RuntimeError("Node without materials")
+        secname, size, offset = _read_section(data, offset)
+
+    material_size, texname_size, texname_count = MATERIAL_LAYOUTS[game]
+    if size % material_size != 0:
+        raise RuntimeError("Material section has a size of {0}".format(size))
+
+    textures = []
+    for start in range(offset, offset + size, material_size):
+        for i in range(texname_count):
+            texname = bytes(data[start + i*texname_size:start + (i+1)*texname_size])
+            if texname.count(b"\x00") != texname_size:
+                textures.append(normalize_res_name(texname))
+
+    return nodename, textures
+
+
+# The name of every node of the model of a model section (LDOM) and the names of the textures
+# of the node's materials, in the order of the materials. The texture names are normalized.
+def read_model_nodes(bwmodel, game):
+    if game not in MATERIAL_LAYOUTS:
+        raise RuntimeError("Unknown game: {0}".format(game))
+
+    data = bwmodel.entries[0].data
+
+    if game == "BW1":
+        nodecount, additionalcount = bw1_model_header.unpack_from(data, 0)
+        offset = bw1_model_header.size
+    else:
+        values = bw2_model_header.unpack_from(data, 0)
+        nodecount, additionalcount = values[2], values[3]
+        offset = bw2_model_header.size + values[-1]
+
+    offset += additionalcount*4
+    if game == "AQ":
+        offset = _skip_section(data, offset, b"LCSC")
+    offset = _skip_section(data, offset, b"MEMX")
+
+    nodes = []
+    for i in range(nodecount):
+        secname, size, start = _read_section(data, offset)
+        if secname != b"EDON":
+            raise RuntimeError("Expected node in model, found {0}".format(secname))
+
+        offset = start + size
+        nodes.append(_read_node(data, start, offset, game, additionalcount, i))
+
+    return nodes
+
+
+# Names of the textures that the model of a model section uses, without duplicates.
+def model_textures(bwmodel, game):
+    return list(dict.fromkeys(texname for nodename, textures in read_model_nodes(bwmodel, game)
+                              for texname in textures))
+
+
+# Which textures every model of an archive uses and which models use every texture. Texture and
+# model names are normalized like in the resource lookup of the archives.
+class TextureDependencies(object):
+    def __init__(self):
+        self.model_textures = {}  # Textures of every model
+        self.texture_models = {}  # Models that use every texture of the archive
+        self.missing_textures = {}  # Textures that models use but aren't in the archive, with those models
+        self.errors = {}  # Models that couldn't be read and the error
+
+    @classmethod
+    def from_archive(cls, archive):
+        dependencies = cls()
+
+        for name in archive.texture_names():
+            dependencies.texture_models[normalize_res_name(name)] = []
+
+        for bwmodel in archive.models:
+            modelname = normalize_res_name(bwmodel.res_name)
+            try:
+                textures = model_textures(bwmodel, archive.game)
+            except Exception as error:
+                dependencies.errors[modelname] = "{0}: {1}".format(type(error).__name__, error)
+                continue
+
+            dependencies.add_model(modelname, textures)
+
+        return dependencies
+
+    def add_model(self, modelname, textures):
+        self.model_textures[modelname] = textures
+
+        for texname in textures:
+            if texname in self.texture_models:
+                self.texture_models[texname].append(modelname)
+            else:
+                self.missing_textures.setdefault(texname, []).append(modelname)
+
+    # Textures of the archive that no model uses, e.g. textures of the interface
+    # or textures that are used by other resources than models.
+    def unused_textures(self):
+        return [texname for texname, models in self.texture_models.items() if not models]
@@ -1,6 +1,10 @@
 import os
 
-from OpenGL.GL import *
+try:
+    from OpenGL.GL import *
+except ImportError:
+    # Without OpenGL models can still be read and exported, but not rendered
+    pass
 from binascii import hexlify
 from struct import unpack
 from .vectors import Vector3, Matrix4x4
@@ -90,7 +94,8 @@ class BW2Model(Model):
         for node in self.nodes:
             node.destroy_displaylists()
 
-    def from_file(self, f):
+    # Without displaylists the model can be read and exported without OpenGL, but not rendered.
+    def from_file(self, f, displaylists=True):
         self.version = (read_uint32(f), read_uint32(f))
         self.nodecount = read_uint16(f)
         self.additionaldatacount = read_uint16(f)
@@ -130,7 +135,8 @@ class BW2Model(Model):
         self.render_order = []
         for node in self.nodes:
             #start = timer()
-            node.create_displaylists()
+            if displaylists:
+                node.create_displaylists()
             #print("node", node.name, "took", timer() - start, "s")
             self.render_order.append(node )
 
@@ -186,9 +192,8 @@ class BW2Model(Model):
 
         for texturename in exported_textures:
             texname = str(texturename.strip(b"\x00"), encoding="ascii") + ".png"
-            result = texturearchive.get_texture(texturename.lower())
-            if result is not None:
-                tex, texid = result
+            tex = texturearchive.decode_texture(texturename.lower())
+            if tex is not None:
                 tex.dump_to_file(os.path.join(outputpath, texname))
 
         normal_offset = 1
@@ -229,7 +234,7 @@ class BW2Model(Model):
                     obj.write("vt {0} {1}\n".format(u, 1-v))
 
                 for i, mat in enumerate(node.materials):
-                    print(node.name)
+                    #print(node.name)
                     matname = str(node.name.strip(b"\00"), encoding="latin-1")+"_mat{0}".format(i)
 
                     mtl.write("newmtl {0}\n".format(matname))
@@ -348,7 +353,8 @@ class AragornModel(BW2Model):
 
         self.nodes = []
 
-    def from_file(self, f):
+    # Without displaylists the model can be read and exported without OpenGL, but not rendered.
+    def from_file(self, f, displaylists=True):
         self.version = (read_uint32(f), read_uint32(f))
         self.nodecount = read_uint16(f)
         self.additionaldatacount = read_uint16(f)
@@ -388,13 +394,14 @@ class AragornModel(BW2Model):
         self.render_order = []
         for node in self.nodes:
             #start = timer()
-            node.create_displaylists()
+            if displaylists:
+                node.create_displaylists()
             #print("node", node.name, "took", timer() - start, "s")
             self.render_order.append(node )
 
 
 class BW1Model(BW2Model):
-    def from_file(self, f):
+    def from_file(self, f, displaylists=True):
         #self.version = (read_uint32(f), read_uint32(f))
         self.nodecount = read_uint16_le(f)
         self.additionaldatacount = read_uint8(f)
@@ -437,12 +444,32 @@ class BW1Model(BW2Model):
         self.render_order = []
         for node in self.nodes:
             start = timer()
-            node.create_displaylists()
+            if displaylists:
+                node.create_displaylists()
             #print("node", node.name, "took", timer() - start, "s")
             self.render_order.append(node )
             #print(node._displaylists, node.meshes)
 
 
+# Read the model of a model section (LDOM) from an archive of the game.
+def load_model(bwmodel, game, displaylists=True):
+    f = bwmodel.entries[0].fileobj
+    f.seek(0)
+
+    if game == "BW1":
+        model = BW1Model()
+        model.bgfname = bytes(bwmodel.res_name)
+    elif game == "BW2":
+        model = BW2Model()
+    elif game == "AQ":
+        model = AragornModel()
+    else:
+        raise RuntimeError("Unknown game: {0}".format(game))
+
+    model.from_file(f, displaylists)
+    return model
+
+
 class LODLevel(object):
     def __init__(self):
         self.vertices = []
@@ -1161,7 +1188,7 @@ class NodeAragorn(NodeBW2):
     def from_file(self, f):
         nodename = f.read(4)
         assert nodename == b"EDON"
-        print("We are reading a node here")
+        #print("We are reading a node here")
         nodesize = read_uint32_le(f)
         nodestart = f.tell()
         nodeend = f.tell() + nodesize
@@ -1199,7 +1226,7 @@ class NodeAragorn(NodeBW2):
         size = read_uint32_le(f)
 
         while secname != b"MATL":
-            print("Reading Section", secname)
+            #print("Reading Section", secname)
             if secname == b"RNOD":
                 self.rnod = f.read(size)
 
@@ -1231,7 +1258,7 @@ class NodeAragorn(NodeBW2):
             secname = read_id(f)
             size = read_uint32_le(f)
             end = f.tell() + size
-            print("Reading Section", secname)
+            #print("Reading Section", secname)
             if secname == b"SCNT":
                 val = read_uint32(f)
                 assert size == 4
@@ -1253,7 +1280,7 @@ class NodeAragorn(NodeBW2):
                 #unknown = (read_uint32(f), read_uint32(f))
                 unknown = f.read(0x20)
                 gx_data_size = read_uint32(f)
-                print("Data size", hex(gx_data_size))
+                #print("Data size", hex(gx_data_size))
                 gx_data_end = f.tell() + gx_data_size
                 # print(hex(gx_data_end), hex(gx_data_size))
 
@@ -1282,8 +1309,8 @@ class NodeAragorn(NodeBW2):
                     elif opcode & 0xF8 == 0x98:  # Triangle strip
                         attribs = VertexDescriptor()
                         attribs.from_value(vertexdesc)
-                        if opcode == 0x9A:
-                            print([x for x in attribs.active_attributes()])
+                        #if opcode == 0x9A:
+                        #    print([x for x in attribs.active_attributes()])
                         vertex_count = read_uint16(f)
                         prim = Primitive(0x98)
                         # print(bin(vertexdesc))
@@ -1373,7 +1400,7 @@ class NodeAragorn(NodeBW2):
             else:
                 f.read(size)
             self.sections.append(secname)
-            print(secname)
+            #print(secname)
             assert f.tell() == end
         while f.tell() < nodeend:
             secname = read_id(f)
@@ -0,0 +1,298 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from struct import Struct
+
+from .bw_archive_base import BufferReader, section_header
+from .bw_archive import read_res_name, probe_game
+from .bw_toc import open_archive_file
+from .header_schema import name_length, pack_prefixed_name
+
+
+# A content addressed store for the resources of extracted archives. The data of every resource
+# (the data of its section, including its name) is stored once in a file named after its hash,
+# so resources that are in several archives, e.g. in the archives of different versions of a
+# game, only take space once. Every archive becomes a manifest that lists its sections in order
+# with the type, name, hash and size of every resource:
+#
+#   {"version": 1, "game": "BW2", "sections": [
+#       {"type": "RXET", "name": "level.tex", "entries": [
+#           {"type": "FTBG", "entries": [{"type": "DXTG", "name": "TEX_000", "hash": "...", "size": 1234}, ...]}]},
+#       {"type": "DNOS", "name": "level.snd", "entries": [{"type": "HFSB"}, {"type": "HPSD", ...}, ...]},
+#       {"type": "LDOM", "name": "MODEL_00", "hash": "...", "size": 5678}, ...]}
+#
+# RXET and DNOS only contain their filename and other sections, the texture sections (FTBX/FTBG)
+# and the sound count (HFSB) only contain the amount of textures and sounds, which is counted
+# again when the archive is rebuilt. Rebuilding an archive only copies the files of its
+# resources together, resources are never decoded.
+MANIFEST_VERSION = 1
+MANIFEST_EXTENSION = ".json"
+OBJECT_DIGEST_SIZE = 20
+COPY_CHUNK_SIZE = 1024*1024
+
+# Amount of textures or sounds at the start of a count section
+section_count = Struct("<I")
+
+CONTAINER_SECTIONS = (b"RXET", b"DNOS")
+TEXTURE_SECTIONS = (b"FTBX", b"FTBG")
+
+
+def tag_to_str(tag):
+    return str(tag, encoding="latin-1")
+
+
+def str_to_tag(tag):
+    return bytes(tag, encoding="latin-1")
+
+
+class ResourceStore(object):
+    def __init__(self, path):
+        self.path = path
+        self.objects_dir = os.path.join(path, "objects")
+        self.manifests_dir = os.path.join(path, "manifests")
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def has_object(self, digest):
+        return os.path.exists(self.object_path(digest))
+
+    # Store data and return its hash. Data that is already in the store isn't written again.
+    def add(self, data):
+        digest = hashlib.blake2b(data, digest_size=OBJECT_DIGEST_SIZE).hexdigest()
+        path = self.object_path(digest)
+
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+
+            # Several processes can add the same data at once, the file
+            # only appears under its name once it is complete.
+            fd, temppath = tempfile.mkstemp(dir=directory)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(temppath, path)
+            finally:
+                # Only left over if writing or renaming it failed
+                if os.path.exists(temppath):
+                    os.remove(temppath)
+
+        return digest
+
+    def add_file(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+
+        return self.add(data), len(data)
+
+    def open_object(self, digest):
+        return open(self.object_path(digest), "rb")
+
+    # Path of the manifest of an archive. Names are relative to the manifests directory of the store
+    # (e.g. the path of the archive in the directory that was extracted), only a name that ends in
+    # .json is the path of a manifest file elsewhere.
+    def manifest_path(self, name):
+        if name.endswith(MANIFEST_EXTENSION):
+            return name
+
+        path = os.path.normpath(os.path.join(self.manifests_dir, name + MANIFEST_EXTENSION))
+        if not self.in_manifests_dir(path):
+            raise RuntimeError("Manifest name is outside of the store: {0}".format(name))
+        return path
+
+    def in_manifests_dir(self, path):
+        manifests_dir = os.path.abspath(self.manifests_dir)
+        return os.path.commonpath([manifests_dir, os.path.abspath(path)]) == manifests_dir
+
+    def load_manifest(self, name):
+        with open(self.manifest_path(name), "r") as f:
+            manifest = json.load(f)
+
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise RuntimeError("Unsupported manifest version: {0}".format(manifest.get("version")))
+
+        return manifest
+
+    # Manifests are only written to the manifests directory, or to a new file
+    # elsewhere, existing files outside of the store are never overwritten.
+    def save_manifest(self, name, manifest):
+        path = self.manifest_path(name)
+        if os.path.exists(path) and not self.in_manifests_dir(path):
+            raise RuntimeError("Won't overwrite a file outside of the store's manifests: {0}".format(path))
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(path, "w") as f:
+            json.dump(manifest, f, indent=1)
+
+        return path
+
+
+def _read_section(f):
+    header = f.read(section_header.size)
+    if len(header) < section_header.size:
+        if header:
+            raise RuntimeError("Archive ends in the middle of a section header")
+        return None, None
+
+    return section_header.unpack(header)
+
+
+def _read_data(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise RuntimeError("Archive ends in the middle of a section")
+    return data
+
+
+def _resource_entry(store, tag, data):
+    res_name = read_res_name(BufferReader(data), tag)
+
+    return {"type": tag_to_str(tag), "name": str(res_name.rstrip(b"\x00"), encoding="latin-1"),
+            "hash": store.add(data), "size": len(data)}
+
+
+# Read the sections in the next size bytes of f into manifest entries.
+def _read_entries(store, f, size):
+    entries = []
+    end = f.tell() + size
+
+    while f.tell() < end:
+        tag, size = _read_section(f)
+        if tag is None:
+            raise RuntimeError("Archive ends in the middle of a section")
+
+        if tag in TEXTURE_SECTIONS:
+            _read_data(f, section_count.size)
+            entries.append({"type": tag_to_str(tag), "entries": _read_entries(store, f, size - section_count.size)})
+        elif tag == b"HFSB" and size == section_count.size:
+            _read_data(f, section_count.size)
+            entries.append({"type": tag_to_str(tag)})
+        else:
+            entries.append(_resource_entry(store, tag, _read_data(f, size)))
+
+    return entries
+
+
+# Put the resources of the archive that f is open for into the store and return the manifest of
+# the archive. The archive is only read forward and one section at a time.
+def extract_archive(store, f):
+    game = probe_game(f).game
+    f.seek(0)
+    sections = []
+
+    tag, size = _read_section(f)
+    while tag is not None:
+        if tag in CONTAINER_SECTIONS:
+            strlength, = name_length.unpack(_read_data(f, name_length.size))
+            name = _read_data(f, strlength)
+            sections.append({"type": tag_to_str(tag), "name": str(name, encoding="latin-1"),
+                             "entries": _read_entries(store, f, size - name_length.size - strlength)})
+        else:
+            sections.append(_resource_entry(store, tag, _read_data(f, size)))
+
+        tag, size = _read_section(f)
+
+    return {"version": MANIFEST_VERSION, "game": game, "sections": sections}
+
+
+def extract_archive_file(store, path):
+    with open_archive_file(path) as f:
+        return extract_archive(store, f)
+
+
+# Iterate over the resources in a list of manifest entries, including those in sections.
+def iter_resources(entries):
+    for entry in entries:
+        if "entries" in entry:
+            yield from iter_resources(entry["entries"])
+        elif "hash" in entry:
+            yield entry
+
+
+# Point the resource of a type and name in a manifest at new data. Returns
+# False if the manifest has no such resource.
+def replace_resource(store, manifest, restype, name, data):
+    for entry in iter_resources(manifest["sections"]):
+        if entry["type"] == restype and entry["name"].upper() == name.upper():
+            entry["hash"] = store.add(data)
+            entry["size"] = len(data)
+            return True
+
+    return False
+
+
+# Size of the data of the section of a manifest entry, the sizes of the sections
+# in it are put into sizes as well.
+def _collect_sizes(store, entry, sizes):
+    tag = str_to_tag(entry["type"])
+
+    if "entries" in entry:
+        if tag in CONTAINER_SECTIONS:
+            size = name_length.size + len(str_to_tag(entry["name"]))
+        else:
+            size = section_count.size
+
+        for child in entry["entries"]:
+            size += section_header.size + _collect_sizes(store, child, sizes)
+    elif "hash" in entry:
+        # Check that the resource is there before anything is written
+        path = store.object_path(entry["hash"])
+        if not os.path.exists(path):
+            raise RuntimeError("Resource {0} {1} isn't in the store".format(entry["type"], entry["name"]))
+        if os.path.getsize(path) != entry["size"]:
+            raise RuntimeError("Resource {0} {1} has the wrong size in the store".format(
+                entry["type"], entry["name"]))
+
+        size = entry["size"]
+    else:
+        size = section_count.size
+
+    sizes[id(entry)] = size
+    return size
+
+
+def _write_section(store, f, entry, sizes, sound_count):
+    tag = str_to_tag(entry["type"])
+    f.write(section_header.pack(tag, sizes[id(entry)]))
+
+    if "entries" in entry:
+        if tag in CONTAINER_SECTIONS:
+            f.write(pack_prefixed_name(str_to_tag(entry["name"])))
+            sound_count = sum(1 for child in entry["entries"] if child["type"] == "HPSD")
+        else:
+            f.write(section_count.pack(len(entry["entries"])))
+
+        for child in entry["entries"]:
+            _write_section(store, f, child, sizes, sound_count)
+    elif "hash" in entry:
+        with store.open_object(entry["hash"]) as data:
+            shutil.copyfileobj(data, f, COPY_CHUNK_SIZE)
+    else:
+        f.write(section_count.pack(sound_count))
+
+
+# Write the archive of a manifest to f. The sizes of all sections are known from the
+# manifest, so the resources are copied from the store into f one after the other.
+def build_archive(store, manifest, f):
+    sizes = {}
+    for entry in manifest["sections"]:
+        _collect_sizes(store, entry, sizes)
+
+    for entry in manifest["sections"]:
+        _write_section(store, f, entry, sizes, 0)
+
+
+def build_archive_file(store, manifest, path):
+    if path.endswith(".gz"):
+        with gzip.open(path, "wb") as f:
+            build_archive(store, manifest, f)
+    else:
+        with open(path, "wb") as f:
+            build_archive(store, manifest, f)
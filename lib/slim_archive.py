@@ -0,0 +1,110 @@
+import gzip
+import os
+import xml.etree.ElementTree as ElementTree
+from collections import namedtuple
+
+from .bw_archive import BWArchive, normalize_res_name
+from .model_dependencies import model_textures
+
+
+# Removes the resources from an archive that nothing uses, to make the archives that are
+# shipped to testers smaller. Models, sounds and scripts are always kept, even if another model,
+# sound or script has the same name. Which textures, effects and animations are used is only known
+# with the level's resource list: textures are kept if a model uses them or the level names them,
+# effects and animations if the level names them. Effects can use textures as well and aren't read,
+# so without the level every texture, effect and animation is kept. Of several textures, effects or
+# animations with the same name only the first is kept, the game and the lookup of the archives
+# only ever find that one.
+SlimReport = namedtuple("SlimReport", ["removed", "errors", "old_size", "new_size"])
+
+TEXTURE_KINDS = (b"TXET", b"DXTG")
+# Kinds of resources that are only kept if something refers to them
+LEVEL_KINDS = (b"FEQT", b"MINA")
+# Kinds of resources of which only the first with a name is kept
+SHADOWED_KINDS = TEXTURE_KINDS + LEVEL_KINDS
+
+
+# The names of the resources that the objects of a level refer to, from the level's XML file.
+# The file is read one object at a time. Returns a set of normalized names, the types of the
+# objects aren't checked because the same name is used by several kinds of resources.
+def read_level_resources(f):
+    names = set()
+
+    for event, element in ElementTree.iterparse(f):
+        if element.tag != "Object":
+            continue
+
+        for attribute in element.iter("Attribute"):
+            if attribute.get("name") == "mName":
+                for item in attribute.iter("Item"):
+                    if item.text:
+                        names.add(normalize_res_name(item.text.strip()))
+
+        element.clear()
+
+    return names
+
+
+# The normalized names of the textures that the models of the archive use. errors gets the
+# name and the error of every model that couldn't be read, if there are any the textures
+# of those models aren't known.
+def used_textures(archive, errors):
+    textures = set()
+
+    for bwmodel in archive.models:
+        try:
+            textures.update(model_textures(bwmodel, archive.game))
+        except Exception as error:
+            errors[normalize_res_name(bwmodel.res_name)] = "{0}: {1}".format(type(error).__name__, error)
+
+    return textures
+
+
+# Remove the unused resources from archive, level_names are the names from the level's resource
+# list or None. Returns the kind and name of every removed resource and the errors of the models
+# that couldn't be read. If a model couldn't be read, no textures are removed.
+def slim_archive(archive, level_names=None):
+    errors = {}
+    textures = used_textures(archive, errors)
+    if level_names is not None:
+        textures.update(level_names)
+
+    seen = set()
+
+    def keep(kind, name):
+        if kind not in SHADOWED_KINDS:
+            return True
+
+        if (kind, name) in seen:
+            return False
+        seen.add((kind, name))
+
+        if level_names is None:
+            return True
+        elif kind in TEXTURE_KINDS:
+            return bool(errors) or name in textures
+        else:
+            return name in level_names
+
+    return archive.remove_resources(keep), errors
+
+
+# Write a slimmed copy of the archive at inpath to outpath. The archive is memory mapped and
+# the resources that are kept are written straight from it, so it is only read once.
+def slim_archive_file(inpath, outpath, level_names=None):
+    if os.path.exists(outpath) and os.path.samefile(inpath, outpath):
+        raise RuntimeError("The slimmed archive has to be written to another file")
+
+    opener = gzip.open if inpath.endswith(".gz") else open
+    with opener(inpath, "rb") as f:
+        archive = BWArchive(f, lazy=True)
+
+    old_size = len(archive.data)
+    removed, errors = slim_archive(archive, level_names)
+
+    opener = gzip.open if outpath.endswith(".gz") else open
+    with opener(outpath, "wb") as f:
+        new_size = archive.prepare()
+        archive.write_data(f)
+
+    return SlimReport(removed, errors, old_size, new_size)
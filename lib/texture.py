@@ -1,12 +1,12 @@
-from OpenGL.GL import *
+import zlib
 from io import BytesIO
 from array import array
-from struct import Struct
-from PyQt5.QtGui import QImage, QPainter
+from struct import Struct, pack
 from math import ceil, floor
 from timeit import default_timer
 
 from .read_binary import *
+from .texture_numpy import decode_i8, decode_ia8, decode_rgba8, decode_dxt1, decode_p8, read_s3tc
 
 
 def decode_rgb565(color_val):
@@ -51,6 +51,9 @@ pixelmask_format = Struct(">I")
 tileformat = Struct(">HHI")
 tileunpack = tileformat.unpack
 
+palette_format = Struct(">256H")
+palette_unpack = palette_format.unpack
+
 colors_unpack = colors_format.unpack
 pixelmask_unpack = pixelmask_format.unpack
 
@@ -68,28 +71,53 @@ P8BW1 = b'P8\x00\x00\x00\x00\x00\x00'#reversed(P8)
 RGBABW1 = b'A8R8G8B8'#reversed(RGBA)
 
 
+def _png_chunk(chunktype, data):
+    return pack(">I", len(data)) + chunktype + data + pack(">I", zlib.crc32(chunktype + data))
+
+
+# Write RGBA8 pixel data as a PNG file. Only needs zlib, so that textures
+# can be exported without Qt.
+def write_png(filepath, width, height, rgba):
+    stride = width * 4
+    rgba = memoryview(rgba)
+    # Every row starts with the filter type, 0 means no filter
+    rows = b"".join(b"\x00" + rgba[y*stride:(y+1)*stride] for y in range(height))
+
+    with open(filepath, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(_png_chunk(b"IHDR", pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        f.write(_png_chunk(b"IDAT", zlib.compress(rows, 6)))
+        f.write(_png_chunk(b"IEND", b""))
+
+
 class Texture(object):
-    def __init__(self, name):
+    # With keep_compressed, DXT1 textures aren't decoded if they can be turned into S3TC
+    # instead, s3tc is the S3TC data of the image then and rgba is None.
+    def __init__(self, name, keep_compressed=False):
         self.name = name
         self._loaded = False
+        self.keep_compressed = keep_compressed
+        self.s3tc = None
 
     def dump_to_file(self, filepath):
-        img = QImage(self.size_x, self.size_y, QImage.Format_ARGB32)
-        rgbadata = self.rgba
-        for ix in range(self.size_x):
-            for iy in range(self.size_y):
-                baseindex = ix * 4 + iy * self.size_x * 4
-                r = rgbadata[baseindex + 0]
-                g = rgbadata[baseindex + 1]
-                b = rgbadata[baseindex + 2]
-                a = rgbadata[baseindex + 3]
-                img.setPixel(ix, iy, (a << 24) | (r << 16) | (g << 8) | b)
-
-        img.save(filepath, "PNG")
+        if self.rgba is None:
+            raise RuntimeError("Texture {0} is kept compressed and can't be written as PNG".format(self.name))
+        write_png(filepath, self.size_x, self.size_y, self.rgba)
 
     def is_loaded(self):
         return self._loaded
 
+    # Read the texture with the reader for the game the archive is from.
+    def from_file_game(self, f, game):
+        if game == "BW1":
+            self.from_file_bw1(f)
+        elif game == "BW2":
+            self.from_file(f)
+        elif game == "AQ":
+            self.from_file_aragorn(f)
+        else:
+            raise RuntimeError("Unknown game: {0}".format(game))
+
     def from_file(self, f):
         start = default_timer()
 
@@ -110,7 +138,7 @@ class Texture(object):
         self.size_x = read_uint32(f)
         self.size_y = read_uint32(f)
         self.mipcount2 = read_uint32(f)
-        print(self.name)
+        #print(self.name)
         #print(self.size_x, self.size_x2)
         #print(self.size_y, self.size_y2)
         assert self.size_x == self.size_x2
@@ -118,7 +146,7 @@ class Texture(object):
         assert self.mipcount == self.mipcount2
         self.success = True
 
-        print(name, self.format)
+        #print(name, self.format)
         assert self.format[8:] == b"8B8G8R8A"
         if self.mipcount == 0:
             self.success = False
@@ -145,221 +173,234 @@ class Texture(object):
             #for ii in range(0, len(pic_data) // 8, 4):
             #    for ii2 in range_4:
             #        block = pic_data[(ii + ii2) * 8:(ii + ii2 + 1) * 8]
-            for ii in range(0, pimsize // 8):
-
-                #col0, col1 = colors_unpack(block[:4])
-                #pixmask = pixelmask_unpack(block[4:])[0]
-
-                col0, col1, pixmask = tileunpack(read(8))
-
-                color0 = decode_rgb565(col0)
-                color1 = decode_rgb565(col1)
-
-                ii2 = ii % 4
-                iix = (ii2 % 2) * 4
-                iiy = (ii2 // 2) * 4
-
-                if col0 > col1:
-                    color2_r = (2 * color0[0] + color1[0]) // 3
-                    color2_g = (2 * color0[1] + color1[1]) // 3
-                    color2_b = (2 * color0[2] + color1[2]) // 3
-                    #color2_a = 255
-
-                    color3_r = (2 * color1[0] + color0[0]) // 3
-                    color3_g = (2 * color1[1] + color0[1]) // 3
-                    color3_b = (2 * color1[2] + color0[2]) // 3
-                    color3_a = 255
-                else:
-                    color2_r = (color0[0] + color1[0]) // 2
-                    color2_g = (color0[1] + color1[1]) // 2
-                    color2_b = (color0[2] + color1[2]) // 2
-                    #color2_a = 255
-                    color3_r = 0
-                    color3_g = 0
-                    color3_b = 0
-                    color3_a = 0
-
-                #colortable = (color0, color1,
-                #              (color2_r, color2_g, color2_b, color2_a),
-                #              (color3_r, color3_g, color3_b, color3_a))
-                for iii in range_16:
-                    iy = iii // 4
-                    ix = iii % 4
-                    index = (pixmask >> ((15 - (iy*4 + ix)) * 2)) & 0b11
-
-                    if index == 0:
-                        r, g, b = color0
-                        a = 255
-                    elif index == 1:
-                        r, g, b = color1
-                        a = 255
-                    elif index == 2:
-                        #r, g, b, a = color2_r, color2_g, color2_b, color2_a
-                        r = color2_r
-                        g = color2_g
-                        b = color2_b
-                        a = 255 #color2_a
-                    elif index == 3:
-                        #r, g, b, a = color3_r, color3_g, color3_b, color3_a
-                        r = color3_r
-                        g = color3_g
-                        b = color3_b
-                        a = color3_a
-                    else:
-                        raise RuntimeError("This shouldn't happen: Invalid index {0}".format(index))
+            if self.keep_compressed:
+                self.s3tc = read_s3tc(f, size_x, size_y, pimsize // 8)
 
-                    array_x = x + ix + iix
-                    array_y = y + iy + iiy
-                    if array_x < size_x and array_y < size_y:
+            if self.s3tc is not None:
+                self.rgba = None
+            elif not decode_dxt1(f, size_x, size_y, pimsize // 8, rgbadata):
+                for ii in range(0, pimsize // 8):
 
-                        rgbadata[array_x*4 + array_y*size_x*4 + 0] = r
-                        rgbadata[array_x*4 + array_y * size_x*4 + 1] = g
-                        rgbadata[array_x*4 + array_y * size_x*4 + 2] = b
-                        rgbadata[array_x*4 + array_y * size_x*4 + 3] = a
-                        #else:
-                    #    print("tried to write outside of bounds:", size_x, size_y, x + ix + iix, y + iy + iiy)
+                    #col0, col1 = colors_unpack(block[:4])
+                    #pixmask = pixelmask_unpack(block[4:])[0]
 
-                if ii2 == 3:
-                    x += 8
-                    if x >= size_x:
-                        x = 0
-                        y += 8
+                    col0, col1, pixmask = tileunpack(read(8))
+
+                    color0 = decode_rgb565(col0)
+                    color1 = decode_rgb565(col1)
+
+                    ii2 = ii % 4
+                    iix = (ii2 % 2) * 4
+                    iiy = (ii2 // 2) * 4
+
+                    if col0 > col1:
+                        color2_r = (2 * color0[0] + color1[0]) // 3
+                        color2_g = (2 * color0[1] + color1[1]) // 3
+                        color2_b = (2 * color0[2] + color1[2]) // 3
+                        #color2_a = 255
+
+                        color3_r = (2 * color1[0] + color0[0]) // 3
+                        color3_g = (2 * color1[1] + color0[1]) // 3
+                        color3_b = (2 * color1[2] + color0[2]) // 3
+                        color3_a = 255
+                    else:
+                        color2_r = (color0[0] + color1[0]) // 2
+                        color2_g = (color0[1] + color1[1]) // 2
+                        color2_b = (color0[2] + color1[2]) // 2
+                        #color2_a = 255
+                        color3_r = 0
+                        color3_g = 0
+                        color3_b = 0
+                        color3_a = 0
+
+                    #colortable = (color0, color1,
+                    #              (color2_r, color2_g, color2_b, color2_a),
+                    #              (color3_r, color3_g, color3_b, color3_a))
+                    for iii in range_16:
+                        iy = iii // 4
+                        ix = iii % 4
+                        index = (pixmask >> ((15 - (iy*4 + ix)) * 2)) & 0b11
+
+                        if index == 0:
+                            r, g, b = color0
+                            a = 255
+                        elif index == 1:
+                            r, g, b = color1
+                            a = 255
+                        elif index == 2:
+                            #r, g, b, a = color2_r, color2_g, color2_b, color2_a
+                            r = color2_r
+                            g = color2_g
+                            b = color2_b
+                            a = 255 #color2_a
+                        elif index == 3:
+                            #r, g, b, a = color3_r, color3_g, color3_b, color3_a
+                            r = color3_r
+                            g = color3_g
+                            b = color3_b
+                            a = color3_a
+                        else:
+                            raise RuntimeError("This shouldn't happen: Invalid index {0}".format(index))
+
+                        array_x = x + ix + iix
+                        array_y = y + iy + iiy
+                        if array_x < size_x and array_y < size_y:
+
+                            rgbadata[array_x*4 + array_y*size_x*4 + 0] = r
+                            rgbadata[array_x*4 + array_y * size_x*4 + 1] = g
+                            rgbadata[array_x*4 + array_y * size_x*4 + 2] = b
+                            rgbadata[array_x*4 + array_y * size_x*4 + 3] = a
+                            #else:
+                        #    print("tried to write outside of bounds:", size_x, size_y, x + ix + iix, y + iy + iiy)
+
+                    if ii2 == 3:
+                        x += 8
+                        if x >= size_x:
+                            x = 0
+                            y += 8
 
         elif texformat == I8:
             assert f.read(4) == b" PIM"
             pimsize = read_uint32_le(f)
             #pic_data = f.read(pimsize)
 
-            blocks_horizontal = int(ceil(size_x / 4.0))
-            blocks_vertical = int(ceil(size_y / 4.0))
+            if not decode_i8(f, size_x, size_y, rgbadata):
+                blocks_horizontal = int(ceil(size_x / 4.0))
+                blocks_vertical = int(ceil(size_y / 4.0))
 
-            for iy in range(blocks_vertical):
-                for ix in range(blocks_horizontal):
-                    block = f.read(4*4*1)
+                for iy in range(blocks_vertical):
+                    for ix in range(blocks_horizontal):
+                        block = f.read(4*4*1)
 
-                    for y in range(4):
-                        for x in range(4):
-                            alphaintensity = block[(x + y * 4)]
+                        for y in range(4):
+                            for x in range(4):
+                                alphaintensity = block[(x + y * 4)]
 
-                            imgx = ix * 4 + x
-                            imgy = iy * 4 + y
+                                imgx = ix * 4 + x
+                                imgy = iy * 4 + y
 
-                            if imgx >= size_x or imgy >= size_y:
-                                continue
+                                if imgx >= size_x or imgy >= size_y:
+                                    continue
 
-                            rgbadata[(imgx + imgy * size_x) * 4 + 0] = alphaintensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 1] = alphaintensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 2] = alphaintensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 3] = alphaintensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 0] = alphaintensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 1] = alphaintensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 2] = alphaintensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 3] = alphaintensity
 
         elif texformat == IA8:
             assert f.read(4) == b" PIM"
             pimsize = read_uint32_le(f)
             #pic_data = f.read(pimsize)
 
-            blocks_horizontal = int(ceil(size_x / 4.0))
-            blocks_vertical = int(ceil(size_y / 4.0))
+            if not decode_ia8(f, size_x, size_y, rgbadata):
+                blocks_horizontal = int(ceil(size_x / 4.0))
+                blocks_vertical = int(ceil(size_y / 4.0))
 
-            for iy in range(blocks_vertical):
-                for ix in range(blocks_horizontal):
-                    block = f.read(4*4*2)
+                for iy in range(blocks_vertical):
+                    for ix in range(blocks_horizontal):
+                        block = f.read(4*4*2)
 
-                    for y in range(4):
-                        for x in range(4):
-                            intensity = block[(x + y*4)*2 + 1]
-                            alpha = block[(x + y * 4) * 2 + 0]
+                        for y in range(4):
+                            for x in range(4):
+                                intensity = block[(x + y*4)*2 + 1]
+                                alpha = block[(x + y * 4) * 2 + 0]
 
-                            imgx = ix * 4 + x
-                            imgy = iy * 4 + y
+                                imgx = ix * 4 + x
+                                imgy = iy * 4 + y
 
-                            if imgx >= size_x or imgy >= size_y:
-                                continue
+                                if imgx >= size_x or imgy >= size_y:
+                                    continue
 
-                            rgbadata[(imgx + imgy * size_x) * 4 + 0] = intensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 1] = intensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 2] = intensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 3] = alpha
+                                rgbadata[(imgx + imgy * size_x) * 4 + 0] = intensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 1] = intensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 2] = intensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 3] = alpha
 
         elif texformat == P8:
             assert f.read(4) == b" LAP"
             pimsize = read_uint32_le(f)
             assert pimsize == 512
 
-            palette = []
-            for i in range(256):
-                palette.append(decode_rgb5a3(read_uint16(f)))
-                #palette.append(decode_rgb565(read_uint16(f)))
+            palette_data = f.read(pimsize)
 
             assert f.read(4) == b" PIM"
             datalen = read_uint32_le(f)
 
-            blocks_vertical = int(ceil(size_y / 4.0))
-            blocks_horizontal = int(ceil(size_x / 8.0))
+            if not decode_p8(f, size_x, size_y, palette_data, rgbadata):
+                palette = []
+                for color in palette_unpack(palette_data):
+                    palette.append(decode_rgb5a3(color))
+                    #palette.append(decode_rgb565(color))
 
-            for iy in range(blocks_vertical):
-                for ix in range(blocks_horizontal):
-                    block = f.read(8*4*1)
-                    if len(block) < 32:
-                        break
+                blocks_vertical = int(ceil(size_y / 4.0))
+                blocks_horizontal = int(ceil(size_x / 8.0))
 
-                    for y in range(4):
-                        for x in range(8):
-                            imgx = ix * 8 + x
-                            imgy = iy * 4 + y
+                for iy in range(blocks_vertical):
+                    for ix in range(blocks_horizontal):
+                        block = f.read(8*4*1)
+                        if len(block) < 32:
+                            break
 
-                            if imgx >= size_x or imgy >= size_y:
-                                continue
+                        for y in range(4):
+                            for x in range(8):
+                                imgx = ix * 8 + x
+                                imgy = iy * 4 + y
 
-                            #intensity = block[(x + y*4)*2 + 1]
-                            #alpha = block[(x + y * 4) * 2 + 0]
-                            index = block[x + y*8]
-                            r, g, b, a = palette[index]# index, index, index, 255#palette[index]
+                                if imgx >= size_x or imgy >= size_y:
+                                    continue
 
+                                #intensity = block[(x + y*4)*2 + 1]
+                                #alpha = block[(x + y * 4) * 2 + 0]
+                                index = block[x + y*8]
+                                r, g, b, a = palette[index]# index, index, index, 255#palette[index]
 
 
-                            rgbadata[(imgx + imgy * size_x) * 4 + 0] = r
-                            rgbadata[(imgx + imgy * size_x) * 4 + 1] = g
-                            rgbadata[(imgx + imgy * size_x) * 4 + 2] = b
-                            rgbadata[(imgx + imgy * size_x) * 4 + 3] = a
+
+                                rgbadata[(imgx + imgy * size_x) * 4 + 0] = r
+                                rgbadata[(imgx + imgy * size_x) * 4 + 1] = g
+                                rgbadata[(imgx + imgy * size_x) * 4 + 2] = b
+                                rgbadata[(imgx + imgy * size_x) * 4 + 3] = a
 
         elif texformat == RGBA:
             assert f.read(4) == b" PIM"
             pimsize = read_uint32_le(f)
             #print("size")
 
-            for i in range(pimsize//64):
-                for iy in range(4):
-                    for ix in range(4):
-                        #ix = 3 - ix
-                        #iy = 3 - iy
-                        imgx = x + ix
-                        imgy = y + iy
-
-                        if imgx >= size_x or imgy >= size_y:
-                            continue
+            if not decode_rgba8(f, size_x, size_y, pimsize, rgbadata):
+                for i in range(pimsize//64):
+                    for iy in range(4):
+                        for ix in range(4):
+                            #ix = 3 - ix
+                            #iy = 3 - iy
+                            imgx = x + ix
+                            imgy = y + iy
+
+                            # The pixels outside of the image are in the data as well
+                            a, r = read_uint8(f), read_uint8(f)
+                            if imgx >= size_x or imgy >= size_y:
+                                continue
 
-                        a, r = read_uint8(f), read_uint8(f)
-                        rgbadata[(imgx + imgy * size_x) * 4 + 0] = r
-                        rgbadata[(imgx + imgy * size_x) * 4 + 3] = a
+                            rgbadata[(imgx + imgy * size_x) * 4 + 0] = r
+                            rgbadata[(imgx + imgy * size_x) * 4 + 3] = a
 
-                for iy in range(4):
-                    for ix in range(4):
-                        #ix = 3 - ix
-                        #iy = 3 - iy
-                        imgx = x + ix
-                        imgy = y + iy
+                    for iy in range(4):
+                        for ix in range(4):
+                            #ix = 3 - ix
+                            #iy = 3 - iy
+                            imgx = x + ix
+                            imgy = y + iy
 
-                        if imgx >= size_x or imgy >= size_y:
-                            continue
+                            g, b = read_uint8(f), read_uint8(f)
+                            if imgx >= size_x or imgy >= size_y:
+                                continue
 
-                        g, b = read_uint8(f), read_uint8(f)
-                        rgbadata[(imgx + imgy * size_x) * 4 + 1] = g
-                        rgbadata[(imgx + imgy * size_x) * 4 + 2] = b
+                            rgbadata[(imgx + imgy * size_x) * 4 + 1] = g
+                            rgbadata[(imgx + imgy * size_x) * 4 + 2] = b
 
-                x += 4
-                if x >= size_x:
-                    x = 0
-                    y += 4
+                    x += 4
+                    if x >= size_x:
+                        x = 0
+                        y += 4
 
 
         else:
@@ -371,7 +412,8 @@ class Texture(object):
         #print(self.size_x, self.size_y)
         #print("conversion took", default_timer()-start)
         start = default_timer()
-        self.rgba = bytes(self.rgba)
+        if self.rgba is not None:
+            self.rgba = bytes(self.rgba)
         self._loaded = True
         self.success = True
         #print("final steps took", default_timer()-start)
@@ -404,7 +446,7 @@ class Texture(object):
         assert self.mipcount > 0
         self.success = True
 
-        print(name, self.format)
+        #print(name, self.format)
         assert self.format[8:] == b"8B8G8R8A"
         if self.mipcount == 0:
             self.success = False
@@ -432,85 +474,91 @@ class Texture(object):
             #for ii in range(0, len(pic_data) // 8, 4):
             #    for ii2 in range_4:
             #        block = pic_data[(ii + ii2) * 8:(ii + ii2 + 1) * 8]
-            for ii in range(0, (pimsize-0x18) // 8):
-
-                #col0, col1 = colors_unpack(block[:4])
-                #pixmask = pixelmask_unpack(block[4:])[0]
-
-                col0, col1, pixmask = tileunpack(read(8))
-
-                color0 = decode_rgb565(col0)
-                color1 = decode_rgb565(col1)
-
-                ii2 = ii % 4
-                iix = (ii2 % 2) * 4
-                iiy = (ii2 // 2) * 4
-
-                if col0 > col1:
-                    color2_r = (2 * color0[0] + color1[0]) // 3
-                    color2_g = (2 * color0[1] + color1[1]) // 3
-                    color2_b = (2 * color0[2] + color1[2]) // 3
-                    #color2_a = 255
-
-                    color3_r = (2 * color1[0] + color0[0]) // 3
-                    color3_g = (2 * color1[1] + color0[1]) // 3
-                    color3_b = (2 * color1[2] + color0[2]) // 3
-                    color3_a = 255
-                else:
-                    color2_r = (color0[0] + color1[0]) // 2
-                    color2_g = (color0[1] + color1[1]) // 2
-                    color2_b = (color0[2] + color1[2]) // 2
-                    #color2_a = 255
-                    color3_r = 0
-                    color3_g = 0
-                    color3_b = 0
-                    color3_a = 0
-
-                #colortable = (color0, color1,
-                #              (color2_r, color2_g, color2_b, color2_a),
-                #              (color3_r, color3_g, color3_b, color3_a))
-                for iii in range_16:
-                    iy = iii // 4
-                    ix = iii % 4
-                    index = (pixmask >> ((15 - (iy*4 + ix)) * 2)) & 0b11
-
-                    if index == 0:
-                        r, g, b = color0
-                        a = 255
-                    elif index == 1:
-                        r, g, b = color1
-                        a = 255
-                    elif index == 2:
-                        #r, g, b, a = color2_r, color2_g, color2_b, color2_a
-                        r = color2_r
-                        g = color2_g
-                        b = color2_b
-                        a = 255 #color2_a
-                    elif index == 3:
-                        #r, g, b, a = color3_r, color3_g, color3_b, color3_a
-                        r = color3_r
-                        g = color3_g
-                        b = color3_b
-                        a = color3_a
-                    else:
-                        raise RuntimeError("This shouldn't happen: Invalid index {0}".format(index))
+            if self.keep_compressed:
+                self.s3tc = read_s3tc(f, size_x, size_y, (pimsize-0x18) // 8)
 
-                    array_x = x + ix + iix
-                    array_y = y + iy + iiy
-                    if array_x < size_x and array_y < size_y:
+            if self.s3tc is not None:
+                self.rgba = None
+            elif not decode_dxt1(f, size_x, size_y, (pimsize-0x18) // 8, rgbadata):
+                for ii in range(0, (pimsize-0x18) // 8):
 
-                        rgbadata[array_x*4 + array_y*size_x*4 + 0] = r
-                        rgbadata[array_x*4 + array_y * size_x*4 + 1] = g
-                        rgbadata[array_x*4 + array_y * size_x*4 + 2] = b
-                        rgbadata[array_x*4 + array_y * size_x*4 + 3] = a
-                        #else:
-                    #    print("tried to write outside of bounds:", size_x, size_y, x + ix + iix, y + iy + iiy)
+                    #col0, col1 = colors_unpack(block[:4])
+                    #pixmask = pixelmask_unpack(block[4:])[0]
 
-                if ii2 == 3:
-                    x += 8
-                    if x >= size_x:
-                        x = 0
-                        y += 8
+                    col0, col1, pixmask = tileunpack(read(8))
+
+                    color0 = decode_rgb565(col0)
+                    color1 = decode_rgb565(col1)
+
+                    ii2 = ii % 4
+                    iix = (ii2 % 2) * 4
+                    iiy = (ii2 // 2) * 4
+
+                    if col0 > col1:
+                        color2_r = (2 * color0[0] + color1[0]) // 3
+                        color2_g = (2 * color0[1] + color1[1]) // 3
+                        color2_b = (2 * color0[2] + color1[2]) // 3
+                        #color2_a = 255
+
+                        color3_r = (2 * color1[0] + color0[0]) // 3
+                        color3_g = (2 * color1[1] + color0[1]) // 3
+                        color3_b = (2 * color1[2] + color0[2]) // 3
+                        color3_a = 255
+                    else:
+                        color2_r = (color0[0] + color1[0]) // 2
+                        color2_g = (color0[1] + color1[1]) // 2
+                        color2_b = (color0[2] + color1[2]) // 2
+                        #color2_a = 255
+                        color3_r = 0
+                        color3_g = 0
+                        color3_b = 0
+                        color3_a = 0
+
+                    #colortable = (color0, color1,
+                    #              (color2_r, color2_g, color2_b, color2_a),
+                    #              (color3_r, color3_g, color3_b, color3_a))
+                    for iii in range_16:
+                        iy = iii // 4
+                        ix = iii % 4
+                        index = (pixmask >> ((15 - (iy*4 + ix)) * 2)) & 0b11
+
+                        if index == 0:
+                            r, g, b = color0
+                            a = 255
+                        elif index == 1:
+                            r, g, b = color1
+                            a = 255
+                        elif index == 2:
+                            #r, g, b, a = color2_r, color2_g, color2_b, color2_a
+                            r = color2_r
+                            g = color2_g
+                            b = color2_b
+                            a = 255 #color2_a
+                        elif index == 3:
+                            #r, g, b, a = color3_r, color3_g, color3_b, color3_a
+                            r = color3_r
+                            g = color3_g
+                            b = color3_b
+                            a = color3_a
+                        else:
+                            raise RuntimeError("This shouldn't happen: Invalid index {0}".format(index))
+
+                        array_x = x + ix + iix
+                        array_y = y + iy + iiy
+                        if array_x < size_x and array_y < size_y:
+
+                            rgbadata[array_x*4 + array_y*size_x*4 + 0] = r
+                            rgbadata[array_x*4 + array_y * size_x*4 + 1] = g
+                            rgbadata[array_x*4 + array_y * size_x*4 + 2] = b
+                            rgbadata[array_x*4 + array_y * size_x*4 + 3] = a
+                            #else:
+                        #    print("tried to write outside of bounds:", size_x, size_y, x + ix + iix, y + iy + iiy)
+
+                    if ii2 == 3:
+                        x += 8
+                        if x >= size_x:
+                            x = 0
+                            y += 8
 
         elif texformat == I8:
             assert f.read(4) == b"RPIM"
@@ -518,27 +566,28 @@ class Texture(object):
             f.read(0x18)  # padding
             #pic_data = f.read(pimsize)
 
-            blocks_horizontal = int(ceil(size_x / 4.0))
-            blocks_vertical = int(ceil(size_y / 4.0))
+            if not decode_i8(f, size_x, size_y, rgbadata):
+                blocks_horizontal = int(ceil(size_x / 4.0))
+                blocks_vertical = int(ceil(size_y / 4.0))
 
-            for iy in range(blocks_vertical):
-                for ix in range(blocks_horizontal):
-                    block = f.read(4*4*1)
+                for iy in range(blocks_vertical):
+                    for ix in range(blocks_horizontal):
+                        block = f.read(4*4*1)
 
-                    for y in range(4):
-                        for x in range(4):
-                            alphaintensity = block[(x + y * 4)]
+                        for y in range(4):
+                            for x in range(4):
+                                alphaintensity = block[(x + y * 4)]
 
-                            imgx = ix * 4 + x
-                            imgy = iy * 4 + y
+                                imgx = ix * 4 + x
+                                imgy = iy * 4 + y
 
-                            if imgx >= size_x or imgy >= size_y:
-                                continue
+                                if imgx >= size_x or imgy >= size_y:
+                                    continue
 
-                            rgbadata[(imgx + imgy * size_x) * 4 + 0] = alphaintensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 1] = alphaintensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 2] = alphaintensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 3] = alphaintensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 0] = alphaintensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 1] = alphaintensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 2] = alphaintensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 3] = alphaintensity
 
         elif texformat == IA8:
             assert f.read(4) == b"RPIM"
@@ -546,72 +595,76 @@ class Texture(object):
             f.read(0x18)  # padding
             #pic_data = f.read(pimsize)
 
-            blocks_horizontal = int(ceil(size_x / 4.0))
-            blocks_vertical = int(ceil(size_y / 4.0))
+            if not decode_ia8(f, size_x, size_y, rgbadata):
+                blocks_horizontal = int(ceil(size_x / 4.0))
+                blocks_vertical = int(ceil(size_y / 4.0))
 
-            for iy in range(blocks_vertical):
-                for ix in range(blocks_horizontal):
-                    block = f.read(4*4*2)
+                for iy in range(blocks_vertical):
+                    for ix in range(blocks_horizontal):
+                        block = f.read(4*4*2)
 
-                    for y in range(4):
-                        for x in range(4):
-                            intensity = block[(x + y*4)*2 + 1]
-                            alpha = block[(x + y * 4) * 2 + 0]
+                        for y in range(4):
+                            for x in range(4):
+                                intensity = block[(x + y*4)*2 + 1]
+                                alpha = block[(x + y * 4) * 2 + 0]
 
-                            imgx = ix * 4 + x
-                            imgy = iy * 4 + y
+                                imgx = ix * 4 + x
+                                imgy = iy * 4 + y
 
-                            if imgx >= size_x or imgy >= size_y:
-                                continue
+                                if imgx >= size_x or imgy >= size_y:
+                                    continue
 
-                            rgbadata[(imgx + imgy * size_x) * 4 + 0] = intensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 1] = intensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 2] = intensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 3] = alpha
+                                rgbadata[(imgx + imgy * size_x) * 4 + 0] = intensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 1] = intensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 2] = intensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 3] = alpha
 
         elif texformat == P8:
             assert f.read(4) == b" LAP"
             pimsize = read_uint32_le(f)
             assert pimsize == 512
 
-            palette = []
-            for i in range(256):
-                palette.append(decode_rgb5a3(read_uint16(f)))
-                #palette.append(decode_rgb565(read_uint16(f)))
+            palette_data = f.read(pimsize)
 
             assert f.read(4) == b"RPIM"
 
             datalen = read_uint32_le(f)
             f.read(0x18)  # padding
 
-            blocks_vertical = int(ceil(size_y / 4.0))
-            blocks_horizontal = int(ceil(size_x / 8.0))
+            if not decode_p8(f, size_x, size_y, palette_data, rgbadata):
+                palette = []
+                for color in palette_unpack(palette_data):
+                    palette.append(decode_rgb5a3(color))
+                    #palette.append(decode_rgb565(color))
 
-            for iy in range(blocks_vertical):
-                for ix in range(blocks_horizontal):
-                    block = f.read(8*4*1)
-                    if len(block) < 32:
-                        break
+                blocks_vertical = int(ceil(size_y / 4.0))
+                blocks_horizontal = int(ceil(size_x / 8.0))
 
-                    for y in range(4):
-                        for x in range(8):
-                            imgx = ix * 8 + x
-                            imgy = iy * 4 + y
+                for iy in range(blocks_vertical):
+                    for ix in range(blocks_horizontal):
+                        block = f.read(8*4*1)
+                        if len(block) < 32:
+                            break
 
-                            if imgx >= size_x or imgy >= size_y:
-                                continue
+                        for y in range(4):
+                            for x in range(8):
+                                imgx = ix * 8 + x
+                                imgy = iy * 4 + y
 
-                            #intensity = block[(x + y*4)*2 + 1]
-                            #alpha = block[(x + y * 4) * 2 + 0]
-                            index = block[x + y*8]
-                            r, g, b, a = palette[index]# index, index, index, 255#palette[index]
+                                if imgx >= size_x or imgy >= size_y:
+                                    continue
 
+                                #intensity = block[(x + y*4)*2 + 1]
+                                #alpha = block[(x + y * 4) * 2 + 0]
+                                index = block[x + y*8]
+                                r, g, b, a = palette[index]# index, index, index, 255#palette[index]
 
 
-                            rgbadata[(imgx + imgy * size_x) * 4 + 0] = r
-                            rgbadata[(imgx + imgy * size_x) * 4 + 1] = g
-                            rgbadata[(imgx + imgy * size_x) * 4 + 2] = b
-                            rgbadata[(imgx + imgy * size_x) * 4 + 3] = a
+
+                                rgbadata[(imgx + imgy * size_x) * 4 + 0] = r
+                                rgbadata[(imgx + imgy * size_x) * 4 + 1] = g
+                                rgbadata[(imgx + imgy * size_x) * 4 + 2] = b
+                                rgbadata[(imgx + imgy * size_x) * 4 + 3] = a
 
         elif texformat == RGBA:
             assert f.read(4) == b"RPIM"
@@ -619,39 +672,41 @@ class Texture(object):
             f.read(0x18)  # padding
             #print("size")
 
-            for i in range(pimsize//64):
-                for iy in range(4):
-                    for ix in range(4):
-                        #ix = 3 - ix
-                        #iy = 3 - iy
-                        imgx = x + ix
-                        imgy = y + iy
-
-                        if imgx >= size_x or imgy >= size_y:
-                            continue
+            if not decode_rgba8(f, size_x, size_y, pimsize, rgbadata):
+                for i in range(pimsize//64):
+                    for iy in range(4):
+                        for ix in range(4):
+                            #ix = 3 - ix
+                            #iy = 3 - iy
+                            imgx = x + ix
+                            imgy = y + iy
+
+                            # The pixels outside of the image are in the data as well
+                            a, r = read_uint8(f), read_uint8(f)
+                            if imgx >= size_x or imgy >= size_y:
+                                continue
 
-                        a, r = read_uint8(f), read_uint8(f)
-                        rgbadata[(imgx + imgy * size_x) * 4 + 0] = r
-                        rgbadata[(imgx + imgy * size_x) * 4 + 3] = a
+                            rgbadata[(imgx + imgy * size_x) * 4 + 0] = r
+                            rgbadata[(imgx + imgy * size_x) * 4 + 3] = a
 
-                for iy in range(4):
-                    for ix in range(4):
-                        #ix = 3 - ix
-                        #iy = 3 - iy
-                        imgx = x + ix
-                        imgy = y + iy
+                    for iy in range(4):
+                        for ix in range(4):
+                            #ix = 3 - ix
+                            #iy = 3 - iy
+                            imgx = x + ix
+                            imgy = y + iy
 
-                        if imgx >= size_x or imgy >= size_y:
-                            continue
+                            g, b = read_uint8(f), read_uint8(f)
+                            if imgx >= size_x or imgy >= size_y:
+                                continue
 
-                        g, b = read_uint8(f), read_uint8(f)
-                        rgbadata[(imgx + imgy * size_x) * 4 + 1] = g
-                        rgbadata[(imgx + imgy * size_x) * 4 + 2] = b
+                            rgbadata[(imgx + imgy * size_x) * 4 + 1] = g
+                            rgbadata[(imgx + imgy * size_x) * 4 + 2] = b
 
-                x += 4
-                if x >= size_x:
-                    x = 0
-                    y += 4
+                    x += 4
+                    if x >= size_x:
+                        x = 0
+                        y += 4
 
 
         else:
@@ -663,7 +718,8 @@ class Texture(object):
         #print(self.size_x, self.size_y)
         #print("conversion took", default_timer()-start)
         start = default_timer()
-        self.rgba = bytes(self.rgba)
+        if self.rgba is not None:
+            self.rgba = bytes(self.rgba)
         self._loaded = True
         self.success = True
         #print("final steps took", default_timer()-start)
@@ -690,8 +746,8 @@ class Texture(object):
         #assert self.mipcount == self.mipcount2
         self.success = True
 
-        print(name, self.format)
-        print(self.size_x, self.size_y)
+        #print(name, self.format)
+        #print(self.size_x, self.size_y)
         assert self.format[8:] == b"A8R8G8B8"
         if self.mipcount == 0:
             self.success = False
@@ -718,211 +774,224 @@ class Texture(object):
             #for ii in range(0, len(pic_data) // 8, 4):
             #    for ii2 in range_4:
             #        block = pic_data[(ii + ii2) * 8:(ii + ii2 + 1) * 8]
-            for ii in range(0, pimsize // 8):
-
-                #col0, col1 = colors_unpack(block[:4])
-                #pixmask = pixelmask_unpack(block[4:])[0]
-
-                col0, col1, pixmask = tileunpack(read(8))
-
-                color0 = decode_rgb565(col0)
-                color1 = decode_rgb565(col1)
-
-                ii2 = ii % 4
-                iix = (ii2 % 2) * 4
-                iiy = (ii2 // 2) * 4
-
-                if col0 > col1:
-                    color2_r = (2 * color0[0] + color1[0]) // 3
-                    color2_g = (2 * color0[1] + color1[1]) // 3
-                    color2_b = (2 * color0[2] + color1[2]) // 3
-                    #color2_a = 255
-
-                    color3_r = (2 * color1[0] + color0[0]) // 3
-                    color3_g = (2 * color1[1] + color0[1]) // 3
-                    color3_b = (2 * color1[2] + color0[2]) // 3
-                    color3_a = 255
-                else:
-                    color2_r = (color0[0] + color1[0]) // 2
-                    color2_g = (color0[1] + color1[1]) // 2
-                    color2_b = (color0[2] + color1[2]) // 2
-                    #color2_a = 255
-                    color3_r = 0
-                    color3_g = 0
-                    color3_b = 0
-                    color3_a = 0
-
-                #colortable = (color0, color1,
-                #              (color2_r, color2_g, color2_b, color2_a),
-                #              (color3_r, color3_g, color3_b, color3_a))
-                for iii in range_16:
-                    iy = iii // 4
-                    ix = iii % 4
-                    index = (pixmask >> ((15 - (iy*4 + ix)) * 2)) & 0b11
-
-                    if index == 0:
-                        r, g, b = color0
-                        a = 255
-                    elif index == 1:
-                        r, g, b = color1
-                        a = 255
-                    elif index == 2:
-                        #r, g, b, a = color2_r, color2_g, color2_b, color2_a
-                        r = color2_r
-                        g = color2_g
-                        b = color2_b
-                        a = 255 #color2_a
-                    elif index == 3:
-                        #r, g, b, a = color3_r, color3_g, color3_b, color3_a
-                        r = color3_r
-                        g = color3_g
-                        b = color3_b
-                        a = color3_a
+            if self.keep_compressed:
+                self.s3tc = read_s3tc(f, size_x, size_y, pimsize // 8)
+
+            if self.s3tc is not None:
+                self.rgba = None
+            elif not decode_dxt1(f, size_x, size_y, pimsize // 8, rgbadata):
+                for ii in range(0, pimsize // 8):
+
+                    #col0, col1 = colors_unpack(block[:4])
+                    #pixmask = pixelmask_unpack(block[4:])[0]
+
+                    col0, col1, pixmask = tileunpack(read(8))
+
+                    color0 = decode_rgb565(col0)
+                    color1 = decode_rgb565(col1)
+
+                    ii2 = ii % 4
+                    iix = (ii2 % 2) * 4
+                    iiy = (ii2 // 2) * 4
+
+                    if col0 > col1:
+                        color2_r = (2 * color0[0] + color1[0]) // 3
+                        color2_g = (2 * color0[1] + color1[1]) // 3
+                        color2_b = (2 * color0[2] + color1[2]) // 3
+                        #color2_a = 255
+
+                        color3_r = (2 * color1[0] + color0[0]) // 3
+                        color3_g = (2 * color1[1] + color0[1]) // 3
+                        color3_b = (2 * color1[2] + color0[2]) // 3
+                        color3_a = 255
                     else:
-                        raise RuntimeError("This shouldn't happen: Invalid index {0}".format(index))
-
-                    array_x = x + ix + iix
-                    array_y = y + iy + iiy
-                    if array_x < size_x and array_y < size_y:
-                        rgbadata[array_x*4 + array_y*size_x*4 + 0] = r
-                        rgbadata[array_x*4 + array_y * size_x*4 + 1] = g
-                        rgbadata[array_x*4 + array_y * size_x*4 + 2] = b
-                        rgbadata[array_x*4 + array_y * size_x*4 + 3] = a
-                        #else:
-                    #    print("tried to write outside of bounds:", size_x, size_y, x + ix + iix, y + iy + iiy)
-
-                if ii2 == 3:
-                    x += 8
-                    if x >= size_x:
-                        x = 0
-                        y += 8
+                        color2_r = (color0[0] + color1[0]) // 2
+                        color2_g = (color0[1] + color1[1]) // 2
+                        color2_b = (color0[2] + color1[2]) // 2
+                        #color2_a = 255
+                        color3_r = 0
+                        color3_g = 0
+                        color3_b = 0
+                        color3_a = 0
+
+                    #colortable = (color0, color1,
+                    #              (color2_r, color2_g, color2_b, color2_a),
+                    #              (color3_r, color3_g, color3_b, color3_a))
+                    for iii in range_16:
+                        iy = iii // 4
+                        ix = iii % 4
+                        index = (pixmask >> ((15 - (iy*4 + ix)) * 2)) & 0b11
+
+                        if index == 0:
+                            r, g, b = color0
+                            a = 255
+                        elif index == 1:
+                            r, g, b = color1
+                            a = 255
+                        elif index == 2:
+                            #r, g, b, a = color2_r, color2_g, color2_b, color2_a
+                            r = color2_r
+                            g = color2_g
+                            b = color2_b
+                            a = 255 #color2_a
+                        elif index == 3:
+                            #r, g, b, a = color3_r, color3_g, color3_b, color3_a
+                            r = color3_r
+                            g = color3_g
+                            b = color3_b
+                            a = color3_a
+                        else:
+                            raise RuntimeError("This shouldn't happen: Invalid index {0}".format(index))
+
+                        array_x = x + ix + iix
+                        array_y = y + iy + iiy
+                        if array_x < size_x and array_y < size_y:
+                            rgbadata[array_x*4 + array_y*size_x*4 + 0] = r
+                            rgbadata[array_x*4 + array_y * size_x*4 + 1] = g
+                            rgbadata[array_x*4 + array_y * size_x*4 + 2] = b
+                            rgbadata[array_x*4 + array_y * size_x*4 + 3] = a
+                            #else:
+                        #    print("tried to write outside of bounds:", size_x, size_y, x + ix + iix, y + iy + iiy)
+
+                    if ii2 == 3:
+                        x += 8
+                        if x >= size_x:
+                            x = 0
+                            y += 8
 
         elif texformat == I8BW1:
             assert f.read(4) == b" PIM"
             pimsize = read_uint32_le(f)
             #pic_data = f.read(pimsize)
 
-            blocks_horizontal = int(ceil(size_x / 4.0))
-            blocks_vertical = int(ceil(size_y / 4.0))
+            if not decode_i8(f, size_x, size_y, rgbadata):
+                blocks_horizontal = int(ceil(size_x / 4.0))
+                blocks_vertical = int(ceil(size_y / 4.0))
 
-            for iy in range(blocks_vertical):
-                for ix in range(blocks_horizontal):
-                    block = f.read(4*4*1)
+                for iy in range(blocks_vertical):
+                    for ix in range(blocks_horizontal):
+                        block = f.read(4*4*1)
 
-                    for y in range(4):
-                        for x in range(4):
-                            alphaintensity = block[(x + y * 4)]
+                        for y in range(4):
+                            for x in range(4):
+                                alphaintensity = block[(x + y * 4)]
 
-                            imgx = ix * 4 + x
-                            imgy = iy * 4 + y
+                                imgx = ix * 4 + x
+                                imgy = iy * 4 + y
 
-                            if imgx >= size_x or imgy >= size_y:
-                                continue
+                                if imgx >= size_x or imgy >= size_y:
+                                    continue
 
-                            rgbadata[(imgx + imgy * size_x) * 4 + 0] = alphaintensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 1] = alphaintensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 2] = alphaintensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 3] = alphaintensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 0] = alphaintensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 1] = alphaintensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 2] = alphaintensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 3] = alphaintensity
         elif texformat == IA8BW1:
             assert f.read(4) == b" PIM"
             pimsize = read_uint32_le(f)
             #pic_data = f.read(pimsize)
 
-            blocks_horizontal = int(ceil(size_x / 4.0))
-            blocks_vertical = int(ceil(size_y / 4.0))
+            if not decode_ia8(f, size_x, size_y, rgbadata):
+                blocks_horizontal = int(ceil(size_x / 4.0))
+                blocks_vertical = int(ceil(size_y / 4.0))
 
-            for iy in range(blocks_vertical):
-                for ix in range(blocks_horizontal):
-                    block = f.read(4*4*2)
+                for iy in range(blocks_vertical):
+                    for ix in range(blocks_horizontal):
+                        block = f.read(4*4*2)
 
-                    for y in range(4):
-                        for x in range(4):
-                            intensity = block[(x + y*4)*2 + 1]
-                            alpha = block[(x + y * 4) * 2 + 0]
+                        for y in range(4):
+                            for x in range(4):
+                                intensity = block[(x + y*4)*2 + 1]
+                                alpha = block[(x + y * 4) * 2 + 0]
 
-                            imgx = ix * 4 + x
-                            imgy = iy * 4 + y
+                                imgx = ix * 4 + x
+                                imgy = iy * 4 + y
 
-                            if imgx >= size_x or imgy >= size_y:
-                                continue
+                                if imgx >= size_x or imgy >= size_y:
+                                    continue
 
-                            rgbadata[(imgx + imgy * size_x) * 4 + 0] = intensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 1] = intensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 2] = intensity
-                            rgbadata[(imgx + imgy * size_x) * 4 + 3] = alpha
+                                rgbadata[(imgx + imgy * size_x) * 4 + 0] = intensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 1] = intensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 2] = intensity
+                                rgbadata[(imgx + imgy * size_x) * 4 + 3] = alpha
 
         elif texformat == P8BW1:
             assert f.read(4) == b" LAP"
             pimsize = read_uint32_le(f)
             assert pimsize == 512
 
-            palette = []
-            for i in range(256):
-                palette.append(decode_rgb5a3(read_uint16(f)))
-                #palette.append(decode_rgb565(read_uint16(f)))
+            palette_data = f.read(pimsize)
 
             assert f.read(4) == b" PIM"
             datalen = read_uint32_le(f)
 
-            blocks_vertical = int(ceil(size_y / 4.0))
-            blocks_horizontal = int(ceil(size_x / 8.0))
+            if not decode_p8(f, size_x, size_y, palette_data, rgbadata):
+                palette = []
+                for color in palette_unpack(palette_data):
+                    palette.append(decode_rgb5a3(color))
+                    #palette.append(decode_rgb565(color))
 
-            for iy in range(blocks_vertical):
-                for ix in range(blocks_horizontal):
-                    block = f.read(8*4*1)
+                blocks_vertical = int(ceil(size_y / 4.0))
+                blocks_horizontal = int(ceil(size_x / 8.0))
 
-                    for y in range(4):
-                        for x in range(8):
-                            #intensity = block[(x + y*4)*2 + 1]
-                            #alpha = block[(x + y * 4) * 2 + 0]
-                            index = block[x + y*8]
-                            r, g, b, a = palette[index]# index, index, index, 255#palette[index]
+                for iy in range(blocks_vertical):
+                    for ix in range(blocks_horizontal):
+                        block = f.read(8*4*1)
 
-                            imgx = ix * 8 + x
-                            imgy = iy * 4 + y
+                        for y in range(4):
+                            for x in range(8):
+                                #intensity = block[(x + y*4)*2 + 1]
+                                #alpha = block[(x + y * 4) * 2 + 0]
+                                index = block[x + y*8]
+                                r, g, b, a = palette[index]# index, index, index, 255#palette[index]
 
-                            if imgx >= size_x or imgy >= size_y:
-                                continue
+                                imgx = ix * 8 + x
+                                imgy = iy * 4 + y
 
-                            rgbadata[(imgx + imgy * size_x) * 4 + 0] = r
-                            rgbadata[(imgx + imgy * size_x) * 4 + 1] = g
-                            rgbadata[(imgx + imgy * size_x) * 4 + 2] = b
-                            rgbadata[(imgx + imgy * size_x) * 4 + 3] = a
+                                if imgx >= size_x or imgy >= size_y:
+                                    continue
+
+                                rgbadata[(imgx + imgy * size_x) * 4 + 0] = r
+                                rgbadata[(imgx + imgy * size_x) * 4 + 1] = g
+                                rgbadata[(imgx + imgy * size_x) * 4 + 2] = b
+                                rgbadata[(imgx + imgy * size_x) * 4 + 3] = a
 
         elif texformat == RGBABW1:
             assert f.read(4) == b" PIM"
             pimsize = read_uint32_le(f)
             #print("size")
 
-            for i in range(pimsize//64):
-                for iy in range(4):
-                    for ix in range(4):
-                        #ix = 3 - ix
-                        #iy = 3 - iy
-                        imgx = x + ix
-                        imgy = y + iy
-                        if imgx >= size_x or imgy >= size_y:
-                            continue
-                        a, r = read_uint8(f), read_uint8(f)
-                        rgbadata[(imgx + imgy * size_x) * 4 + 0] = r
-                        rgbadata[(imgx + imgy * size_x) * 4 + 3] = a
-
-                for iy in range(4):
-                    for ix in range(4):
-                        #ix = 3 - ix
-                        #iy = 3 - iy
-                        imgx = x + ix
-                        imgy = y + iy
-                        if imgx >= size_x or imgy >= size_y:
-                            continue
-                        g, b = read_uint8(f), read_uint8(f)
-                        rgbadata[(imgx + imgy * size_x) * 4 + 1] = g
-                        rgbadata[(imgx + imgy * size_x) * 4 + 2] = b
-
-                x += 4
-                if x >= size_x:
-                    x = 0
-                    y += 4
+            if not decode_rgba8(f, size_x, size_y, pimsize, rgbadata):
+                for i in range(pimsize//64):
+                    for iy in range(4):
+                        for ix in range(4):
+                            #ix = 3 - ix
+                            #iy = 3 - iy
+                            imgx = x + ix
+                            imgy = y + iy
+                            # The pixels outside of the image are in the data as well
+                            a, r = read_uint8(f), read_uint8(f)
+                            if imgx >= size_x or imgy >= size_y:
+                                continue
+                            rgbadata[(imgx + imgy * size_x) * 4 + 0] = r
+                            rgbadata[(imgx + imgy * size_x) * 4 + 3] = a
+
+                    for iy in range(4):
+                        for ix in range(4):
+                            #ix = 3 - ix
+                            #iy = 3 - iy
+                            imgx = x + ix
+                            imgy = y + iy
+                            g, b = read_uint8(f), read_uint8(f)
+                            if imgx >= size_x or imgy >= size_y:
+                                continue
+                            rgbadata[(imgx + imgy * size_x) * 4 + 1] = g
+                            rgbadata[(imgx + imgy * size_x) * 4 + 2] = b
+
+                    x += 4
+                    if x >= size_x:
+                        x = 0
+                        y += 4
 
 
         else:
@@ -934,23 +1003,51 @@ class Texture(object):
         #print(self.size_x, self.size_y)
         #print("conversion took", default_timer()-start)
         #start = default_timer()
-        self.rgba = bytes(self.rgba)
+        if self.rgba is not None:
+            self.rgba = bytes(self.rgba)
         self._loaded = True
         self.success = True
         #print("final steps took", default_timer()-start)
 
 
+# Decodes the textures of an archive when they are needed and keeps them. The viewer uses
+# GLTextureArchive from texture_gl, which uploads the textures to OpenGL as well.
 class TextureArchive(object):
     def __init__(self, archive):
-        self.game = archive.get_game()
+        self.game = archive.game
+        self._archive = archive
 
-        self.textures = {}
-        for texture in archive.textures:
-            name = bytes(texture.res_name).lower()
-            self.textures[name] = texture
+        # Only the names are read here, the texture entries are
+        # taken from the archive once they are needed.
+        self.texture_indices = {}
+        self._indexed_count = 0
+        self.update_texture_names()
 
         self._cached = {}
-        self.tex = glGenTextures(1)
+
+        # Keep DXT1 textures compressed instead of decoding them, if upload_texture can use S3TC
+        self.keep_compressed = False
+
+    # Add the names of textures that were added to the archive after the last call.
+    def update_texture_names(self):
+        names = self._archive.texture_names()
+        for i in range(self._indexed_count, len(names)):
+            self.texture_indices[bytes(names[i]).lower()] = i
+        self._indexed_count = len(names)
+
+    # Switch to another version of the archive, e.g. after it was written again. Only the
+    # textures with names in changed are decoded again, the others stay as they are.
+    def replace_archive(self, archive, changed):
+        self.game = archive.game
+        self._archive = archive
+        self.texture_indices = {}
+        self._indexed_count = 0
+        self.update_texture_names()
+
+        for texname in changed:
+            if texname in self._cached:
+                tex, ID = self._cached.pop(texname)
+                self.delete_texture_id(ID)
 
     def reset(self):
         for name, val in self._cached.items():
@@ -958,19 +1055,29 @@ class TextureArchive(object):
 
         self._cached = {}
 
+    # The ID the decoded texture is stored under together with the texture, None without OpenGL.
+    def create_texture_id(self):
+        return None
+
+    def delete_texture_id(self, ID):
+        pass
+
+    def upload_texture(self, tex, ID):
+        pass
+
     def initialize_texture(self, texname):
         if texname in self._cached:
             return self._cached[texname]
 
-        if texname not in self.textures:
+        if texname not in self.texture_indices:
             print("Texture not found:", texname)
             return None
 
 
         # f = self.textures[texname].fileobj
-        tex = Texture(texname)
+        tex = Texture(texname, self.keep_compressed)
         #tex.from_file(f)
-        ID = glGenTextures(1)
+        ID = self.create_texture_id()
         self._cached[texname] = (tex, ID)
         self.load_texture(texname)
         return self._cached[texname]
@@ -986,38 +1093,30 @@ class TextureArchive(object):
         if tex.is_loaded():
             return self._cached[texname]
 
-        f = self.textures[texname].fileobj
-        print(self.game)
-        print("what's uuuuuuuuuup")
-        if self.game == "BW1":
-            tex.from_file_bw1(f)
-        elif self.game == "BW2":
-            tex.from_file(f)
-        elif self.game == "AQ":
-            tex.from_file_aragorn(f)
+        f = self.get_texture_entry(texname).fileobj
+        tex.from_file_game(f, self.game)
 
         if tex.success:
             #tex.dump_to_file(str(texname.strip(b"\x00"), encoding="ascii")+".png")
-            glBindTexture(GL_TEXTURE_2D, ID)
-            glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_BASE_LEVEL, 0);
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, 0);
-            # glPixelStorei(GL_UNPACK_ROW_LENGTH, tex.size_x)
-            #print("call info", tex.size_x, tex.size_y, tex.size_x * tex.size_y * 4, len(tex.rgba))
-            #print(ID)
-            glTexImage2D(GL_TEXTURE_2D, 0, 4, tex.size_x, tex.size_y, 0, GL_RGBA, GL_UNSIGNED_BYTE, tex.rgba)# b"\x00"*tex.size_x*tex.size_y*4)#tex.rgba)
-            #glTexImage2D(GL_TEXTURE_2D, 0, 4, tex.size_x, tex.size_y, 0, GL_RGBA, GL_UNSIGNED_BYTE, b"\x7F"*tex.size_x*tex.size_y*4)
-            #testsize = 32
-            #glTexImage2D(GL_TEXTURE_2D, 0, 4, testsize, testsize, 0, GL_RGBA, GL_UNSIGNED_BYTE,
-            #             b"\x7F" * testsize * testsize * 4)
-            #print("error after call", glGetError())
-            #self._cached[texname] = (tex, ID)
-
+            self.upload_texture(tex, ID)
             return self._cached[texname]
         else:
             print("loading tex wasn't successful", texname)
             return None
 
+    def get_texture_entry(self, texname):
+        return self._archive.textures[self.texture_indices[texname]]
+
+    # A new texture decoded to RGBA for exporting it, also if the cached one is kept compressed.
+    # None if the texture doesn't exist or can't be decoded.
+    def decode_texture(self, texname):
+        if texname not in self.texture_indices:
+            return None
+
+        tex = Texture(texname)
+        tex.from_file_game(self.get_texture_entry(texname).fileobj, self.game)
+        return tex if tex.success else None
+
     def get_texture(self, texname):
         if texname in self._cached:
             #tex, id = self._cached[texname]
@@ -1027,4 +1126,3 @@ class TextureArchive(object):
         else:
             self.initialize_texture(texname)
             return self.load_texture(texname)
-
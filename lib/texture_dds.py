@@ -0,0 +1,160 @@
+from struct import Struct
+
+from .bw_archive import texture_format, texture_mipcount
+from .bw_archive_base import section_header
+from .texture_numpy import numpy, cmpr_to_s3tc, decode_image
+
+
+# Exports textures as DDS files with all of their mipmaps. DXT1 textures are written as DXT1 without
+# decoding them, the GX blocks are only rearranged (see cmpr_to_s3tc), so the file has exactly the
+# data of the archive. The other formats are written as uncompressed 32 bit BGRA.
+
+# size, flags, height, width, pitch or linear size, depth, mipmap count, 11 reserved ints,
+# the pixel format (size, flags, four cc, bit count, red, green, blue and alpha masks),
+# caps, caps2, caps3, caps4 and a reserved int
+dds_header = Struct("<7I44x2I4s5I4I4x")
+
+DDSD_CAPS = 0x1
+DDSD_HEIGHT = 0x2
+DDSD_WIDTH = 0x4
+DDSD_PITCH = 0x8
+DDSD_PIXELFORMAT = 0x1000
+DDSD_MIPMAPCOUNT = 0x20000
+DDSD_LINEARSIZE = 0x80000
+
+DDPF_ALPHAPIXELS = 0x1
+DDPF_FOURCC = 0x4
+DDPF_RGB = 0x40
+
+DDSCAPS_COMPLEX = 0x8
+DDSCAPS_TEXTURE = 0x1000
+DDSCAPS_MIPMAP = 0x400000
+
+# Width and height of the blocks of every format and the size of a block in bytes
+FORMAT_BLOCKS = {
+    "I8": (4, 4, 16),
+    "IA8": (4, 4, 32),
+    "A8R8G8B8": (4, 4, 64),
+    "P8": (8, 4, 32),
+    "DXT1": (8, 8, 32)
+}
+
+
+def _blocks(size, block_size):
+    return (size + block_size - 1) // block_size
+
+
+def mipmap_size(width, height, level):
+    return max(1, width >> level), max(1, height >> level)
+
+
+# The palette of a texture and the data of its images. The image sections follow the header of the
+# texture, in AQ they start with 0x18 bytes of padding. A P8 texture has a palette section before them.
+def read_image_sections(texture):
+    f = texture.fileobj
+    f.seek(texture.header_schema.size)
+
+    palette = None
+    images = []
+    while True:
+        header = f.read(section_header.size)
+        if len(header) < section_header.size:
+            break
+
+        name, size = section_header.unpack(header)
+        data = f.read(size)
+        if name == b" LAP":
+            palette = data
+        elif name == b" PIM":
+            images.append(data)
+        elif name == b"RPIM":
+            images.append(data[0x18:])
+        else:
+            raise RuntimeError("Unknown section in texture: {0}".format(name))
+
+    return palette, images
+
+
+# The data of every mipmap of a texture, starting with the full image. A texture has one image section
+# with every mipmap one after the other or an image section for each mipmap. Mipmaps that are missing
+# from the data are left out.
+def read_mipmaps(texture, game, texformat):
+    block_width, block_height, block_size = FORMAT_BLOCKS[texformat]
+    palette, images = read_image_sections(texture)
+
+    mipmaps = []
+    offset = 0
+    for level in range(texture_mipcount(texture, game)):
+        width, height = mipmap_size(texture.width, texture.height, level)
+        size = _blocks(width, block_width)*_blocks(height, block_height)*block_size
+
+        if len(images) > 1:
+            if level >= len(images) or len(images[level]) < size:
+                break
+            mipmaps.append(images[level][:size])
+        else:
+            if not images or offset + size > len(images[0]):
+                break
+            mipmaps.append(images[0][offset:offset+size])
+            offset += size
+
+    return palette, mipmaps
+
+
+def _dds_header(width, height, mipcount, linear_size, pixel_format):
+    flags = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT
+    caps = DDSCAPS_TEXTURE
+    if mipcount > 1:
+        flags |= DDSD_MIPMAPCOUNT
+        caps |= DDSCAPS_COMPLEX | DDSCAPS_MIPMAP
+
+    if pixel_format[0] & DDPF_FOURCC:
+        flags |= DDSD_LINEARSIZE
+    else:
+        flags |= DDSD_PITCH
+
+    return b"DDS " + dds_header.pack(dds_header.size, flags, height, width, linear_size, 0, mipcount,
+                                     32, *pixel_format, caps, 0, 0, 0)
+
+
+# The texture as a DDS file
+def texture_to_dds(texture, game):
+    if numpy is None:
+        raise RuntimeError("Exporting textures as DDS needs NumPy")
+
+    texformat = texture_format(texture, game)
+    if texformat not in FORMAT_BLOCKS:
+        raise RuntimeError("Unsupported texture format: {0}".format(texformat))
+
+    palette, mipmaps = read_mipmaps(texture, game, texformat)
+    if not mipmaps:
+        raise RuntimeError("Texture has no image data")
+
+    images = []
+    for level, data in enumerate(mipmaps):
+        width, height = mipmap_size(texture.width, texture.height, level)
+
+        if texformat == "DXT1":
+            images.append(cmpr_to_s3tc(data, width, height))
+        else:
+            rgba = decode_image(data, texformat, width, height, palette)
+            if rgba is None:
+                raise RuntimeError("Texture data can't be decoded")
+            # RGBA to BGRA
+            images.append(numpy.frombuffer(rgba, dtype=numpy.uint8).reshape((-1, 4))[:, (2, 1, 0, 3)].tobytes())
+
+    if texformat == "DXT1":
+        pixel_format = (DDPF_FOURCC, b"DXT1", 0, 0, 0, 0, 0)
+        linear_size = len(images[0])
+    else:
+        pixel_format = (DDPF_RGB | DDPF_ALPHAPIXELS, b"\x00"*4, 32,
+                        0x00FF0000, 0x0000FF00, 0x000000FF, 0xFF000000)
+        linear_size = texture.width*4
+
+    return _dds_header(texture.width, texture.height, len(images), linear_size, pixel_format) + b"".join(images)
+
+
+def write_dds(filepath, texture, game):
+    data = texture_to_dds(texture, game)
+    with open(filepath, "wb") as f:
+        f.write(data)
@@ -0,0 +1,32 @@
+from OpenGL.GL import *
+from OpenGL.GL.EXT.texture_compression_s3tc import (glInitTextureCompressionS3TcEXT,
+                                                    GL_COMPRESSED_RGBA_S3TC_DXT1_EXT)
+
+from .texture import TextureArchive
+
+
+# TextureArchive that uploads every texture it decodes to OpenGL. If OpenGL supports S3TC,
+# DXT1 textures are uploaded compressed without decoding them, which takes an eighth of the memory.
+class GLTextureArchive(TextureArchive):
+    def __init__(self, archive):
+        super().__init__(archive)
+        self.tex = glGenTextures(1)
+        self.keep_compressed = bool(glInitTextureCompressionS3TcEXT())
+
+    def create_texture_id(self):
+        return glGenTextures(1)
+
+    def delete_texture_id(self, ID):
+        if ID is not None:
+            glDeleteTextures([ID])
+
+    def upload_texture(self, tex, ID):
+        glBindTexture(GL_TEXTURE_2D, ID)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_BASE_LEVEL, 0)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, 0)
+        if tex.s3tc is not None:
+            glCompressedTexImage2D(GL_TEXTURE_2D, 0, GL_COMPRESSED_RGBA_S3TC_DXT1_EXT, tex.size_x, tex.size_y, 0,
+                                   len(tex.s3tc), tex.s3tc)
+        else:
+            glTexImage2D(GL_TEXTURE_2D, 0, 4, tex.size_x, tex.size_y, 0, GL_RGBA, GL_UNSIGNED_BYTE, tex.rgba)
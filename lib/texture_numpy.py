@@ -0,0 +1,295 @@
+import io
+
+try:
+    import numpy
+except ImportError:
+    # Without NumPy the textures are decoded by the loops in texture.py
+    numpy = None
+
+
+# Decoders for the texture formats of texture.py that work on the whole image at once with NumPy.
+# GX textures are stored in blocks of pixels (e.g. 4x4), one block after the other, row by row.
+# Viewed as an array of shape (blocks vertical, blocks horizontal, block height, block width),
+# swapping the two middle axes turns the blocks into rows of pixels, after which the padding of
+# the blocks at the right and bottom edge is cut off. Every decoder reads the image data from f and
+# writes the pixels into rgbadata (a bytearray with 4 bytes per pixel) and returns True, or returns
+# False without reading anything if it can't decode the image, so the caller can decode it itself.
+
+
+def _blocks(size, block_size):
+    return (size + block_size - 1) // block_size
+
+
+# View of rgbadata as an array of shape (height, width, 4)
+def _rgba_view(rgbadata, width, height):
+    return numpy.frombuffer(rgbadata, dtype=numpy.uint8).reshape((height, width, 4))
+
+
+# Read size bytes from f, or None if f doesn't have that many
+def _read_image_data(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        f.seek(-len(data), io.SEEK_CUR)
+        return None
+    return data
+
+
+# The RGBA colour of every 16 bit RGB565 and RGB5A3 value, computed like decode_rgb565 and
+# decode_rgb5a3 in texture.py, so that colours can be looked up in them all at once.
+def _rgb565_colors():
+    values = numpy.arange(0x10000, dtype=numpy.uint32)
+    colors = numpy.empty((0x10000, 4), dtype=numpy.uint8)
+    colors[:, 0] = ((values >> 11) & 0b11111) * 8
+    colors[:, 1] = ((values >> 5) & 0b111111) * 4
+    colors[:, 2] = (values & 0b11111) * 8
+    colors[:, 3] = 0xFF
+    return colors
+
+
+def _rgb5a3_colors():
+    values = numpy.arange(0x10000, dtype=numpy.uint32)
+    colors = numpy.empty((0x10000, 4), dtype=numpy.uint8)
+
+    # RGB555 if the highest bit is set
+    rgb555 = values[0x8000:]
+    colors[0x8000:, 0] = ((rgb555 >> 10) & 0b11111) * 8
+    colors[0x8000:, 1] = ((rgb555 >> 5) & 0b11111) * 8
+    colors[0x8000:, 2] = (rgb555 & 0b11111) * 8
+    colors[0x8000:, 3] = 0xFF
+
+    # RGB4A3 otherwise
+    rgb4a3 = values[:0x8000]
+    colors[:0x8000, 0] = ((rgb4a3 >> 8) & 0b1111) * 0x11
+    colors[:0x8000, 1] = ((rgb4a3 >> 4) & 0b1111) * 0x11
+    colors[:0x8000, 2] = (rgb4a3 & 0b1111) * 0x11
+    colors[:0x8000, 3] = ((rgb4a3 >> 12) & 0b111) * 0x20
+    return colors
+
+
+RGB565_COLORS = None if numpy is None else _rgb565_colors()
+RGB5A3_COLORS = None if numpy is None else _rgb5a3_colors()
+
+
+# Turn blocks of block_width x block_height pixels with bytes_per_pixel bytes each into an
+# array of shape (height, width, bytes_per_pixel) of the pixels in rows.
+def unswizzle(data, width, height, block_width, block_height, bytes_per_pixel):
+    blocks_horizontal = _blocks(width, block_width)
+    blocks_vertical = _blocks(height, block_height)
+
+    pixels = numpy.frombuffer(data, dtype=numpy.uint8,
+                              count=blocks_horizontal*blocks_vertical*block_width*block_height*bytes_per_pixel)
+    pixels = pixels.reshape((blocks_vertical, blocks_horizontal, block_height, block_width, bytes_per_pixel))
+    pixels = pixels.transpose((0, 2, 1, 3, 4)).reshape(
+        (blocks_vertical*block_height, blocks_horizontal*block_width, bytes_per_pixel))
+
+    return pixels[:height, :width]
+
+
+# I8: 4x4 blocks with one byte of intensity per pixel, which is used for the alpha as well
+def decode_i8(f, width, height, rgbadata):
+    if numpy is None:
+        return False
+
+    data = _read_image_data(f, _blocks(width, 4)*_blocks(height, 4)*16)
+    if data is None:
+        return False
+
+    _rgba_view(rgbadata, width, height)[:] = unswizzle(data, width, height, 4, 4, 1)
+    return True
+
+
+# IA8: 4x4 blocks with 2 bytes per pixel, the alpha and the intensity
+def decode_ia8(f, width, height, rgbadata):
+    if numpy is None:
+        return False
+
+    data = _read_image_data(f, _blocks(width, 4)*_blocks(height, 4)*32)
+    if data is None:
+        return False
+
+    pixels = unswizzle(data, width, height, 4, 4, 2)
+    rgba = _rgba_view(rgbadata, width, height)
+    rgba[:, :, :3] = pixels[:, :, 1:2]
+    rgba[:, :, 3] = pixels[:, :, 0]
+    return True
+
+
+# RGBA8 pixels of whole blocks into the array rgba of shape (height, width, 4). The two halves
+# of a block are handled like blocks of 4x4 pixels with 2 bytes per pixel, with the planes
+# as another axis.
+def _rgba8_pixels(data, width, height, rgba):
+    blocks_horizontal = _blocks(width, 4)
+    blocks_vertical = _blocks(height, 4)
+
+    planes = numpy.frombuffer(data, dtype=numpy.uint8, count=blocks_horizontal*blocks_vertical*64)
+    planes = planes.reshape((blocks_vertical, blocks_horizontal, 2, 4, 4, 2)).transpose((2, 0, 3, 1, 4, 5))
+    planes = planes.reshape((2, blocks_vertical*4, blocks_horizontal*4, 2))[:, :height, :width]
+
+    rgba[:, :, 0] = planes[0, :, :, 1]
+    rgba[:, :, 1] = planes[1, :, :, 0]
+    rgba[:, :, 2] = planes[1, :, :, 1]
+    rgba[:, :, 3] = planes[0, :, :, 0]
+
+
+# RGBA8: 4x4 blocks of 64 bytes, the alpha and red of the 16 pixels followed by their green and
+# blue. Images with a size that isn't a multiple of 4 have whole blocks, the pixels outside of
+# the image are cropped.
+def decode_rgba8(f, width, height, pimsize, rgbadata):
+    if numpy is None:
+        return False
+
+    blocks_horizontal = _blocks(width, 4)
+    blocks_vertical = _blocks(height, 4)
+    if pimsize // 64 < blocks_horizontal*blocks_vertical:
+        return False
+
+    data = _read_image_data(f, blocks_horizontal*blocks_vertical*64)
+    if data is None:
+        return False
+
+    _rgba8_pixels(data, width, height, _rgba_view(rgbadata, width, height))
+    return True
+
+
+# A DXT1 (CMPR) tile: two RGB565 colours and 2 bits per pixel that pick one of the
+# four colours of the tile, for 4x4 pixels.
+dxt1_tile = None if numpy is None else numpy.dtype([("color0", ">u2"), ("color1", ">u2"), ("indices", ">u4")])
+
+
+# DXT1 (CMPR): blocks of 8x8 pixels, each made of 2x2 tiles of 4x4 pixels. tilecount is the
+# amount of tiles that the loops in texture.py read, all of them are read from f but only
+# the ones that cover the image are decoded.
+def decode_dxt1(f, width, height, tilecount, rgbadata):
+    if numpy is None:
+        return False
+
+    blocks_horizontal = _blocks(width, 8)
+    blocks_vertical = _blocks(height, 8)
+    count = blocks_horizontal*blocks_vertical*4
+    if tilecount < count:
+        return False
+
+    data = _read_image_data(f, tilecount*8)
+    if data is None:
+        return False
+
+    tiles = numpy.frombuffer(data, dtype=dxt1_tile, count=count)
+    color0 = RGB565_COLORS[tiles["color0"], :3].astype(numpy.uint16)
+    color1 = RGB565_COLORS[tiles["color1"], :3].astype(numpy.uint16)
+
+    # With color0 > color1 the other two colours are in between them, otherwise
+    # the third colour is their average and the fourth is transparent black.
+    opaque = (tiles["color0"] > tiles["color1"])[:, numpy.newaxis]
+    palette = numpy.empty((count, 4, 4), dtype=numpy.uint8)
+    palette[:, :, 3] = 255
+    palette[:, 0, :3] = color0
+    palette[:, 1, :3] = color1
+    palette[:, 2, :3] = numpy.where(opaque, (2*color0 + color1) // 3, (color0 + color1) // 2)
+    palette[:, 3, :3] = numpy.where(opaque, (2*color1 + color0) // 3, 0)
+    palette[:, 3, 3] = numpy.where(opaque[:, 0], 255, 0)
+
+    # Every byte of the indices is a row of the tile, with the first pixel in the highest 2 bits.
+    # The colours are looked up as one 32 bit value in the palettes of all tiles at once.
+    rows = numpy.frombuffer(data, dtype=numpy.uint8, count=count*8).reshape((count, 8))[:, 4:]
+    indices = (rows[:, :, numpy.newaxis] >> numpy.array((6, 4, 2, 0), dtype=numpy.uint8)) & 0b11
+    indices = numpy.add(indices, numpy.arange(0, count*4, 4, dtype=numpy.uint32)[:, numpy.newaxis, numpy.newaxis],
+                        dtype=numpy.uint32)
+    pixels = palette.view(numpy.uint32).ravel().take(indices).view(numpy.uint8)
+
+    # (block row, block column, tile row, tile column, pixel row, pixel column, rgba)
+    pixels = pixels.reshape((blocks_vertical, blocks_horizontal, 2, 2, 4, 4, 4))
+    pixels = pixels.transpose((0, 2, 4, 1, 3, 5, 6)).reshape((blocks_vertical*8, blocks_horizontal*8, 4))
+
+    _rgba_view(rgbadata, width, height)[:] = pixels[:height, :width]
+    return True
+
+
+# The colours of a palette of 16 bit values (e.g. RGB5A3) as an array of shape (colour count, 4)
+def palette_colors(palette, colors):
+    return colors.take(numpy.frombuffer(palette, dtype=">u2"), axis=0)
+
+
+# P8: 8x4 blocks with one byte per pixel, the index of the pixel's colour in palette, the data of
+# a palette of 256 RGB5A3 colours.
+def decode_p8(f, width, height, palette, rgbadata):
+    if numpy is None or len(palette) != 512:
+        return False
+
+    data = _read_image_data(f, _blocks(width, 8)*_blocks(height, 4)*32)
+    if data is None:
+        return False
+
+    indices = unswizzle(data, width, height, 8, 4, 1)[:, :, 0]
+    _rgba_view(rgbadata, width, height)[:] = palette_colors(palette, RGB5A3_COLORS).take(indices, axis=0)
+    return True
+
+
+# Decode an image that has all of its blocks, e.g. a mipmap, into RGBA data. texformat is the
+# name of the format (I8, IA8, A8R8G8B8, P8 or DXT1) and palette the palette data of P8 images.
+# Returns None if the format is unknown or data is too short.
+def decode_image(data, texformat, width, height, palette=None):
+    if numpy is None:
+        return None
+
+    rgbadata = bytearray(width*height*4)
+    f = io.BytesIO(data)
+
+    if texformat == "I8":
+        decoded = decode_i8(f, width, height, rgbadata)
+    elif texformat == "IA8":
+        decoded = decode_ia8(f, width, height, rgbadata)
+    elif texformat == "P8":
+        decoded = palette is not None and decode_p8(f, width, height, palette, rgbadata)
+    elif texformat == "DXT1":
+        decoded = decode_dxt1(f, width, height, len(data) // 8, rgbadata)
+    elif texformat == "A8R8G8B8":
+        decoded = len(data) >= _blocks(width, 4)*_blocks(height, 4)*64
+        if decoded:
+            _rgba8_pixels(data, width, height, _rgba_view(rgbadata, width, height))
+    else:
+        decoded = False
+
+    return rgbadata if decoded else None
+
+# The bytes of the indices of a tile with the 4 indices in the opposite order
+_reversed_indices = None if numpy is None else numpy.array(
+    [((i & 0b11) << 6) | ((i & 0b1100) << 2) | ((i >> 2) & 0b1100) | (i >> 6) for i in range(256)],
+    dtype=numpy.uint8)
+
+
+# Turn the DXT1 (CMPR) image data of a texture into S3TC DXT1 data like OpenGL and DDS files use,
+# without decoding it. S3TC has the 4x4 tiles row by row instead of in blocks of 2x2 tiles, the
+# colours in little endian and the first pixel of every row of a tile in the lowest 2 bits instead
+# of the highest. The colours and what the indices mean are the same, so nothing is lost.
+# Returns None if data is too short for the image.
+def cmpr_to_s3tc(data, width, height):
+    if numpy is None:
+        return None
+
+    blocks_horizontal = _blocks(width, 8)
+    blocks_vertical = _blocks(height, 8)
+    count = blocks_horizontal*blocks_vertical*4
+    if len(data) < count*8:
+        return None
+
+    tiles = numpy.frombuffer(data, dtype=numpy.uint8, count=count*8)
+    tiles = tiles.reshape((blocks_vertical, blocks_horizontal, 2, 2, 8)).transpose((0, 2, 1, 3, 4))
+    tiles = tiles.reshape((blocks_vertical*2, blocks_horizontal*2, 8))[:_blocks(height, 4), :_blocks(width, 4)]
+
+    s3tc = numpy.empty(tiles.shape, dtype=numpy.uint8)
+    s3tc[:, :, 0:4] = tiles[:, :, (1, 0, 3, 2)]
+    s3tc[:, :, 4:8] = _reversed_indices.take(tiles[:, :, 4:8])
+    return s3tc.tobytes()
+
+
+# Read the DXT1 image data of a texture from f as S3TC data, see cmpr_to_s3tc. Like decode_dxt1
+# it reads all tilecount tiles, or nothing and returns None if it can't.
+def read_s3tc(f, width, height, tilecount):
+    if numpy is None or tilecount < _blocks(width, 8)*_blocks(height, 8)*4:
+        return None
+
+    data = _read_image_data(f, tilecount*8)
+    if data is None:
+        return None
+
+    return cmpr_to_s3tc(data, width, height)
@@ -0,0 +1,77 @@
+# Builds small archives for the tests, with the same layout as the archives of the games.
+import struct
+
+
+def section(tag, data):
+    return tag + struct.pack("<I", len(data)) + data
+
+
+def prefixed_name(name):
+    return struct.pack("<I", len(name)) + name
+
+
+# A BW2 (or AQ) texture entry (DXTG). payload is the image data of the first image section.
+def texture_bw2(name, width, height, texformat, payload, aq=False, palette=None, mipcount=1):
+    header = name.ljust(0x20, b"\x00")
+    header += struct.pack(">IIII", width, height, 0, 0)
+    header += texformat + b"8B8G8R8A"
+    header += b"\x00"*0x20
+    if aq:
+        header += struct.pack(">IIII", 0, width, height, mipcount)
+    else:
+        header += struct.pack(">IIII", mipcount, width, height, mipcount)
+
+    body = b""
+    if palette is not None:
+        body += section(b" LAP", palette)
+    if aq:
+        body += section(b"RPIM", b"\x00"*0x18 + payload)
+    else:
+        body += section(b" PIM", payload)
+
+    return section(b"DXTG", header + body)
+
+
+# A BW1 texture entry (TXET) with an image section for every image in images
+def texture_bw1(name, width, height, texformat, images, palette=None):
+    header = name.ljust(0x10, b"\x00") + struct.pack("<II", width, height) + struct.pack(">II", 0, 0)
+    header += texformat.ljust(8, b"\x00") + b"A8R8G8B8" + b"\x00"*0x20
+    header += struct.pack("<I", len(images))
+
+    body = b""
+    if palette is not None:
+        body += section(b" LAP", palette)
+    for image in images:
+        body += section(b" PIM", image)
+
+    return section(b"TXET", header + body)
+
+
+# A BW2 archive with DXT1 textures, sounds, models without nodes, an effect, an animation and a script.
+# resources is a list of (tag, name) of further top level resources, which get their name as data.
+def archive_bw2(textures=(b"TEX_000", b"TEX_001"), sounds=(b"SND_000", ), models=(b"MODEL_00", ),
+                resources=()):
+    entries = b""
+    for i, name in enumerate(textures):
+        entries += texture_bw2(name, 8, 8, b"\x00\x00\x00\x001TXD", bytes(range(i, i + 32)))
+    data = section(b"RXET", prefixed_name(b"level.tex") + section(b"FTBG", struct.pack("<I", len(textures)) + entries))
+
+    sound_data = section(b"HFSB", struct.pack("<I", len(sounds)))
+    for name in sounds:
+        sound_data += section(b"HPSD", name.ljust(0x20, b"\x00") + section(b"DHSD", bytes(0x60)))
+        sound_data += section(b"DPSD", bytes(64))
+    data += section(b"DNOS", prefixed_name(b"level.snd") + sound_data)
+
+    for name in models:
+        model = struct.pack(">IIHHI4fI", 0x65, 0xC8, 0, 0, 0, 0, 0, 0, 0, 0)
+        model += section(b"MEMX", bytes(8))
+        data += section(b"LDOM", prefixed_name(name) + section(b"LDOM", model))
+
+    data += section(b"FEQT", prefixed_name(b"FX_ONE") + b"\x01\x02\x03\x04")
+    data += section(b"MINA", prefixed_name(b"ANIM_ONE") + b"\x05\x06")
+    data += section(b"PRCS", prefixed_name(b"SCRIPT_ONE") + b"luac")
+
+    for tag, name in resources:
+        data += section(tag, prefixed_name(name) + name)
+
+    return data
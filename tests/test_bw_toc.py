@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+from lib.bw_toc import TOCArchive, get_toc, open_archive
+from tests.archive_data import archive_bw2
+
+
+class TOCArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.path = os.path.join(self.tempdir.name, "level.res")
+        with open(self.path, "wb") as f:
+            f.write(archive_bw2(textures=(b"TEX_A", b"TEX_B")))
+
+    def test_close_releases_mapping(self):
+        archive = open_archive(self.path)
+        self.assertEqual(bytes(archive.textures[0].res_name).rstrip(b"\x00"), b"TEX_A")
+        archive.close()
+        self.assertIsNone(archive._buffer)
+        self.assertIsNone(archive._mmap)
+
+    def test_unmapped_archive_can_be_replaced(self):
+        archive = TOCArchive(self.path, get_toc(self.path), mapped=False)
+        texture = archive.textures[0]
+        self.assertIsNone(archive._file)
+
+        # The data of resources that were read stays as it was
+        with open(self.path + ".new", "wb") as f:
+            f.write(archive_bw2(textures=(b"TEX_C", )))
+        os.replace(self.path + ".new", self.path)
+        self.assertEqual(bytes(texture.res_name).rstrip(b"\x00"), b"TEX_A")
+
+        # The new file is shorter, the second texture isn't where the TOC says
+        with open(self.path, "r+b") as f:
+            f.truncate(100)
+        with self.assertRaises(RuntimeError):
+            archive.textures[1]
+        archive.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
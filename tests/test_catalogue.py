@@ -0,0 +1,51 @@
+import gzip
+import mmap
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from lib.bw_toc import open_archive_file, scan_archive
+from lib.catalogue import archive_digests
+from tests.archive_data import archive_bw2
+
+
+class ArchiveDigestsTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        data = archive_bw2(sounds=(b"SND_000", b"SND_001"))
+        self.path = os.path.join(self.tempdir.name, "level.res")
+        with open(self.path, "wb") as f:
+            f.write(data)
+        with gzip.open(self.path + ".gz", "wb") as f:
+            f.write(data)
+
+        with open_archive_file(self.path) as f:
+            game, self.entries = scan_archive(f)
+
+    def test_mapping_is_closed(self):
+        mappings = []
+        real_mmap = mmap.mmap
+
+        def open_mapping(*args, **kwargs):
+            mappings.append(real_mmap(*args, **kwargs))
+            return mappings[-1]
+
+        with mock.patch("lib.catalogue.mmap.mmap", side_effect=open_mapping):
+            archive_digests(self.path, self.entries)
+
+        self.assertEqual(len(mappings), 1)
+        self.assertTrue(mappings[0].closed)
+
+    def test_compressed_archive_has_same_digests(self):
+        digests = archive_digests(self.path, self.entries)
+
+        self.assertEqual(digests, archive_digests(self.path + ".gz", self.entries))
+        # The sound data is part of the digest of the sound header
+        self.assertEqual(sum(digest is None for digest in digests), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import gzip
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from lib.catalogue_db import CatalogueDatabase
+from tests.archive_data import archive_bw2
+
+
+class IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.gamedir = os.path.join(self.tempdir.name, "game")
+        self.cachedir = os.path.join(self.tempdir.name, "cache")
+        os.makedirs(self.gamedir)
+
+        data = archive_bw2(textures=(b"TEX_A", b"TEX_B"))
+        with open(os.path.join(self.gamedir, "level1.res"), "wb") as f:
+            f.write(data)
+        with gzip.open(os.path.join(self.gamedir, "level2.res.gz"), "wb") as f:
+            f.write(data)
+
+    def test_index_writes_nothing_next_to_archives(self):
+        with mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.cachedir, "LOCALAPPDATA": self.cachedir}):
+            with CatalogueDatabase(os.path.join(self.tempdir.name, "index.db")) as database:
+                database.update(self.gamedir, jobs=1)
+                textures = database.query("SELECT name FROM textures ORDER BY name")
+
+        self.assertEqual(len(textures), 4)
+        self.assertEqual(sorted(os.listdir(self.gamedir)), ["level1.res", "level2.res.gz"])
+        self.assertFalse(os.path.exists(self.cachedir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import io
+import unittest
+
+from lib.bw_archive import BWArchive
+from lib.header_schema import HeaderSchema
+from tests.archive_data import archive_bw2
+
+
+class Header(object):
+    pass
+
+
+class HeaderSchemaTest(unittest.TestCase):
+    def setUp(self):
+        self.schema = HeaderSchema([("res_name", "16s"), ("size", "I"), ("values", "2H")], byteorder=">")
+
+    def test_round_trip(self):
+        data = b"TEX_A".ljust(16, b"\x00") + b"\x00\x00\x01\x00\x00\x02\x00\x03"
+        header = Header()
+        self.schema.unpack_into(header, data)
+
+        self.assertEqual((header.res_name, header.size, header.values), (data[:16], 256, [2, 3]))
+        self.assertEqual(self.schema.pack(header), data)
+
+    def test_name_longer_than_field(self):
+        header = Header()
+        header.res_name, header.size, header.values = b"A"*17, 0, [0, 0]
+        buffer = bytearray(self.schema.size)
+
+        with self.assertRaises(ValueError):
+            self.schema.pack(header)
+        with self.assertRaises(ValueError):
+            self.schema.pack_into(header, buffer)
+        self.assertEqual(buffer, bytes(self.schema.size))
+
+        # A name that fills the field exactly is fine
+        header.res_name = b"A"*16
+        self.assertEqual(self.schema.pack(header)[:16], b"A"*16)
+
+    def test_renamed_texture_too_long(self):
+        archive = BWArchive(io.BytesIO(archive_bw2()))
+        archive.textures[0].res_name = b"TEX_WITH_A_NAME_LONGER_THAN_32_BYTES"
+
+        with self.assertRaises(ValueError):
+            archive.write(io.BytesIO())
+
+
+if __name__ == "__main__":
+    unittest.main()
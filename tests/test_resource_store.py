@@ -0,0 +1,71 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+import bw_tool
+from lib.resource_store import ResourceStore
+from tests.archive_data import archive_bw2
+
+
+def file_md5(path):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+class StoreExtractTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.source = os.path.join(self.tempdir.name, "source")
+        self.store = os.path.join(self.tempdir.name, "store")
+
+        self.archives = {}
+        for relpath, textures in (("x.res", (b"TEX_A", )), (os.path.join("sub", "y.res"), (b"TEX_B", b"TEX_C"))):
+            path = os.path.join(self.source, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(archive_bw2(textures=textures))
+            self.archives[relpath] = file_md5(path)
+
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+
+    def check_sources_unchanged(self):
+        for relpath, digest in self.archives.items():
+            self.assertEqual(file_md5(os.path.join(self.source, relpath)), digest)
+
+    # The manifest names are the paths of the archives relative to the extracted directory,
+    # which used to be taken as the path of the manifest if the archive existed there.
+    def test_extract_directory_from_inside(self):
+        os.chdir(self.source)
+        self.assertEqual(bw_tool.main(["store-extract", ".", self.store, "--jobs", "1"]), 0)
+        self.check_sources_unchanged()
+
+        store = ResourceStore(self.store)
+        for relpath in self.archives:
+            self.assertTrue(os.path.isfile(os.path.join(store.manifests_dir, relpath + ".json")))
+
+    def test_extract_and_rebuild_single_archive(self):
+        os.chdir(self.source)
+        self.assertEqual(bw_tool.main(["store-extract", "x.res", self.store, "--jobs", "1"]), 0)
+        self.check_sources_unchanged()
+
+        output = os.path.join(self.tempdir.name, "rebuilt.res")
+        bw_tool.main(["store-rebuild", self.store, "x.res", output])
+        self.assertEqual(file_md5(output), self.archives["x.res"])
+
+    def test_manifest_outside_of_store(self):
+        store = ResourceStore(self.store)
+        with self.assertRaises(RuntimeError):
+            store.manifest_path(os.path.join("..", "..", "x.res"))
+
+        path = os.path.join(self.source, "x.res.json")
+        with open(path, "w") as f:
+            f.write("{}")
+        with self.assertRaises(RuntimeError):
+            store.save_manifest(path, {"version": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import io
+import unittest
+
+from lib.bw_archive import BWArchive, normalize_res_name
+from lib.slim_archive import slim_archive, read_level_resources
+from tests.archive_data import archive_bw2
+
+LEVEL = b"""<Level>
+ <Object type="cNodeHierarchyResource"><Attribute name="mName"><Item>MODEL_00</Item></Attribute></Object>
+ <Object type="cFxResource"><Attribute name="mName"><Item>FX_ONE</Item></Attribute></Object>
+ <Object type="cTextureResource"><Attribute name="mName"><Item>TEX_USED</Item></Attribute></Object>
+</Level>"""
+
+
+def make_archive():
+    data = archive_bw2(textures=(b"TEX_USED", b"TEX_UNUSED", b"TEX_USED"), sounds=(b"SND_000", b"SND_000"),
+                       models=(b"MODEL_00", b"MODEL_00"), resources=((b"PRCS", b"SCRIPT_ONE"), ))
+    return BWArchive(io.BytesIO(data))
+
+
+def texture_names(archive):
+    return [normalize_res_name(name) for name in archive.texture_names()]
+
+
+class SlimArchiveTest(unittest.TestCase):
+    def test_models_sounds_and_scripts_are_kept(self):
+        for level_names in (None, {b"MODEL_00", b"FX_ONE", b"TEX_USED"}):
+            archive = make_archive()
+            removed, errors = slim_archive(archive, level_names)
+
+            kinds = set(kind for kind, name in removed)
+            self.assertFalse(kinds & {b"LDOM", b"HPSD", b"PRCS"})
+            self.assertEqual(len(archive.models), 2)
+            self.assertEqual(len(archive.sounds), 2)
+
+    def test_without_level_only_duplicates_are_removed(self):
+        archive = make_archive()
+        removed, errors = slim_archive(archive)
+
+        self.assertEqual(removed, [(b"DXTG", b"TEX_USED")])
+        self.assertEqual(texture_names(archive), [b"TEX_USED", b"TEX_UNUSED"])
+
+    def test_with_level(self):
+        archive = make_archive()
+        removed, errors = slim_archive(archive, read_level_resources(io.BytesIO(LEVEL)))
+
+        self.assertEqual(sorted(removed), [(b"DXTG", b"TEX_UNUSED"), (b"DXTG", b"TEX_USED"), (b"MINA", b"ANIM_ONE")])
+        self.assertEqual(texture_names(archive), [b"TEX_USED"])
+
+
+if __name__ == "__main__":
+    unittest.main()
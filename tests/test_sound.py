@@ -0,0 +1,119 @@
+import math
+import unittest
+
+from lib.sound import Sound, dsp_header, decode_dsp_adpcm, read_dsp_headers, numpy, \
+    FRAME_SIZE, SAMPLES_PER_FRAME
+from tests.archive_data import section
+
+
+COEFS = (0, 0, 2048, 0, 0, 2048, 1024, 1024, 4096, -2048, 3584, -1536, 3072, -1024, 4608, -2560)
+
+
+def dsp_header_data(num_samples, coefs=COEFS, sample_rate=32000, ps=0, yn1=0, yn2=0):
+    frames, rest = divmod(num_samples, SAMPLES_PER_FRAME)
+    num_nibbles = frames*16 + (rest + 2 if rest else 0)
+    return dsp_header.pack(num_samples, num_nibbles, sample_rate, 0, 0, 0, 0, 2, *coefs,
+                           0, ps, yn1, yn2, 0, 0, 0)
+
+
+def sound_header_data(name, headers):
+    return name.ljust(0x20, b"\x00") + section(b"DHSD", b"".join(headers))
+
+
+def _decode_sample(coef1, coef2, hist1, hist2, nibble, scale):
+    sample = (coef1*hist1 + coef2*hist2 + ((nibble*scale) << 11) + 1024) >> 11
+    return max(-32768, min(32767, sample))
+
+
+# A simple DSP-ADPCM encoder: for every frame it tries every predictor and scale, picks the
+# nibble closest to each sample and keeps the choice with the smallest error. It returns the
+# ADPCM data and the samples a decoder has to get from it.
+def encode_dsp_adpcm(samples, coefs=COEFS):
+    data = b""
+    decoded = []
+    hist1 = hist2 = 0
+
+    for start in range(0, len(samples), SAMPLES_PER_FRAME):
+        frame = samples[start:start + SAMPLES_PER_FRAME]
+        best = None
+
+        for predictor in range(8):
+            coef1, coef2 = coefs[predictor*2:predictor*2+2]
+            for shift in range(12):
+                scale = 1 << shift
+                h1, h2 = hist1, hist2
+                nibbles, output, error = [], [], 0
+
+                for sample in frame:
+                    nibble = min(range(-8, 8), key=lambda n: abs(_decode_sample(coef1, coef2, h1, h2, n, scale) - sample))
+                    value = _decode_sample(coef1, coef2, h1, h2, nibble, scale)
+                    nibbles.append(nibble)
+                    output.append(value)
+                    error += (value - sample)**2
+                    h1, h2 = value, h1
+
+                if best is None or error < best[0]:
+                    best = (error, (predictor << 4) | shift, nibbles, output, h1, h2)
+
+        _, ps, nibbles, output, hist1, hist2 = best
+        nibbles += [0]*(SAMPLES_PER_FRAME - len(nibbles))
+        data += bytes([ps]) + bytes(((a & 0xF) << 4) | (b & 0xF) for a, b in zip(nibbles[0::2], nibbles[1::2]))
+        decoded.extend(output)
+
+    return data, decoded
+
+
+@unittest.skipIf(numpy is None, "Decoding sounds needs NumPy")
+class DSPADPCMTest(unittest.TestCase):
+    def test_known_frame(self):
+        # Predictor 0 (coefficients 2048, 0) adds every nibble times the scale 4 to the sample before
+        header = read_dsp_headers(sound_header_data(b"SND", [dsp_header_data(14)]))[0]
+        frame = bytes([0x02, 0x12, 0x34, 0x56, 0x78, 0x9A, 0xBC, 0xDE])
+        samples = decode_dsp_adpcm(frame, header._replace(coefs=(2048, 0) + COEFS[2:]))
+
+        self.assertEqual(samples.tolist(), [4, 12, 24, 40, 60, 84, 112, 80, 52, 28, 8, -8, -20, -28])
+
+    def test_round_trip(self):
+        signal = [int(12000*math.sin(i/5.0) + 6000*math.sin(i/13.0)) for i in range(100)]
+        data, expected = encode_dsp_adpcm(signal)
+        self.assertEqual(len(data), 8*FRAME_SIZE)
+
+        header = read_dsp_headers(sound_header_data(b"SND", [dsp_header_data(len(signal))]))[0]
+        samples = decode_dsp_adpcm(data, header).tolist()
+
+        self.assertEqual(samples, expected)
+        self.assertLess(max(abs(a - b) for a, b in zip(samples, signal)), 800)
+
+    def test_sound_channels(self):
+        left, left_samples = encode_dsp_adpcm([i*100 for i in range(30)])
+        right, right_samples = encode_dsp_adpcm([-i*100 for i in range(30)])
+        header = dsp_header_data(30)
+
+        sound = Sound(b"SND")
+        sound.from_data(sound_header_data(b"SND", [header, header]), left + right)
+
+        self.assertEqual(sound.sample_rate, 32000)
+        self.assertEqual([channel.tolist() for channel in sound.channels], [left_samples, right_samples])
+
+
+class DSPHeaderTest(unittest.TestCase):
+    def test_unknown_layout_fails(self):
+        header = dsp_header_data(30)
+
+        with self.assertRaises(RuntimeError):
+            read_dsp_headers(b"SND".ljust(0x20, b"\x00") + section(b"XXXX", header))
+        with self.assertRaises(RuntimeError):
+            read_dsp_headers(sound_header_data(b"SND", [header[:0x5C]]))
+        with self.assertRaises(RuntimeError):
+            read_dsp_headers(sound_header_data(b"SND", [bytes(0x60)]))
+        with self.assertRaises(RuntimeError):
+            read_dsp_headers(sound_header_data(b"SND", [header])[:-4])
+
+    def test_short_sound_data_fails(self):
+        header = dsp_header_data(30)
+        with self.assertRaises(RuntimeError):
+            Sound(b"SND").from_data(sound_header_data(b"SND", [header, header]), bytes(40))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import io
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+from types import SimpleNamespace
+
+from lib.bw_archive import BWArchive
+from lib.model_rendering import BW2Model
+from lib.texture import Texture, TextureArchive
+from lib.texture_numpy import numpy
+from tests.archive_data import archive_bw2
+
+
+def read_png(filepath):
+    with open(filepath, "rb") as f:
+        data = f.read()
+
+    width, height = struct.unpack_from(">II", data, 16)
+    idat = data.index(b"IDAT")
+    length, = struct.unpack_from(">I", data, idat - 4)
+    rows = zlib.decompress(data[idat+4:idat+4+length])
+    # Every row starts with a filter byte
+    return width, height, b"".join(rows[y*(width*4+1)+1:(y+1)*(width*4+1)] for y in range(height))
+
+
+class KeepCompressedTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.archive = BWArchive(io.BytesIO(archive_bw2(textures=(b"TEX_000", ))))
+        self.texarchive = TextureArchive(self.archive)
+        self.texarchive.keep_compressed = True
+        # Names are padded with zeroes like in the archive
+        self.name = b"TEX_000".ljust(0x20, b"\x00")
+
+    @unittest.skipIf(numpy is None, "Keeping textures compressed needs NumPy")
+    def test_cached_texture_is_compressed(self):
+        tex, ID = self.texarchive.get_texture(self.name.lower())
+        self.assertIsNone(tex.rgba)
+        self.assertIsNotNone(tex.s3tc)
+
+    def test_export_obj_writes_dxt1_texture(self):
+        # The texture is in the cache without RGBA data when the model is exported
+        self.texarchive.get_texture(self.name.lower())
+
+        node = SimpleNamespace(materials=[SimpleNamespace(textures=lambda: [self.name])], do_skip=lambda: True)
+        model = SimpleNamespace(bgfname=b"MODEL_00", nodes=[node])
+        BW2Model.export_obj(model, self.tempdir.name, self.texarchive)
+
+        expected = Texture(self.name.lower())
+        expected.from_file_game(self.archive.textures[0].fileobj, self.archive.game)
+        self.assertEqual(read_png(os.path.join(self.tempdir.name, "TEX_000.png")), (8, 8, expected.rgba))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import io
+import random
+import unittest
+from unittest import mock
+
+from lib import texture_numpy
+from lib.texture import Texture, decode_rgb565, DXT1, I8, IA8, P8, RGBA
+from lib.texture_numpy import numpy, decode_image, cmpr_to_s3tc
+from tests.archive_data import texture_bw2
+
+
+# Width and height of a block and its size in bytes
+FORMATS = {
+    "I8": (I8, 4, 4, 16),
+    "IA8": (IA8, 4, 4, 32),
+    "A8R8G8B8": (RGBA, 4, 4, 64),
+    "P8": (P8, 8, 4, 32),
+    "DXT1": (DXT1, 8, 8, 32)
+}
+
+# Multiples of every block size and sizes that aren't
+SIZES = ((8, 8), (16, 8), (5, 7), (1, 3), (13, 6), (12, 20))
+
+
+def _blocks(size, block_size):
+    return (size + block_size - 1) // block_size
+
+
+def image_data(rng, texformat, width, height):
+    _, block_width, block_height, block_size = FORMATS[texformat]
+    size = _blocks(width, block_width)*_blocks(height, block_height)*block_size
+    return bytes(rng.getrandbits(8) for i in range(size))
+
+
+# Decode a texture with the loops of Texture, without NumPy
+def decode_with_loops(texformat, width, height, data, palette=None):
+    entry = texture_bw2(b"TEX", width, height, FORMATS[texformat][0], data, palette=palette)
+    texture = Texture(b"TEX")
+    with mock.patch.object(texture_numpy, "numpy", None):
+        texture.from_file(io.BytesIO(entry[8:]))
+
+    return texture.rgba
+
+
+# Decode S3TC (DXT1) data: 4x4 tiles in raster order with little endian colors, the
+# first pixel of a row is in the lowest bits.
+def decode_s3tc(data, width, height):
+    rgba = bytearray(width*height*4)
+    tiles_x = _blocks(width, 4)
+
+    for tile in range(len(data) // 8):
+        tile_data = data[tile*8:tile*8+8]
+        col0 = tile_data[0] | tile_data[1] << 8
+        col1 = tile_data[2] | tile_data[3] << 8
+        color0, color1 = decode_rgb565(col0), decode_rgb565(col1)
+
+        if col0 > col1:
+            color2 = tuple((2*a + b) // 3 for a, b in zip(color0, color1)) + (255, )
+            color3 = tuple((a + 2*b) // 3 for a, b in zip(color0, color1)) + (255, )
+        else:
+            color2 = tuple((a + b) // 2 for a, b in zip(color0, color1)) + (255, )
+            color3 = (0, 0, 0, 0)
+        colors = (color0 + (255, ), color1 + (255, ), color2, color3)
+
+        for y in range(4):
+            for x in range(4):
+                imgx = (tile % tiles_x)*4 + x
+                imgy = (tile // tiles_x)*4 + y
+                if imgx < width and imgy < height:
+                    index = (tile_data[4 + y] >> (x*2)) & 0b11
+                    rgba[(imgx + imgy*width)*4:(imgx + imgy*width)*4 + 4] = bytes(colors[index])
+
+    return rgba
+
+
+@unittest.skipIf(numpy is None, "The decoders need NumPy")
+class DecodeImageTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(1234)
+
+    def assert_same_as_loops(self, texformat, palette=None):
+        for width, height in SIZES:
+            with self.subTest(texformat=texformat, width=width, height=height):
+                data = image_data(self.rng, texformat, width, height)
+
+                rgba = decode_image(data, texformat, width, height, palette)
+                self.assertEqual(len(rgba), width*height*4)
+                self.assertEqual(bytes(rgba), decode_with_loops(texformat, width, height, data, palette))
+
+    def test_i8(self):
+        self.assert_same_as_loops("I8")
+
+    def test_ia8(self):
+        self.assert_same_as_loops("IA8")
+
+    def test_rgba8(self):
+        self.assert_same_as_loops("A8R8G8B8")
+
+    def test_p8(self):
+        self.assert_same_as_loops("P8", bytes(self.rng.getrandbits(8) for i in range(512)))
+
+    def test_cmpr(self):
+        self.assert_same_as_loops("DXT1")
+
+    # The NumPy decoders of Texture give the same result as the loops
+    def test_texture_decoders(self):
+        palette = bytes(self.rng.getrandbits(8) for i in range(512))
+
+        for texformat in FORMATS:
+            for width, height in SIZES:
+                with self.subTest(texformat=texformat, width=width, height=height):
+                    data = image_data(self.rng, texformat, width, height)
+                    entry = texture_bw2(b"TEX", width, height, FORMATS[texformat][0], data,
+                                        palette=palette if texformat == "P8" else None)
+                    texture = Texture(b"TEX")
+                    texture.from_file(io.BytesIO(entry[8:]))
+
+                    self.assertEqual(texture.rgba, decode_with_loops(
+                        texformat, width, height, data, palette if texformat == "P8" else None))
+
+    def test_cmpr_to_s3tc(self):
+        for width, height in SIZES:
+            with self.subTest(width=width, height=height):
+                data = image_data(self.rng, "DXT1", width, height)
+                s3tc = cmpr_to_s3tc(data, width, height)
+
+                self.assertEqual(len(s3tc), _blocks(width, 4)*_blocks(height, 4)*8)
+                self.assertEqual(decode_s3tc(s3tc, width, height), decode_image(data, "DXT1", width, height))
+
+
+if __name__ == "__main__":
+    unittest.main()